@@ -9,6 +9,8 @@ from sqlmodel import Session, select
 from typing import Dict, Any
 
 from database import get_session, engine
+from config_registry import ConfigRegistry
+import engine_commands
 from models import (
     User, Stock, Portfolio, Transaction, Horse, Race, Bet,
     SlotSpin, EventLog, SystemConfig
@@ -57,19 +59,24 @@ DEFAULT_CONFIGS = {
         "category": "market"
     },
     "market.breakthrough_chance": {
-        "value": 0.02,
+        "value": 0.10,
         "description": "突破機率 (0-0.1)。每秒有此機率讓股票無視重力，自由飛行。",
         "category": "market"
     },
     "market.regime_change_interval": {
         "value": 120,
-        "description": "市場狀態變換間隔（秒）。每隔這段時間，市場有機會切換狀態（BOOM/CRASH/CHAOS/NORMAL）。",
+        "description": "市場狀態變換間隔（秒）。NORMAL 狀態至少維持這段時間，之後市場有機會切換狀態（BOOM/CRASH/CHAOS/NORMAL）。",
+        "category": "market"
+    },
+    "market.history_retention_hours": {
+        "value": 72,
+        "description": "5 秒 K 線保留時數。更舊的資料每日壓縮為 1 分鐘以上的 K 線後刪除。",
         "category": "market"
     },
     
     # === 賽馬參數 ===
     "race.bet_deadline_seconds": {
-        "value": 180,
+        "value": 20,
         "description": "下注截止時間（秒）。比賽開始前多久關閉下注。",
         "category": "race"
     },
@@ -79,29 +86,29 @@ DEFAULT_CONFIGS = {
         "category": "race"
     },
     "race.min_odds": {
-        "value": 1.2,
+        "value": 1.01,
         "description": "最低賠率。最強的馬的賠率下限。",
         "category": "race"
     },
     "race.max_odds": {
-        "value": 10.0,
-        "description": "最高賠率。最弱的馬的賠率上限。",
+        "value": 0.0,
+        "description": "最高賠率。最弱的馬的賠率上限，0 表示不設上限（預設，與原本的賠率計算相同）。",
         "category": "race"
     },
     "race.interval_seconds": {
-        "value": 300,
-        "description": "比賽間隔（秒）。一場比賽結束到下一場開始的時間。",
+        "value": 600,
+        "description": "比賽間隔（秒）。排定新比賽時，距離起跑的時間。",
         "category": "race"
     },
     
     # === 老虎機參數 ===
     "slots.base_rtp": {
-        "value": 0.92,
+        "value": 0.9225,
         "description": "基礎回報率 (0.5-1.0)。長期而言，玩家每投入 $100 平均可拿回的金額。0.92 表示 92%。",
         "category": "slots"
     },
     "slots.jackpot_multiplier": {
-        "value": 100,
+        "value": 150,
         "description": "頭獎倍率。三個 7️⃣ 的獎金倍率。",
         "category": "slots"
     },
@@ -111,8 +118,8 @@ DEFAULT_CONFIGS = {
         "category": "slots"
     },
     "slots.max_bet": {
-        "value": 1000,
-        "description": "最高下注金額。",
+        "value": 0,
+        "description": "最高下注金額，0 表示不設上限（預設，與原本的老虎機相同）。",
         "category": "slots"
     },
     
@@ -135,8 +142,14 @@ DEFAULT_CONFIGS = {
 }
 
 
+# 全域配置快取（啟動時載入，更新 / 重置時整份替換）
+config_registry = ConfigRegistry(DEFAULT_CONFIGS, lambda: Session(engine))
+
+
 def get_config_value(key: str, session: Session) -> Any:
     """取得配置值，如果不存在則返回預設值"""
+    if config_registry.loaded:
+        return config_registry.get(key)
     config = session.exec(select(SystemConfig).where(SystemConfig.key == key)).first()
     if config:
         return json.loads(config.value)
@@ -172,15 +185,17 @@ def set_config_value(key: str, value: Any, session: Session) -> bool:
 def get_all_configs(session: Session = Depends(get_session)):
     """取得所有系統配置和說明"""
     result = {}
+    if not config_registry.loaded:
+        config_registry.reload(session)
     
     for key, default in DEFAULT_CONFIGS.items():
-        config = session.exec(select(SystemConfig).where(SystemConfig.key == key)).first()
+        updated_at = config_registry.updated_at(key)
         result[key] = {
-            "value": json.loads(config.value) if config else default["value"],
+            "value": config_registry.get(key),
             "description": default["description"],
             "category": default["category"],
-            "is_default": config is None,
-            "updated_at": config.updated_at.isoformat() if config else None
+            "is_default": updated_at is None,
+            "updated_at": updated_at.isoformat() if updated_at else None
         }
     
     return result
@@ -195,8 +210,14 @@ def update_config(key: str, body: dict, session: Session = Depends(get_session))
     value = body.get("value")
     if value is None:
         return {"status": "error", "message": "缺少 value 欄位"}
+    try:
+        value = config_registry.coerce(key, value)
+    except (ValueError, TypeError) as e:
+        return {"status": "error", "message": f"數值格式錯誤: {e}"}
     
     set_config_value(key, value, session)
+    config_registry.reload(session)
+    config_registry.notify()
     return {
         "status": "success",
         "message": f"已更新 {key}",
@@ -212,6 +233,8 @@ def reset_configs(session: Session = Depends(get_session)):
     for c in configs:
         session.delete(c)
     session.commit()
+    config_registry.reload(session)
+    config_registry.notify()
     return {"status": "success", "message": "已重置所有配置為預設值"}
 
 
@@ -478,6 +501,9 @@ def create_event(body: dict, session: Session = Depends(get_session)):
     )
     session.add(event)
     session.commit()
+
+    # 同步登記到行情引擎的事件索引（由主節點套用），下一個 tick 即生效
+    engine_commands.get().record_event(event)
     
     return {
         "status": "success",
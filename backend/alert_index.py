@@ -0,0 +1,91 @@
+"""
+到價提醒索引
+每檔股票維護兩個排序好的門檻：above 由低到高、below 由高到低（以負值遞增儲存），
+價格更新後只從前端彈出已被越過的提醒，不需要掃描 Alert 資料表。
+"""
+import bisect
+import threading
+import time
+
+from sqlmodel import select
+from models import Alert
+
+REBUILD_SECONDS = 60  # 定期重建，補上主節點換手期間遺失的變更
+
+
+class AlertIndex:
+    def __init__(self, rebuild_seconds=REBUILD_SECONDS):
+        self.rebuild_seconds = rebuild_seconds
+        self._above = {}  # {stock_id: [(target_price, alert_id)]}
+        self._below = {}  # {stock_id: [(-target_price, alert_id)]}
+        self._alerts = {}  # {alert_id: (user_id, stock_id, target_price, condition)}
+        self._rebuilt_at = None
+        self._lock = threading.Lock()  # API 執行緒新增 / 刪除，tick 執行緒彈出
+
+    def __len__(self):
+        return len(self._alerts)
+
+    def rebuild(self, session):
+        alerts = session.exec(select(Alert).where(Alert.is_triggered == False)).all()
+        with self._lock:
+            self._above = {}
+            self._below = {}
+            self._alerts = {}
+            for alert in alerts:
+                self._insert(alert.id, alert.user_id, alert.stock_id, alert.target_price, alert.condition)
+            self._rebuilt_at = time.monotonic()
+        return len(alerts)
+
+    def needs_rebuild(self):
+        return self._rebuilt_at is None or time.monotonic() - self._rebuilt_at >= self.rebuild_seconds
+
+    def add(self, alert):
+        with self._lock:
+            self._remove(alert.id)
+            if not alert.is_triggered:
+                self._insert(alert.id, alert.user_id, alert.stock_id, alert.target_price, alert.condition)
+
+    def remove(self, alert_id):
+        with self._lock:
+            self._remove(alert_id)
+
+    def pop_crossed(self, prices):
+        """彈出價格已達到門檻的提醒：[(alert_id, user_id, stock_id, target_price, condition)]"""
+        crossed = []
+        with self._lock:
+            for side, sign in ((self._above, 1), (self._below, -1)):
+                for stock_id in list(side):
+                    price = prices.get(stock_id)
+                    if price is None:
+                        continue
+                    entries = side[stock_id]
+                    end = bisect.bisect_right(entries, (sign * price, float("inf")))
+                    if not end:
+                        continue
+                    for _, alert_id in entries[:end]:
+                        user_id, _, target_price, condition = self._alerts.pop(alert_id)
+                        crossed.append((alert_id, user_id, stock_id, target_price, condition))
+                    del entries[:end]
+                    if not entries:
+                        del side[stock_id]
+        return crossed
+
+    def _insert(self, alert_id, user_id, stock_id, target_price, condition):
+        if condition == "above":
+            bisect.insort(self._above.setdefault(stock_id, []), (target_price, alert_id))
+        elif condition == "below":
+            bisect.insort(self._below.setdefault(stock_id, []), (-target_price, alert_id))
+        else:
+            return
+        self._alerts[alert_id] = (user_id, stock_id, target_price, condition)
+
+    def _remove(self, alert_id):
+        meta = self._alerts.pop(alert_id, None)
+        if meta is None:
+            return
+        _, stock_id, target_price, condition = meta
+        side, key = (self._above, target_price) if condition == "above" else (self._below, -target_price)
+        entries = side[stock_id]
+        entries.pop(bisect.bisect_left(entries, (key, alert_id)))
+        if not entries:
+            del side[stock_id]
@@ -1,13 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Response, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlmodel import Session, select, or_
 from datetime import timedelta, datetime
 from typing import List
+import base64
 import json
 import random
 
 from database import get_session, engine
-from models import User, Portfolio, Stock, BonusLog, StockPriceHistory, Transaction, Watchlist, Horse, Race, Bet, Friendship, UserDailySnapshot, SlotSpin, LeaderboardSnapshot
+from models import User, Portfolio, Stock, Alert, BonusLog, StockCandle, Transaction, Watchlist, Horse, Race, Bet, Friendship, UserDailySnapshot, SlotSpin, LeaderboardSnapshot
 from auth import (
     ACCESS_TOKEN_EXPIRE_MINUTES,
     create_access_token,
@@ -20,6 +21,10 @@ from events import EventSystem
 from race_engine import RaceEngine
 from slots_engine import SlotsEngine
 from redis_utils import get_redis
+from candle_rollup import RESOLUTIONS
+import history_archive
+import history_codec
+import engine_commands
 
 router = APIRouter()
 
@@ -95,26 +100,18 @@ def get_portfolio(current_user: User = Depends(get_current_user), session: Sessi
 
 @router.post("/trade/buy")
 async def buy_stock(stock_id: int, quantity: int, current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
-    # 直接從 MarketEngine 內存取得最新價格（避免 Redis 延遲或 DB 舊數據）
-    from main import market_engine
-    live_price = None
-    for stock in market_engine.active_stocks:
-        if stock.id == stock_id:
-            live_price = stock.price
-            break
+    # 直接從最新市場快照取得價格（避免 Redis 延遲或 DB 舊數據）
+    from main import market_snapshots
+    live_price = market_snapshots.price(stock_id)
 
     trader = Trader(session)
     return trader.buy_stock(current_user, stock_id, quantity, live_price=live_price)
 
 @router.post("/trade/sell")
 async def sell_stock(stock_id: int, quantity: int, current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
-    # 直接從 MarketEngine 內存取得最新價格
-    from main import market_engine
-    live_price = None
-    for stock in market_engine.active_stocks:
-        if stock.id == stock_id:
-            live_price = stock.price
-            break
+    # 直接從最新市場快照取得價格
+    from main import market_snapshots
+    live_price = market_snapshots.price(stock_id)
 
     trader = Trader(session)
     return trader.sell_stock(current_user, stock_id, quantity, live_price=live_price)
@@ -122,13 +119,9 @@ async def sell_stock(stock_id: int, quantity: int, current_user: User = Depends(
 @router.post("/trade/short")
 async def short_stock(stock_id: int, quantity: int, current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
     """做空股票 API"""
-    # 直接從 MarketEngine 內存取得最新價格
-    from main import market_engine
-    live_price = None
-    for stock in market_engine.active_stocks:
-        if stock.id == stock_id:
-            live_price = stock.price
-            break
+    # 直接從最新市場快照取得價格
+    from main import market_snapshots
+    live_price = market_snapshots.price(stock_id)
 
     trader = Trader(session)
     return trader.short_stock(current_user, stock_id, quantity, live_price=live_price)
@@ -136,13 +129,9 @@ async def short_stock(stock_id: int, quantity: int, current_user: User = Depends
 @router.post("/trade/cover")
 async def cover_short(stock_id: int, quantity: int, current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
     """回補空單 API"""
-    # 直接從 MarketEngine 內存取得最新價格
-    from main import market_engine
-    live_price = None
-    for stock in market_engine.active_stocks:
-        if stock.id == stock_id:
-            live_price = stock.price
-            break
+    # 直接從最新市場快照取得價格
+    from main import market_snapshots
+    live_price = market_snapshots.price(stock_id)
 
     trader = Trader(session)
     return trader.cover_short(current_user, stock_id, quantity, live_price=live_price)
@@ -203,7 +192,13 @@ def get_leaderboard(session: Session = Depends(get_session)):
 @router.get("/stocks")
 @router.get("/stocks")
 async def get_stocks(session: Session = Depends(get_session)):
-    # Try Redis first (Real-time state)
+    # In-process snapshot first (no I/O)
+    from main import market_snapshots
+    snapshot = market_snapshots.current
+    if snapshot:
+        return snapshot.stocks_data()
+
+    # Then Redis (Real-time state)
     from redis_utils import get_redis
     redis = await get_redis()
     if redis:
@@ -217,138 +212,144 @@ async def get_stocks(session: Session = Depends(get_session)):
     # Fallback to DB (might be 60s old)
     return session.exec(select(Stock)).all()
 
-def resample_candles(candles: List[StockPriceHistory], interval_minutes: int) -> List[dict]:
-    if not candles:
-        return []
-    
-    # Sort by time just in case
-    candles.sort(key=lambda c: c.timestamp)
-    
-    resampled = []
-    current_bucket_start = None
-    current_bucket_data = {
-        "open": 0, "high": -float('inf'), "low": float('inf'), "close": 0, "volume": 0
-    }
-    
-    # 5-second buckets to N-minute buckets
-    for candle in candles:
-        # Calculate bucket start time
-        # truncate timestamp to interval
-        ts = candle.timestamp
-        # total minutes from epoch often easier, or just simple truncation if aligned
-        # For simplicity, we align to minute boundaries 00:00
-        # If interval is 5m, we want 00, 05, 10
-        minute_bucket = (ts.minute // interval_minutes) * interval_minutes
-        bucket_time = ts.replace(minute=minute_bucket, second=0, microsecond=0)
-        
-        if interval_minutes >= 60:
-             # Handle Hour logic roughly if needed, but for now specific minutes
-             # If interval is 60 (1h), truncated to hour
-            hour_bucket = (ts.hour // (interval_minutes // 60)) * (interval_minutes // 60)
-            bucket_time = ts.replace(hour=hour_bucket, minute=0, second=0, microsecond=0)
-
-        if current_bucket_start is None:
-            current_bucket_start = bucket_time
-            current_bucket_data["open"] = candle.open
-        
-        if bucket_time != current_bucket_start:
-            # Commit previous bucket
-            resampled.append({
-                "time": current_bucket_start, # Frontend will handle timezone or keep as is
-                "open": current_bucket_data["open"],
-                "high": current_bucket_data["high"],
-                "low": current_bucket_data["low"],
-                "close": current_bucket_data["close"],
-                "volume": current_bucket_data["volume"]
-            })
-            # Start new
-            current_bucket_start = bucket_time
-            current_bucket_data = {
-                "open": candle.open, 
-                "high": -float('inf'), 
-                "low": float('inf'), 
-                "close": 0, 
-                "volume": 0
-            }
-        
-        # Aggregate
-        current_bucket_data["high"] = max(current_bucket_data["high"], candle.high)
-        current_bucket_data["low"] = min(current_bucket_data["low"], candle.low)
-        current_bucket_data["close"] = candle.close
-        current_bucket_data["volume"] += candle.volume
-
-    # Commit last bucket
-    if current_bucket_start:
-        resampled.append({
-            "time": current_bucket_start,
-            "open": current_bucket_data["open"],
-            "high": current_bucket_data["high"],
-            "low": current_bucket_data["low"],
-            "close": current_bucket_data["close"],
-            "volume": current_bucket_data["volume"]
-        })
+# lightweight-charts 以 UTC 顯示時間軸，把本地牆上時間直接當作 UTC 秒數送出，
+# 圖表就會顯示伺服器當地時間（取代寫死的 +28800，任何時區 / 夏令時間都正確）
+CHART_EPOCH = datetime(1970, 1, 1)
 
-    return resampled
 
-@router.get("/stocks/{stock_id}/history")
-def get_stock_history(stock_id: int, interval: str = "1m", limit: int = 5000, before: int = None, session: Session = Depends(get_session)):
-    # interval: 1m, 5m, 15m, 1h, 1d
-    # before: unix timestamp (optional) for pagination
-    
-    # Determine how much data to fetch
-    # Limit to last N records (Optimized for speed)
-    query = select(StockPriceHistory).where(StockPriceHistory.stock_id == stock_id)
-    
-    if before:
-        # Client sends unix timestamp which INCLUDES the +28800 offset we added for display.
-        # We must subtract it to match the DB's Naive timestamp (which acts as UTC locally).
-        adjusted_before = before - 28800
-        before_dt = datetime.fromtimestamp(adjusted_before)
-        query = query.where(StockPriceHistory.timestamp < before_dt)
+def to_chart_time(ts: datetime) -> int:
+    return int((ts - CHART_EPOCH).total_seconds())
+
+
+def from_chart_time(seconds: int) -> datetime:
+    return CHART_EPOCH + timedelta(seconds=seconds)
+
+
+def encode_history_cursor(resolution: str, ts: datetime) -> str:
+    """分頁游標：下一頁從這根 K 線之前開始（內容對前端不透明）"""
+    raw = f"{resolution}:{to_chart_time(ts)}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_history_cursor(cursor: str):
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    resolution, seconds = raw.split(":")
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"unknown resolution {resolution}")
+    return resolution, from_chart_time(int(seconds))
+
+
+def load_stock_history(session, stock_id, resolution, before_dt, limit, live=True):
+    """查詢一頁 K 線（DB + 記憶體 + 封存檔），time 為 datetime，依時間排序
+    live=False 時只讀 DB（非主節點的引擎不 tick，記憶體中的 K 線不是最新的）"""
+    # 往前翻頁超過 DB 保留範圍：直接讀封存檔（numpy memmap），不查資料庫
+    archived_until = history_archive.watermark(stock_id, resolution) if before_dt else None
+    if archived_until is not None and before_dt.timestamp() <= archived_until:
+        return history_archive.read_before(stock_id, resolution, before_dt.timestamp(), limit)
+
+    # (stock_id, resolution, timestamp) 唯一索引：seek 到 before_dt 後往回讀 limit 筆
+    query = select(StockCandle).where(
+        StockCandle.stock_id == stock_id,
+        StockCandle.resolution == resolution
+    )
+    if before_dt:
+        query = query.where(StockCandle.timestamp < before_dt)
         
-    statement = query.order_by(StockPriceHistory.timestamp.desc()).limit(limit) 
-    
-    # Fetch descending (latest first), then reverse for processing
-    raw_history = session.exec(statement).all()
-    raw_history = list(reversed(raw_history))
+    statement = query.order_by(StockCandle.timestamp.desc()).limit(limit)
     
-    if not raw_history:
-        return []
-
-    interval_map = {
-        "1m": 1,
-        "5m": 5,
-        "15m": 15,
-        "1h": 60,
-        "4h": 240,
-        "1d": 1440
+    # Fetch descending (latest first), then reverse
+    candles = {
+        c.timestamp: {"time": c.timestamp, "open": c.open, "high": c.high, "low": c.low, "close": c.close, "volume": c.volume}
+        for c in reversed(session.exec(statement).all())
     }
     
-    minutes = interval_map.get(interval, 1)
+    # 最新一頁：併入尚未寫入 DB 的 K 線與進行中的區間（記憶體版本較新）
+    if not before_dt and live:
+        from main import market_engine
+        for c in market_engine.history_candles(stock_id, resolution):
+            candles[c["time"]] = c
     
-    if minutes == 1:
-        # If 1m, maybe we just return raw 5-sec candles or actually 1m?
-        # User asked for timeframes. Since our raw data is 5-sec (per task change previously)
-        # We should aggregate 5-sec to 1-min for "1m" view.
-        # Or if "raw" is requested, return 5sec.
-        # Let's default "1m" to aggregating 5sec -> 1min
-        pass
+    data = sorted(candles.values(), key=lambda d: d["time"])[-limit:]
     
-    data = resample_candles(raw_history, minutes)
+    # DB 的資料不足一頁：剩下的由封存檔補上
+    if before_dt and archived_until is not None and len(data) < limit:
+        older_than = data[0]["time"].timestamp() if data else before_dt.timestamp()
+        data = history_archive.read_before(stock_id, resolution, older_than, limit - len(data)) + data
+    return data
+
+
+@router.get("/stocks/{stock_id}/history")
+def get_stock_history(stock_id: int, interval: str = "1m", limit: int = 5000, before: int = None, cursor: str = None, format: str = "json", accept: str = Header(None), if_none_match: str = Header(None), session: Session = Depends(get_session)):
+    # interval: 1m, 5m, 15m, 1h, 4h, 1d（各週期由引擎即時累加，存於 StockCandle）
+    # cursor: 上一頁回應標頭 X-Next-Cursor 的值（keyset 分頁，每一頁成本相同）
+    # before: 舊版分頁參數（圖表時間），仍然支援
+    # format=columnar: 精簡欄式格式（見 history_codec），Accept: application/msgpack 則回傳二進位
+    resolution = interval if interval in RESOLUTIONS else "1m"
+    if history_codec.wants_msgpack(accept):
+        wire = "msgpack"
+    else:
+        wire = "columnar" if format == "columnar" else "json"
     
-    # Format for lightweight-charts: time (unix timestamp), open, high, low, close
-    # Lightweight charts expects seconds timestamp
-    return [
-        {
-            "time": int(d["time"].timestamp()) + 28800, # Shift for Visual Display (UTC axis -> Local Time)
-            "open": d["open"],
-            "high": d["high"],
-            "low": d["low"],
-            "close": d["close"],
-            "volume": d["volume"]
-        }
-        for d in data
-    ]
+    before_dt = None
+    if cursor:
+        try:
+            resolution, before_dt = decode_history_cursor(cursor)
+        except (ValueError, UnicodeDecodeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    elif before:
+        before_dt = from_chart_time(before)
+    
+    # 最新一頁的鍵帶版本號（每收一根 5 秒 K 線就換新），較舊的頁面只靠 TTL 過期
+    # 非主節點的引擎不 tick：版本改用所有副本都收得到的 tick 串流序號，且只讀 DB
+    from main import market_engine, manager, is_leader
+    cache = market_engine.history_cache
+    live = is_leader()
+    if before_dt:
+        version = None
+    elif live:
+        version = cache.version(stock_id)
+    else:
+        version = ("stream", manager.stream.seq)
+    key = (stock_id, resolution, before_dt, limit, version, wire)
+    
+    cached = cache.get(key)
+    if cached is None:
+        data = load_stock_history(session, stock_id, resolution, before_dt, limit, live=live)
+        
+        # 滿一頁才可能還有更舊的資料
+        next_cursor = None
+        if data and len(data) >= limit:
+            next_cursor = encode_history_cursor(resolution, data[0]["time"])
+        
+        # Format for lightweight-charts: time (seconds), open, high, low, close
+        points = [
+            {
+                "time": to_chart_time(d["time"]),
+                "open": d["open"],
+                "high": d["high"],
+                "low": d["low"],
+                "close": d["close"],
+                "volume": d["volume"]
+            }
+            for d in data
+        ]
+        if wire == "msgpack":
+            body = history_codec.pack(history_codec.encode_columnar(points))
+        elif wire == "columnar":
+            body = json.dumps(history_codec.encode_columnar(points), separators=(",", ":")).encode()
+        else:
+            body = json.dumps(points).encode()
+        etag = cache.put(key, body, next_cursor)
+    else:
+        etag, body, next_cursor = cached
+    
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept"}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    media_type = history_codec.MSGPACK_MEDIA_TYPE if wire == "msgpack" else "application/json"
+    return Response(content=body, media_type=media_type, headers=headers)
 
 @router.get("/transactions", response_model=List[dict])
 def get_transactions(current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
@@ -409,6 +410,73 @@ def remove_watchlist(stock_id: int, current_user: User = Depends(get_current_use
     session.commit()
     return {"message": "Removed from watchlist"}
 
+# --- Price Alert Endpoints ---
+
+def _alert_dict(alert: Alert):
+    return {
+        "id": alert.id,
+        "stock_id": alert.stock_id,
+        "target_price": alert.target_price,
+        "condition": alert.condition,
+        "is_triggered": alert.is_triggered
+    }
+
+@router.get("/alerts")
+def get_alerts(current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
+    alerts = session.exec(select(Alert).where(Alert.user_id == current_user.id).order_by(Alert.id.desc())).all()
+    return [_alert_dict(a) for a in alerts]
+
+@router.post("/alerts")
+def create_alert(stock_id: int, target_price: float, condition: str, current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
+    if condition not in ("above", "below"):
+        raise HTTPException(status_code=400, detail="condition must be 'above' or 'below'")
+    if target_price <= 0:
+        raise HTTPException(status_code=400, detail="target_price must be positive")
+    if not session.get(Stock, stock_id):
+        raise HTTPException(status_code=404, detail="Stock not found")
+
+    alert = Alert(user_id=current_user.id, stock_id=stock_id, target_price=target_price, condition=condition)
+    session.add(alert)
+    session.commit()
+    session.refresh(alert)
+
+    # 立即登記到引擎的提醒索引（由主節點套用），下一個 tick 就會檢查
+    engine_commands.get().add_alert(alert)
+    return _alert_dict(alert)
+
+@router.put("/alerts/{alert_id}")
+def update_alert(alert_id: int, target_price: float = None, condition: str = None, current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
+    """修改門檻並重新啟用提醒"""
+    alert = session.get(Alert, alert_id)
+    if not alert or alert.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Alert not found")
+    if condition is not None:
+        if condition not in ("above", "below"):
+            raise HTTPException(status_code=400, detail="condition must be 'above' or 'below'")
+        alert.condition = condition
+    if target_price is not None:
+        if target_price <= 0:
+            raise HTTPException(status_code=400, detail="target_price must be positive")
+        alert.target_price = target_price
+    alert.is_triggered = False
+    session.add(alert)
+    session.commit()
+    session.refresh(alert)
+
+    engine_commands.get().add_alert(alert)
+    return _alert_dict(alert)
+
+@router.delete("/alerts/{alert_id}")
+def delete_alert(alert_id: int, current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
+    alert = session.get(Alert, alert_id)
+    if not alert or alert.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Alert not found")
+    session.delete(alert)
+    session.commit()
+
+    engine_commands.get().remove_alert(alert_id)
+    return {"message": "Alert deleted"}
+
 # --- Race Betting Endpoints ---
 
 @router.get("/race/next")
@@ -32,6 +32,16 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def user_id_from_token(token: str, session: Session) -> Optional[int]:
+    """驗證 JWT 並回傳 user id，無效時回傳 None（WebSocket 連線驗證用，瀏覽器無法帶 Authorization header）"""
+    try:
+        username = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except JWTError:
+        return None
+    if username is None:
+        return None
+    return session.exec(select(User.id).where(User.username == username)).first()
+
 async def get_current_user(token: str = Depends(oauth2_scheme), session: Session = Depends(get_session)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -0,0 +1,66 @@
+"""
+批次寫入
+persist_state 每 60 秒把記憶體狀態寫回 DB：股價以單一多列 UPDATE 更新，
+5 秒 K 線以 Core 批次 INSERT 寫入（Postgres 使用 COPY），不建立 ORM 物件、不逐筆 SELECT。
+"""
+import csv
+import io
+
+from sqlalchemy import bindparam, insert, update
+
+from models import Stock, StockPriceHistory
+
+HISTORY_COLUMNS = ("stock_id", "timestamp", "open", "high", "low", "close", "volume")
+
+
+def _is_postgres(session):
+    return session.get_bind().dialect.name == "postgresql"
+
+
+def bulk_update_stocks(session, rows):
+    """rows: [(id, price, day_open)]，只更新行情欄位（名稱、波動度等由管理後台維護）"""
+    if not rows:
+        return 0
+    if _is_postgres(session):
+        # UPDATE ... FROM (VALUES ...)：一個語句更新所有股票
+        from psycopg2.extras import execute_values
+        cursor = session.connection().connection.cursor()
+        execute_values(
+            cursor,
+            "UPDATE stock SET price = v.price, day_open = v.day_open "
+            "FROM (VALUES %s) AS v(id, price, day_open) WHERE stock.id = v.id",
+            rows,
+            template="(%s, %s::double precision, %s::double precision)",
+            page_size=len(rows)
+        )
+        return len(rows)
+
+    table = Stock.__table__
+    session.execute(
+        update(table)
+        .where(table.c.id == bindparam("b_id"))
+        .values(price=bindparam("b_price"), day_open=bindparam("b_day_open")),
+        [{"b_id": i, "b_price": price, "b_day_open": day_open} for i, price, day_open in rows]
+    )
+    return len(rows)
+
+
+def bulk_insert_history(session, rows):
+    """rows: [(stock_id, timestamp, open, high, low, close, volume)]"""
+    if not rows:
+        return 0
+    if _is_postgres(session):
+        buf = io.StringIO()
+        csv.writer(buf).writerows(rows)
+        buf.seek(0)
+        cursor = session.connection().connection.cursor()
+        cursor.copy_expert(
+            f"COPY stockpricehistory ({', '.join(HISTORY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buf
+        )
+        return len(rows)
+
+    session.execute(
+        insert(StockPriceHistory.__table__),
+        [dict(zip(HISTORY_COLUMNS, row)) for row in rows]
+    )
+    return len(rows)
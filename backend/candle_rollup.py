@@ -0,0 +1,218 @@
+"""
+多週期 K 線累加
+每根 5 秒 K 線收盤時依序併入 1m/5m/15m/1h/4h/1d 的未收盤區間，
+區間結束時產生 StockCandle，由 persist_state 連同未收盤區間一起寫入 DB，
+歷史 API 只需要對 StockCandle 做一次索引範圍查詢。
+"""
+import threading
+from datetime import timedelta
+from sqlmodel import select
+from models import StockCandle, StockPriceHistory
+
+# {resolution: 秒數}
+RESOLUTIONS = {
+    "1m": 60,
+    "5m": 300,
+    "15m": 900,
+    "1h": 3600,
+    "4h": 14400,
+    "1d": 86400
+}
+
+
+def bucket_start(ts, seconds):
+    """區間起點：自當日 00:00 起對齊（4h → 0/4/8…點，1d → 00:00）"""
+    midnight = ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    offset = int((ts - midnight).total_seconds()) // seconds * seconds
+    return midnight + timedelta(seconds=offset)
+
+
+def _to_row(stock_id, resolution, candle):
+    return StockCandle(
+        stock_id=stock_id,
+        resolution=resolution,
+        timestamp=candle["start_time"],
+        open=candle["open"],
+        high=candle["high"],
+        low=candle["low"],
+        close=candle["close"],
+        volume=candle["volume"]
+    )
+
+
+def _to_point(candle):
+    return {
+        "time": candle["start_time"],
+        "open": candle["open"],
+        "high": candle["high"],
+        "low": candle["low"],
+        "close": candle["close"],
+        "volume": candle["volume"]
+    }
+
+
+class CandleRollup:
+    def __init__(self):
+        self.open_buckets = {}  # {stock_id: {resolution: {start_time, open, high, low, close, volume}}}
+        self.pending = []  # 已收盤、尚未寫入 DB 的 StockCandle
+        self._lock = threading.Lock()  # tick 執行緒併入，寫入執行緒取出
+
+    def add(self, stock_id, candle):
+        """併入一根已收盤的 5 秒 K 線"""
+        with self._lock:
+            self._add(stock_id, candle)
+
+    def _add(self, stock_id, candle):
+        buckets = self.open_buckets.setdefault(stock_id, {})
+        for resolution, seconds in RESOLUTIONS.items():
+            start = bucket_start(candle["start_time"], seconds)
+            current = buckets.get(resolution)
+            if current is not None and current["start_time"] == start:
+                current["high"] = max(current["high"], candle["high"])
+                current["low"] = min(current["low"], candle["low"])
+                current["close"] = candle["close"]
+                current["volume"] += candle["volume"]
+                continue
+            if current is not None:
+                self.pending.append(_to_row(stock_id, resolution, current))
+            buckets[resolution] = {
+                "start_time": start,
+                "open": candle["open"],
+                "high": candle["high"],
+                "low": candle["low"],
+                "close": candle["close"],
+                "volume": candle["volume"]
+            }
+
+    def snapshot(self, stock_id, resolution, live=None):
+        """尚未寫入 DB 的 K 線 + 未收盤區間（可併入進行中的 5 秒 K 線 live），依時間排序"""
+        with self._lock:
+            pending = list(self.pending)
+            current = self.open_buckets.get(stock_id, {}).get(resolution)
+            if current is not None:
+                current = dict(current)
+        points = [
+            {
+                "time": row.timestamp, "open": row.open, "high": row.high,
+                "low": row.low, "close": row.close, "volume": row.volume
+            }
+            for row in pending
+            if row.stock_id == stock_id and row.resolution == resolution
+        ]
+        if current is not None:
+            if live and bucket_start(live["start_time"], RESOLUTIONS[resolution]) == current["start_time"]:
+                current["high"] = max(current["high"], live["high"])
+                current["low"] = min(current["low"], live["low"])
+                current["close"] = live["close"]
+                current["volume"] += live["volume"]
+            points.append(_to_point(current))
+        elif live:
+            start = bucket_start(live["start_time"], RESOLUTIONS[resolution])
+            points.append(_to_point(dict(live, start_time=start)))
+        return points
+
+    def take(self):
+        """取出已收盤 K 線並複製未收盤區間：回傳 (closed, open_rows)；寫入失敗時以 rollback(closed) 放回"""
+        with self._lock:
+            closed, self.pending = self.pending, []
+            open_rows = [
+                _to_row(stock_id, resolution, candle)
+                for stock_id, buckets in self.open_buckets.items()
+                for resolution, candle in buckets.items()
+            ]
+        return closed, open_rows
+
+    def rollback(self, closed):
+        """寫入失敗：取出的已收盤 K 線放回（排在之後收盤的前面），下一次 flush 重寫"""
+        with self._lock:
+            self.pending = closed + self.pending
+
+    def persist(self, session, upsert=True):
+        """寫入已收盤 K 線並 upsert 未收盤區間，回傳筆數（由呼叫端 commit，失敗時不會放回；見 take / write）"""
+        closed, open_rows = self.take()
+        return self.write(session, closed + open_rows, upsert)
+
+    def write(self, session, rows, upsert=True):
+        """寫入 take() 取出的 K 線（同一區間每次 flush 覆寫），回傳筆數"""
+        if not rows:
+            return 0
+        if not upsert:
+            session.add_all(rows)
+            return len(rows)
+
+        by_resolution = {}
+        for row in rows:
+            by_resolution.setdefault(row.resolution, {})[(row.stock_id, row.timestamp)] = row
+        for resolution, items in by_resolution.items():
+            timestamps = {ts for _, ts in items}
+            existing = session.exec(select(StockCandle).where(
+                StockCandle.resolution == resolution,
+                StockCandle.timestamp.in_(timestamps)
+            )).all()
+            for db_row in existing:
+                row = items.pop((db_row.stock_id, db_row.timestamp), None)
+                if row is None:
+                    continue
+                db_row.open = row.open
+                db_row.high = row.high
+                db_row.low = row.low
+                db_row.close = row.close
+                db_row.volume = row.volume
+                session.add(db_row)
+            session.add_all(items.values())
+        return len(rows)
+
+    def restore(self, session, now):
+        """重啟時從 DB 載回目前仍未收盤的區間，之後的 5 秒 K 線繼續累加"""
+        count = 0
+        for resolution, seconds in RESOLUTIONS.items():
+            rows = session.exec(select(StockCandle).where(
+                StockCandle.resolution == resolution,
+                StockCandle.timestamp == bucket_start(now, seconds)
+            )).all()
+            for row in rows:
+                self.open_buckets.setdefault(row.stock_id, {})[resolution] = {
+                    "start_time": row.timestamp,
+                    "open": row.open,
+                    "high": row.high,
+                    "low": row.low,
+                    "close": row.close,
+                    "volume": row.volume
+                }
+                count += 1
+        return count
+
+
+def backfill_rollups(session_factory, batch_size=5000):
+    """由既有的 5 秒 K 線補建 StockCandle（只處理還沒有任何多週期 K 線的股票）"""
+    total = 0
+    with session_factory() as session:
+        stock_ids = session.exec(select(StockPriceHistory.stock_id).distinct()).all()
+        done = set(session.exec(select(StockCandle.stock_id).distinct()).all())
+        for stock_id in stock_ids:
+            if stock_id in done:
+                continue
+            rollup = CandleRollup()
+            count = 0
+            # 只取欄位（不建立 ORM 物件），分批串流讀取
+            rows = session.exec(
+                select(
+                    StockPriceHistory.timestamp, StockPriceHistory.open, StockPriceHistory.high,
+                    StockPriceHistory.low, StockPriceHistory.close, StockPriceHistory.volume
+                )
+                .where(StockPriceHistory.stock_id == stock_id)
+                .order_by(StockPriceHistory.timestamp)
+                .execution_options(yield_per=batch_size)
+            )
+            for timestamp, open_, high, low, close, volume in rows:
+                rollup.add(stock_id, {
+                    "start_time": timestamp, "open": open_, "high": high,
+                    "low": low, "close": close, "volume": volume
+                })
+                count += 1
+            written = rollup.persist(session, upsert=False)
+            session.commit()
+            session.expunge_all()
+            total += written
+            print(f"[Candles] Backfilled stock {stock_id}: {count} raw candles -> {written} rollups")
+    return total
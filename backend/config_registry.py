@@ -0,0 +1,148 @@
+"""
+系統配置快取
+啟動時一次載入所有 SystemConfig，之後 tick 路徑直接讀取記憶體中的唯讀 mapping（不查 DB）。
+後台更新 / 重置時整份重建後一次替換參考，並透過 Redis pub/sub 通知其他副本重新載入。
+"""
+import asyncio
+import json
+import threading
+import uuid
+from types import MappingProxyType
+
+from sqlmodel import select
+from models import SystemConfig
+
+CONFIG_CHANNEL = "config_updates"
+
+
+class ConfigRegistry:
+    def __init__(self, defaults, session_factory):
+        self.defaults = defaults  # DEFAULT_CONFIGS: {key: {"value", "description", "category"}}
+        self.session_factory = session_factory
+        self.instance_id = uuid.uuid4().hex  # 忽略自己發出的通知
+        self.version = 0
+        self.loaded = False
+        self._values = MappingProxyType({key: d["value"] for key, d in defaults.items()})
+        self._updated_at = MappingProxyType({})
+        self._sections = {}
+        self._subscribers = []
+        self._lock = threading.Lock()  # 序列化重新載入；讀取端不需要鎖
+        self._loop = None
+        self._redis = None
+
+    @property
+    def values(self):
+        """目前所有配置 {key: value}（唯讀）"""
+        return self._values
+
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+
+    def updated_at(self, key):
+        """DB 中的更新時間，使用預設值時為 None"""
+        return self._updated_at.get(key)
+
+    def section(self, prefix):
+        """取得某一類配置並去掉前綴，例如 section("market") → {"gravity_strength": 0.01, ...}"""
+        sections = self._sections
+        cached = sections.get(prefix)
+        if cached is None:
+            head = prefix + "."
+            cached = MappingProxyType({
+                key[len(head):]: value for key, value in self._values.items() if key.startswith(head)
+            })
+            sections[prefix] = cached
+        return cached
+
+    def coerce(self, key, value):
+        """依預設值的型別轉換（int / float / bool），無法轉換時拋出 ValueError"""
+        default = self.defaults[key]["value"]
+        if isinstance(default, bool):
+            if isinstance(value, bool):
+                return value
+            raise ValueError(f"{key} 需要布林值")
+        if isinstance(default, int):
+            number = float(value)
+            if not number.is_integer():
+                raise ValueError(f"{key} 需要整數")
+            return int(number)
+        if isinstance(default, float):
+            return float(value)
+        return value
+
+    def subscribe(self, callback):
+        """註冊 callback(registry)，每次重新載入後呼叫（在重新載入的執行緒上）"""
+        self._subscribers.append(callback)
+        callback(self)
+
+    def reload(self, session=None):
+        """從 DB 讀取所有配置並整份替換"""
+        if session is None:
+            with self.session_factory() as own_session:
+                return self.reload(own_session)
+
+        rows = session.exec(select(SystemConfig)).all()
+        values = {key: d["value"] for key, d in self.defaults.items()}
+        updated_at = {}
+        for row in rows:
+            if row.key not in self.defaults:
+                continue
+            try:
+                values[row.key] = self.coerce(row.key, json.loads(row.value))
+                updated_at[row.key] = row.updated_at
+            except (ValueError, TypeError) as e:
+                print(f"[Config] Ignoring invalid value for {row.key}: {e}")
+
+        with self._lock:
+            self._values = MappingProxyType(values)
+            self._updated_at = MappingProxyType(updated_at)
+            self._sections = {}
+            self.version += 1
+            self.loaded = True
+            subscribers = list(self._subscribers)
+
+        for callback in subscribers:
+            try:
+                callback(self)
+            except Exception as e:
+                print(f"[Config] Subscriber error: {e}")
+        return self.version
+
+    # ==================== 跨副本同步 ====================
+
+    def attach(self, loop, redis_client):
+        """在 lifespan 中呼叫：之後 notify() 會從任何執行緒發佈到 Redis"""
+        self._loop = loop
+        self._redis = redis_client
+
+    def notify(self):
+        """通知其他副本重新載入（無 Redis 時不做事）"""
+        if not self._loop or not self._redis:
+            return
+        message = json.dumps({"origin": self.instance_id, "version": self.version})
+        try:
+            asyncio.run_coroutine_threadsafe(self._redis.publish(CONFIG_CHANNEL, message), self._loop)
+        except RuntimeError as e:
+            print(f"[Config] Notify failed: {e}")
+
+    async def listen(self):
+        """訂閱配置變更通知，收到其他副本的通知時重新載入"""
+        if not self._redis:
+            return
+        pubsub = self._redis.pubsub()
+        await pubsub.subscribe(CONFIG_CHANNEL)
+        print(f"[Redis] Subscribed to {CONFIG_CHANNEL} channel")
+        try:
+            async for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                try:
+                    origin = json.loads(message["data"]).get("origin")
+                except (ValueError, AttributeError):
+                    origin = None
+                if origin == self.instance_id:
+                    continue
+                version = await asyncio.to_thread(self.reload)
+                print(f"[Config] Reloaded from remote update (v{version})")
+        except Exception as e:
+            print(f"[Config] Listener Error: {e}")
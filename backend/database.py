@@ -109,6 +109,19 @@ def create_db_and_tables():
             except Exception as e:
                 print(f"Migration Error (systemconfig): {e}")
 
+        # Migration: (stock_id, timestamp) composite index for price history
+        # 複合索引涵蓋原本的 stock_id 單欄索引，舊索引移除以減少寫入成本
+        if inspector.has_table("stockpricehistory"):
+            indexes = [i["name"] for i in inspector.get_indexes("stockpricehistory")]
+            if "ix_stockpricehistory_stock_id_timestamp" not in indexes:
+                print("Migrating: Adding (stock_id, timestamp) index to stockpricehistory...")
+                try:
+                    connection.execute(text('CREATE INDEX IF NOT EXISTS ix_stockpricehistory_stock_id_timestamp ON stockpricehistory (stock_id, timestamp)'))
+                    connection.execute(text('DROP INDEX IF EXISTS ix_stockpricehistory_stock_id'))
+                    connection.commit()
+                except Exception as e:
+                    print(f"Migration Error (stockpricehistory index): {e}")
+
 def get_session():
     with Session(engine) as session:
         yield session
@@ -0,0 +1,117 @@
+"""
+跨副本的行情引擎指令
+行情引擎的記憶體索引（事件影響力、到價提醒、空單強平門檻）只在主節點上運作（見 leader）。
+任何副本上的 API 變更後以這些方法通知：主節點（或沒有 Redis 的單機）直接套用到本機引擎，
+其他副本發佈到 Redis ENGINE_CHANNEL，由主節點的 listen() 套用。
+  {"op": "event", "stock_id", "impact", "created_at"}
+  {"op": "alert_add", "id", "user_id", "stock_id", "target_price", "condition", "is_triggered"}
+  {"op": "alert_remove", "alert_id"}
+  {"op": "margin_dirty", "user_ids": [...]}
+換手期間遺失的指令由新主節點啟動時從 DB 重建索引補上。
+
+main 建立實例後以 install() 註冊，API 模組以 get() 取得，不必回頭 import main。
+"""
+import asyncio
+import json
+from datetime import datetime
+from types import SimpleNamespace
+
+ENGINE_CHANNEL = "engine_commands"
+
+_current = None  # install() 註冊的 EngineCommands
+
+
+def install(commands):
+    global _current
+    _current = commands
+    return commands
+
+
+def get():
+    return _current
+
+
+class EngineCommands:
+    def __init__(self, market_engine, is_leader):
+        self.market_engine = market_engine
+        self.is_leader = is_leader  # callable
+        self._loop = None
+        self._redis = None
+
+    def attach(self, loop, redis_client):
+        """在 lifespan 中呼叫：之後非主節點的指令從任何執行緒發佈到 Redis"""
+        self._loop = loop
+        self._redis = redis_client
+
+    # ==================== 指令 ====================
+
+    def record_event(self, event):
+        self._dispatch({
+            "op": "event",
+            "stock_id": event.target_stock_id,
+            "impact": event.impact_multiplier,
+            "created_at": event.created_at.isoformat()
+        })
+
+    def add_alert(self, alert):
+        self._dispatch({
+            "op": "alert_add",
+            "id": alert.id,
+            "user_id": alert.user_id,
+            "stock_id": alert.stock_id,
+            "target_price": alert.target_price,
+            "condition": alert.condition,
+            "is_triggered": alert.is_triggered
+        })
+
+    def remove_alert(self, alert_id):
+        self._dispatch({"op": "alert_remove", "alert_id": alert_id})
+
+    def margin_dirty(self, user_ids):
+        """ORM 事件已標記本機的索引：只有非主節點需要轉送"""
+        if self._redis and not self.is_leader():
+            self._publish({"op": "margin_dirty", "user_ids": list(user_ids)})
+
+    # ==================== 套用 / 轉送 ====================
+
+    def _dispatch(self, command):
+        if self._redis is None or self.is_leader():
+            self.apply(command)
+        else:
+            self._publish(command)
+
+    def _publish(self, command):
+        try:
+            asyncio.run_coroutine_threadsafe(self._redis.publish(ENGINE_CHANNEL, json.dumps(command)), self._loop)
+        except RuntimeError as e:
+            print(f"[EngineCommands] Publish failed: {e}")
+
+    def apply(self, command):
+        engine = self.market_engine
+        op = command.get("op")
+        if op == "event":
+            engine.event_index.add(command["stock_id"], command["impact"], datetime.fromisoformat(command["created_at"]))
+        elif op == "alert_add":
+            engine.alert_index.add(SimpleNamespace(**{k: v for k, v in command.items() if k != "op"}))
+        elif op == "alert_remove":
+            engine.alert_index.remove(command["alert_id"])
+        elif op == "margin_dirty":
+            engine.margin_index.mark_dirty(command["user_ids"])
+
+    async def listen(self):
+        """訂閱其他副本的指令，擔任主節點時套用"""
+        if not self._redis:
+            return
+        pubsub = self._redis.pubsub()
+        await pubsub.subscribe(ENGINE_CHANNEL)
+        print(f"[Redis] Subscribed to {ENGINE_CHANNEL} channel")
+        try:
+            async for message in pubsub.listen():
+                if message["type"] != "message" or not self.is_leader():
+                    continue
+                try:
+                    self.apply(json.loads(message["data"]))
+                except (ValueError, KeyError, TypeError) as e:
+                    print(f"[EngineCommands] Bad command: {e}")
+        except Exception as e:
+            print(f"[EngineCommands] Listener Error: {e}")
@@ -0,0 +1,201 @@
+"""
+行情引擎狀態快照
+每隔幾個 tick 把 MarketEngine 與 EventSystem 的完整記憶體狀態（股價、重力中心、趨勢、Regime、
+未收盤 K 線、尚未寫入 DB 的 K 線、事件排程）序列化成一份帶版本號的 zlib 壓縮 JSON，
+寫入本機檔案與 Redis；重啟時取較新的一份整份套用，模擬從中斷處接續，不需要重新暖機。
+"""
+import base64
+import json
+import os
+import time
+import zlib
+from datetime import datetime
+
+from sqlmodel import select
+from models import EventLog, Stock, StockCandle, StockPriceHistory
+
+STATE_VERSION = 1
+STATE_FILE = os.getenv("ENGINE_STATE_FILE", "engine_state.bin")
+REDIS_KEY = "market_engine_state"
+SAVE_EVERY_TICKS = 5
+
+
+def _ts(value):
+    return value.isoformat() if value else None
+
+
+def _dt(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+def _candle_out(candle):
+    return dict(candle, start_time=_ts(candle["start_time"]))
+
+
+def _candle_in(candle):
+    return dict(candle, start_time=_dt(candle["start_time"]))
+
+
+def capture(market, events=None):
+    """在行情執行緒上呼叫（與 tick 同一執行緒，讀到的是一致的狀態）"""
+    if market.vector_kernel is not None:
+        market.vector_kernel.export_state(market)
+
+    state = {
+        "version": STATE_VERSION,
+        "saved_at": time.time(),
+        "market": {
+            "last_date": market.last_date.isoformat(),
+            "stocks": [[s.id, s.price, s.day_open] for s in market.active_stocks],
+            "base_prices": dict(market.base_prices),
+            "stock_trends": [[sid, t] for sid, t in market.stock_trends.items()],
+            "market_regimes": dict(market.market_regimes),
+            "regime_durations": dict(market.regime_durations),
+            "candles": [[sid, _candle_out(c)] for sid, c in market.candles.items()],
+            "history": [
+                [sid, _ts(ts), o, h, l, c, v]
+                for sid, ts, o, h, l, c, v in market.history_buffer.peek()
+            ],
+            "rollup_open": [
+                [sid, resolution, _candle_out(c)]
+                for sid, buckets in market.rollup.open_buckets.items()
+                for resolution, c in buckets.items()
+            ],
+            "rollup_pending": [
+                [r.stock_id, r.resolution, _ts(r.timestamp), r.open, r.high, r.low, r.close, r.volume]
+                for r in list(market.rollup.pending)
+            ],
+        },
+    }
+    if events is not None:
+        cache = events.next_event_cache
+        state["events"] = {
+            "window_start": _ts(events.window_start),
+            "scheduled_times": [_ts(t) for t in events.scheduled_times],
+            "current_event_id": events.current_event.id if events.current_event else None,
+            "event_end_time": _ts(events.event_end_time),
+            "next_event": {
+                "target_id": cache["target"].id,
+                "time": _ts(cache["time"]),
+                "data": {k: v for k, v in cache["data"].items() if k != "target"},
+            } if cache else None,
+        }
+    return state
+
+
+def dumps(state):
+    return zlib.compress(json.dumps(state, separators=(",", ":")).encode(), 6)
+
+
+def loads(blob):
+    state = json.loads(zlib.decompress(blob))
+    if state.get("version") != STATE_VERSION:
+        raise ValueError(f"unsupported engine state version {state.get('version')}")
+    return state
+
+
+def save_file(blob, path=STATE_FILE):
+    """先寫暫存檔再替換，重啟時不會讀到寫到一半的檔案"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(blob)
+    os.replace(tmp_path, path)
+
+
+def load_file(path=STATE_FILE):
+    try:
+        with open(path, "rb") as f:
+            return loads(f.read())
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"[EngineState] Ignoring unreadable state file: {e}")
+        return None
+
+
+def to_redis(blob):
+    return base64.b64encode(blob).decode()  # redis client 以 decode_responses=True 連線
+
+
+def from_redis(text):
+    try:
+        return loads(base64.b64decode(text)) if text else None
+    except Exception as e:
+        print(f"[EngineState] Ignoring unreadable Redis state: {e}")
+        return None
+
+
+def newest(*states):
+    states = [s for s in states if s]
+    return max(states, key=lambda s: s["saved_at"]) if states else None
+
+
+def restore(market, events, state):
+    """把快照套用到已 load_cache 的引擎（先組好所有結構再一次替換）"""
+    m = state["market"]
+    prices = {sid: (price, day_open) for sid, price, day_open in m["stocks"]}
+    for stock in market.active_stocks:
+        if stock.id in prices:
+            stock.price, stock.day_open = prices[stock.id]
+
+    open_buckets = {}
+    for sid, resolution, c in m["rollup_open"]:
+        open_buckets.setdefault(sid, {})[resolution] = _candle_in(c)
+    pending = [
+        StockCandle(
+            stock_id=sid, resolution=resolution, timestamp=_dt(ts),
+            open=o, high=h, low=l, close=c, volume=v
+        )
+        for sid, resolution, ts, o, h, l, c, v in m["rollup_pending"]
+    ]
+    history = [(sid, _dt(ts), o, h, l, c, v) for sid, ts, o, h, l, c, v in m["history"]]
+
+    with market.session_factory() as session:
+        # 快照之後可能已經 flush 過：DB 已有的 5 秒 K 線不再重複寫入
+        if history:
+            oldest = min(r[1] for r in history)
+            written = set(session.exec(
+                select(StockPriceHistory.stock_id, StockPriceHistory.timestamp)
+                .where(StockPriceHistory.timestamp >= oldest)
+            ).all())
+            history = [r for r in history if (r[0], r[1]) not in written]
+
+        current_event = None
+        next_event_cache = None
+        e = state.get("events")
+        if events is not None and e:
+            if e["current_event_id"]:
+                current_event = session.get(EventLog, e["current_event_id"])
+            if e["next_event"]:
+                target = session.get(Stock, e["next_event"]["target_id"])
+                if target:
+                    next_event_cache = {
+                        "target": target,
+                        "data": dict(e["next_event"]["data"], target=target),
+                        "time": _dt(e["next_event"]["time"]),
+                    }
+
+    market.last_date = datetime.fromisoformat(m["last_date"]).date()
+    market.base_prices = dict(m["base_prices"])
+    market.stock_trends = {sid: t for sid, t in m["stock_trends"]}
+    market.market_regimes = dict(m["market_regimes"])
+    market.regime_durations = dict(m["regime_durations"])
+    market.candles = {sid: _candle_in(c) for sid, c in m["candles"]}
+    market.rollup.open_buckets = open_buckets
+    market.rollup.pending = pending
+    # 先前擔任主節點時未寫入的紀錄已由快照涵蓋：確定還原成功後才替換
+    market.history_buffer.clear()
+    for record in history:
+        market.history_buffer.append(record)
+    if market.vector_kernel is not None:
+        market.vector_kernel._layout = None  # 下一個 tick 由還原後的狀態重建陣列
+
+    if events is not None and e:
+        events.window_start = _dt(e["window_start"])
+        events.scheduled_times = [_dt(t) for t in e["scheduled_times"]]
+        events.current_event = current_event
+        events.event_end_time = _dt(e["event_end_time"]) if current_event else None
+        events.next_event_cache = next_event_cache
+
+    age = time.time() - state["saved_at"]
+    print(f"[EngineState] Restored {len(m['stocks'])} stocks, {len(history)} unflushed candles (snapshot age {age:.1f}s)")
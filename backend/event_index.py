@@ -0,0 +1,67 @@
+"""
+事件影響力索引
+在記憶體中維護每檔股票最近 60 秒內事件的影響力總和，
+取代每個 tick 對每檔股票查詢一次 EventLog。
+"""
+import heapq
+import threading
+from datetime import timedelta
+from sqlmodel import select
+from models import EventLog
+
+
+class EventImpactIndex:
+    def __init__(self, window_seconds=60):
+        self.window_seconds = window_seconds
+        self.window = timedelta(seconds=window_seconds)
+        self.totals = {}  # {stock_id: 影響力總和}
+        self.counts = {}  # {stock_id: 生效中的事件數}，歸零時移除總和避免浮點殘差
+        self._expiry = []  # heap: (expires_at, seq, stock_id, impact)
+        self._seq = 0
+        self._lock = threading.Lock()  # 事件可能來自 tick、排程與 API 執行緒
+
+    def add(self, stock_id, impact, created_at):
+        """登記一則事件（created_at + window 之後失效）"""
+        if stock_id is None or not impact:
+            return
+        with self._lock:
+            self._seq += 1
+            heapq.heappush(self._expiry, (created_at + self.window, self._seq, stock_id, impact))
+            self.totals[stock_id] = self.totals.get(stock_id, 0.0) + impact
+            self.counts[stock_id] = self.counts.get(stock_id, 0) + 1
+
+    def expire(self, now):
+        """移除 created_at < now - window 的事件（每個 tick 呼叫一次）"""
+        with self._lock:
+            while self._expiry and self._expiry[0][0] < now:
+                _, _, stock_id, impact = heapq.heappop(self._expiry)
+                remaining = self.counts[stock_id] - 1
+                if remaining <= 0:
+                    del self.counts[stock_id]
+                    del self.totals[stock_id]
+                else:
+                    self.counts[stock_id] = remaining
+                    self.totals[stock_id] -= impact
+
+    def force(self, stock_id):
+        """每秒影響力 = 總影響 / 60"""
+        return self.totals.get(stock_id, 0.0) / self.window_seconds
+
+    def forces(self):
+        """所有受事件影響股票的每秒影響力 {stock_id: force}"""
+        with self._lock:
+            return {sid: total / self.window_seconds for sid, total in self.totals.items()}
+
+    def rebuild(self, session, now):
+        """重啟時從 EventLog 最近 60 秒的紀錄重建"""
+        events = session.exec(select(EventLog).where(
+            EventLog.target_stock_id != None,
+            EventLog.created_at >= now - self.window
+        )).all()
+        with self._lock:
+            self.totals = {}
+            self.counts = {}
+            self._expiry = []
+        for e in events:
+            self.add(e.target_stock_id, e.impact_multiplier, e.created_at)
+        return len(events)
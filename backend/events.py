@@ -52,8 +52,10 @@ TIER_4_BLACK_SWAN = [
 ]
 
 class EventSystem:
-    def __init__(self, session_factory):
+    def __init__(self, session_factory, market_engine=None, clock=None):
         self.session_factory = session_factory
+        self.clock = clock or datetime.now  # 可注入模擬時鐘（離線模擬器使用）
+        self.market_engine = market_engine  # 新事件同步登記到 MarketEngine 的影響力索引
         self.window_start = None
         self.scheduled_times = [] # List of datetimes
         self.WINDOW_MINUTES = 60 
@@ -85,7 +87,7 @@ class EventSystem:
     def get_active_event(self):
         # Check if current event is expired
         if self.current_event and self.event_end_time:
-            if datetime.now() > self.event_end_time:
+            if self.clock() > self.event_end_time:
                 self.current_event = None
                 self.event_end_time = None
         return self.current_event
@@ -97,7 +99,7 @@ class EventSystem:
             return {
                 "type": "forecast",
                 "stock_name": self.next_event_cache['target'].name,
-                "eta_seconds": int((self.next_event_cache['time'] - datetime.now()).total_seconds())
+                "eta_seconds": int((self.next_event_cache['time'] - self.clock()).total_seconds())
             }
         return None
 
@@ -189,7 +191,7 @@ class EventSystem:
         }
 
     def generate_random_event(self):
-        now = datetime.now().replace(microsecond=0)
+        now = self.clock().replace(microsecond=0)
         
         # Initialize or rotate window
         if self.window_start is None or now >= self.window_start + timedelta(minutes=self.WINDOW_MINUTES):
@@ -223,10 +225,13 @@ class EventSystem:
                         description=data['description'],
                         target_stock_id=target.id,
                         impact_multiplier=data['impact'],
-                        duration_seconds=data['duration']
+                        duration_seconds=data['duration'],
+                        created_at=now
                     )
                     session.add(event)
                     session.commit()
+                    if self.market_engine:
+                        self.market_engine.record_event(event)
                     
                     crit_tag = "CRITICAL HIT! 🔥" if data['is_critical'] else ""
                     print(f"[EventSystem] [{data['tier_display']}] {crit_tag} Impact: {data['impact']*100:.1f}% | {event.title} - {target.name}")
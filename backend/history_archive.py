@@ -0,0 +1,136 @@
+"""
+冷資料 K 線封存
+超過 DB 保留期限的多週期 K 線依「股票 / 週期 / 月份」匯出成固定寬度的 .npy 檔
+（time, open, high, low, close, volume，每根 48 bytes），
+歷史 API 往前翻頁超過 DB 保留範圍時以 numpy memmap 直接讀檔，不查資料庫。
+
+HISTORY_ARCHIVE_DIR 必須是所有副本共同掛載的目錄（docker-compose 的 history_archive volume；
+跨主機部署時改用 NFS 等共用儲存）：只有主節點的壓縮工作寫入（見 leader），任何副本都可能回應歷史 API。
+寫入時先寫暫存檔再 os.replace，讀取端已開啟的 memmap 仍指向舊檔、新開啟的看到完整的新檔。
+"""
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+
+ARCHIVE_DIR = os.getenv("HISTORY_ARCHIVE_DIR", "history_archive")
+CACHE_MONTHS = 64  # 保持開啟的 memmap 數
+
+ARCHIVE_DTYPE = np.dtype([
+    ("time", "<i8"),  # epoch 秒（區間起點）
+    ("open", "<f8"),
+    ("high", "<f8"),
+    ("low", "<f8"),
+    ("close", "<f8"),
+    ("volume", "<i8"),
+])
+
+_cache = OrderedDict()  # {path: ((st_ino, st_mtime_ns, st_size), memmap)}
+_cache_lock = threading.Lock()
+
+
+def _month_dir(stock_id, resolution):
+    return os.path.join(ARCHIVE_DIR, str(stock_id), resolution)
+
+
+def _months(stock_id, resolution):
+    """已封存的月份（"YYYY-MM"），由舊到新"""
+    try:
+        names = os.listdir(_month_dir(stock_id, resolution))
+    except FileNotFoundError:
+        return []
+    return sorted(name[:-4] for name in names if name.endswith(".npy"))
+
+
+def _open(stock_id, resolution, month):
+    """以 memmap 開啟一個月份；檔案被替換（inode / mtime 改變）後重新開啟"""
+    path = os.path.join(_month_dir(stock_id, resolution), f"{month}.npy")
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return np.empty(0, dtype=ARCHIVE_DTYPE)
+    version = (st.st_ino, st.st_mtime_ns, st.st_size)
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached is not None and cached[0] == version:
+            _cache.move_to_end(path)
+            return cached[1]
+    data = np.load(path, mmap_mode="r")
+    with _cache_lock:
+        _cache[path] = (version, data)
+        _cache.move_to_end(path)
+        while len(_cache) > CACHE_MONTHS:
+            _cache.popitem(last=False)
+    return data
+
+
+def write_candles(stock_id, resolution, rows):
+    """rows: [(timestamp, open, high, low, close, volume), ...]；與既有檔案合併（同一時間以新資料為準），回傳寫入筆數"""
+    by_month = {}
+    for timestamp, open_, high, low, close, volume in rows:
+        by_month.setdefault(timestamp.strftime("%Y-%m"), []).append(
+            (int(timestamp.timestamp()), open_, high, low, close, volume or 0)
+        )
+
+    directory = _month_dir(stock_id, resolution)
+    os.makedirs(directory, exist_ok=True)
+    written = 0
+    for month, items in by_month.items():
+        data = np.array(items, dtype=ARCHIVE_DTYPE)
+        path = os.path.join(directory, f"{month}.npy")
+        if os.path.exists(path):
+            data = np.concatenate([data, np.load(path)])  # 新資料在前，unique 保留第一筆
+        _, first = np.unique(data["time"], return_index=True)
+        data = data[first]  # np.unique 已依 time 排序
+
+        # 先寫暫存檔再替換，讀取端永遠看到完整的檔案
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        written += len(items)
+    return written
+
+
+def watermark(stock_id, resolution):
+    """封存資料的最後一根 K 線時間（epoch 秒），沒有封存時為 None"""
+    months = _months(stock_id, resolution)
+    if not months:
+        return None
+    data = _open(stock_id, resolution, months[-1])
+    return int(data["time"][-1]) if len(data) else None
+
+
+def read_before(stock_id, resolution, before, limit):
+    """讀取 time < before（epoch 秒）的最近 limit 根 K 線，依時間排序"""
+    before_month = datetime.fromtimestamp(before).strftime("%Y-%m")
+    chunks = []
+    remaining = limit
+    for month in reversed(_months(stock_id, resolution)):
+        if month > before_month:
+            continue
+        data = _open(stock_id, resolution, month)
+        end = int(np.searchsorted(data["time"], before, side="left"))
+        start = max(0, end - remaining)
+        if end > start:
+            chunks.append(data[start:end])
+            remaining -= end - start
+        if remaining <= 0:
+            break
+
+    candles = []
+    for chunk in reversed(chunks):
+        for t, open_, high, low, close, volume in chunk.tolist():
+            candles.append({
+                "time": datetime.fromtimestamp(t),
+                "open": open_,
+                "high": high,
+                "low": low,
+                "close": close,
+                "volume": volume
+            })
+    return candles
@@ -0,0 +1,54 @@
+"""
+K 線歷史回應快取
+同一檔熱門股票的圖表常被大量使用者同時開啟，以 (stock_id, interval, before, limit)
+為鍵快取序列化後的回應（LRU + TTL），並附 ETag 讓重複輪詢回 304。
+引擎收完一根 5 秒 K 線時呼叫 invalidate，丟掉該股票最新一頁的快取。
+（只有主節點的引擎會 tick；其他副本的最新一頁以 tick 串流序號為版本，見 api.get_stock_history）
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class HistoryCache:
+    def __init__(self, max_entries=512, ttl_seconds=60):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # {key: (expires_at, etag, body, next_cursor)}
+        self._versions = {}  # {stock_id: 版本號}，每收一根 K 線 +1
+        self._lock = threading.Lock()  # tick 執行緒 invalidate，API 執行緒池讀寫
+
+    def version(self, stock_id):
+        return self._versions.get(stock_id, 0)
+
+    def get(self, key):
+        """回傳 (etag, body, next_cursor)，不存在或過期回傳 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1:]
+
+    def put(self, key, body, next_cursor=None):
+        """存入序列化後的回應，回傳 ETag"""
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, etag, body, next_cursor)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return etag
+
+    def invalidate(self, stock_id):
+        """該股票有新的 K 線收盤：版本 +1，最新一頁的舊快取不會再被讀到"""
+        with self._lock:
+            self._versions[stock_id] = self._versions.get(stock_id, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
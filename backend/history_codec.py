@@ -0,0 +1,72 @@
+"""
+K 線歷史的精簡欄式格式（?format=columnar）
+預設的 JSON 陣列每根 K 線都重複 time/open/high/low/close/volume 六個鍵，
+欄式格式改為平行陣列，價格量化到分（整數）並做差分：
+  time  : 第一根為圖表時間，之後為與前一根的秒差
+  close : 第一根為價格（分），之後為與前一根收盤的差
+  open/high/low : 與同一根收盤的差（分）
+  volume: 原值
+價格 = 分 / scale。安裝 msgpack 時，Accept: application/msgpack 可取得二進位版本。
+"""
+try:
+    import msgpack  # Optional: 二進位編碼
+except ImportError:
+    msgpack = None
+
+PRICE_SCALE = 100  # 價格量化到 0.01
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+
+def encode_columnar(points):
+    """points: [{time(秒), open, high, low, close, volume}]（依時間排序）"""
+    times, opens, highs, lows, closes, volumes = [], [], [], [], [], []
+    prev_time = 0
+    prev_close = 0
+    for p in points:
+        close = round(p["close"] * PRICE_SCALE)
+        times.append(p["time"] - prev_time)
+        closes.append(close - prev_close)
+        opens.append(round(p["open"] * PRICE_SCALE) - close)
+        highs.append(round(p["high"] * PRICE_SCALE) - close)
+        lows.append(round(p["low"] * PRICE_SCALE) - close)
+        volumes.append(p["volume"])
+        prev_time = p["time"]
+        prev_close = close
+    return {
+        "format": "columnar",
+        "scale": PRICE_SCALE,
+        "time": times,
+        "open": opens,
+        "high": highs,
+        "low": lows,
+        "close": closes,
+        "volume": volumes
+    }
+
+
+def decode_columnar(payload):
+    """encode_columnar 的反向轉換（測試與 Python 用戶端使用）"""
+    scale = payload["scale"]
+    points = []
+    time = 0
+    close = 0
+    for i in range(len(payload["time"])):
+        time += payload["time"][i]
+        close += payload["close"][i]
+        points.append({
+            "time": time,
+            "open": (close + payload["open"][i]) / scale,
+            "high": (close + payload["high"][i]) / scale,
+            "low": (close + payload["low"][i]) / scale,
+            "close": close / scale,
+            "volume": payload["volume"][i]
+        })
+    return points
+
+
+def pack(payload):
+    return msgpack.packb(payload, use_bin_type=True)
+
+
+def wants_msgpack(accept):
+    return msgpack is not None and bool(accept) and MSGPACK_MEDIA_TYPE in accept
@@ -0,0 +1,192 @@
+"""
+K 線歷史壓縮
+5 秒 K 線 (StockPriceHistory) 只保留最近一段時間，更舊的資料確認已有多週期 K 線 (StockCandle)
+後分批刪除；較細的多週期 K 線也依週期保留不同天數（刪除前先封存到 history_archive），
+1h/4h/1d 永久保留。
+每批刪除各自一個短交易，不會長時間鎖表。
+
+用法:
+    python history_compactor.py --dry-run
+    python history_compactor.py --retention-hours 48 --chunk-size 1000
+"""
+import argparse
+from datetime import datetime, timedelta
+
+from sqlmodel import Session, select, delete, func
+
+from models import Stock, StockPriceHistory, StockCandle
+from candle_rollup import CandleRollup, bucket_start
+import history_archive
+
+DEFAULT_RAW_RETENTION_HOURS = 72
+# 多週期 K 線保留天數；未列出的週期 (1h/4h/1d) 永久保留
+ROLLUP_RETENTION_DAYS = {
+    "1m": 14,
+    "5m": 60,
+    "15m": 180
+}
+DEFAULT_CHUNK_SIZE = 500  # 每個刪除交易的筆數（也低於 SQLite 的參數上限）
+
+
+def _delete_in_chunks(session_factory, model, conditions, chunk_size):
+    """依 id 分批刪除，每批一個交易，回傳刪除筆數"""
+    deleted = 0
+    while True:
+        with session_factory() as session:
+            ids = session.exec(select(model.id).where(*conditions).order_by(model.id).limit(chunk_size)).all()
+            if not ids:
+                return deleted
+            session.exec(delete(model).where(model.id.in_(ids)))
+            session.commit()
+        deleted += len(ids)
+
+
+def _ensure_rollups(session, stock_id, day_start, day_end, rows):
+    """用當日的 5 秒 K 線補上缺少的多週期 K 線（已存在的以 DB 為準），回傳補建筆數"""
+    rollup = CandleRollup()
+    for timestamp, open_, high, low, close, volume in rows:
+        rollup.add(stock_id, {
+            "start_time": timestamp, "open": open_, "high": high,
+            "low": low, "close": close, "volume": volume
+        })
+    candidates = list(rollup.pending)
+    for resolution, candle in rollup.open_buckets.get(stock_id, {}).items():
+        candidates.append(StockCandle(
+            stock_id=stock_id, resolution=resolution, timestamp=candle["start_time"],
+            open=candle["open"], high=candle["high"], low=candle["low"],
+            close=candle["close"], volume=candle["volume"]
+        ))
+
+    existing = set(session.exec(select(StockCandle.resolution, StockCandle.timestamp).where(
+        StockCandle.stock_id == stock_id,
+        StockCandle.timestamp >= day_start,
+        StockCandle.timestamp < day_end
+    )).all())
+    missing = [c for c in candidates if (c.resolution, c.timestamp) not in existing]
+    session.add_all(missing)
+    return len(missing)
+
+
+def _archive_rollups(session_factory, stock_ids, resolution, cutoff):
+    """把 cutoff 之前的多週期 K 線匯出到封存檔，回傳筆數"""
+    archived = 0
+    for stock_id in stock_ids:
+        with session_factory() as session:
+            rows = session.exec(select(
+                StockCandle.timestamp, StockCandle.open, StockCandle.high,
+                StockCandle.low, StockCandle.close, StockCandle.volume
+            ).where(
+                StockCandle.stock_id == stock_id,
+                StockCandle.resolution == resolution,
+                StockCandle.timestamp < cutoff
+            ).order_by(StockCandle.timestamp)).all()
+        if rows:
+            archived += history_archive.write_candles(stock_id, resolution, rows)
+    return archived
+
+
+def compact_history(session_factory, raw_retention_hours=DEFAULT_RAW_RETENTION_HOURS,
+                    rollup_retention_days=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                    dry_run=False, archive=True, now=None, progress=print):
+    """壓縮 K 線歷史，回傳統計；dry_run 時只計算不寫入"""
+    now = now or datetime.now()
+    rollup_retention_days = ROLLUP_RETENTION_DAYS if rollup_retention_days is None else rollup_retention_days
+    # 以整日為單位處理，確保每個週期的區間都完整
+    raw_cutoff = bucket_start(now - timedelta(hours=raw_retention_hours), 86400)
+    stats = {"raw_deleted": 0, "rollups_created": 0, "rollups_archived": 0, "rollups_deleted": {}, "dry_run": dry_run}
+    started = datetime.now()
+    tag = "[Compactor]" + (" (dry-run)" if dry_run else "")
+
+    with session_factory() as session:
+        stock_ids = session.exec(select(Stock.id).order_by(Stock.id)).all()
+
+    # 1. 5 秒 K 線：逐檔、逐日確認多週期 K 線後刪除
+    for n, stock_id in enumerate(stock_ids, 1):
+        with session_factory() as session:
+            oldest = session.exec(select(func.min(StockPriceHistory.timestamp)).where(
+                StockPriceHistory.stock_id == stock_id
+            )).first()
+        day_start = bucket_start(oldest, 86400) if oldest else raw_cutoff
+        stock_raw = 0
+        while day_start < raw_cutoff:
+            day_end = day_start + timedelta(days=1)
+            day_conditions = [
+                StockPriceHistory.stock_id == stock_id,
+                StockPriceHistory.timestamp >= day_start,
+                StockPriceHistory.timestamp < day_end
+            ]
+            with session_factory() as session:
+                rows = session.exec(select(
+                    StockPriceHistory.timestamp, StockPriceHistory.open, StockPriceHistory.high,
+                    StockPriceHistory.low, StockPriceHistory.close, StockPriceHistory.volume
+                ).where(*day_conditions).order_by(StockPriceHistory.timestamp)).all()
+                if rows:
+                    created = _ensure_rollups(session, stock_id, day_start, day_end, rows)
+                    if dry_run:
+                        session.rollback()
+                    else:
+                        session.commit()
+                    stats["rollups_created"] += created
+
+            if rows:
+                if dry_run:
+                    deleted = len(rows)
+                else:
+                    deleted = _delete_in_chunks(session_factory, StockPriceHistory, day_conditions, chunk_size)
+                stock_raw += deleted
+            day_start = day_end
+
+        stats["raw_deleted"] += stock_raw
+        if stock_raw:
+            progress(f"{tag} Stock {stock_id} ({n}/{len(stock_ids)}): {stock_raw} raw candles before {raw_cutoff:%Y-%m-%d}")
+
+    # 2. 較細的多週期 K 線依週期保留（先封存再刪除）
+    for resolution, days in rollup_retention_days.items():
+        cutoff = bucket_start(now - timedelta(days=days), 86400)
+        conditions = [
+            StockCandle.resolution == resolution,
+            StockCandle.timestamp < cutoff
+        ]
+        if archive and not dry_run:
+            archived = _archive_rollups(session_factory, stock_ids, resolution, cutoff)
+            stats["rollups_archived"] += archived
+            if archived:
+                progress(f"{tag} Archived {archived} {resolution} candles to {history_archive.ARCHIVE_DIR}")
+        if dry_run:
+            with session_factory() as session:
+                deleted = session.exec(select(func.count(StockCandle.id)).where(*conditions)).one()
+        else:
+            deleted = _delete_in_chunks(session_factory, StockCandle, conditions, chunk_size)
+        stats["rollups_deleted"][resolution] = deleted
+        if deleted:
+            progress(f"{tag} {resolution} candles older than {days} days: {deleted}")
+
+    stats["elapsed_s"] = round((datetime.now() - started).total_seconds(), 2)
+    progress(
+        f"{tag} Done in {stats['elapsed_s']}s: {stats['raw_deleted']} raw deleted, "
+        f"{stats['rollups_created']} rollups created, {sum(stats['rollups_deleted'].values())} rollups deleted"
+    )
+    return stats
+
+
+def main(argv=None):
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="Compact StockPriceHistory into rollup candles")
+    parser.add_argument("--retention-hours", type=float, default=DEFAULT_RAW_RETENTION_HOURS, help="5 秒 K 線保留時數")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="每個刪除交易的筆數")
+    parser.add_argument("--dry-run", action="store_true", help="只統計會刪除/補建的筆數，不寫入")
+    parser.add_argument("--no-archive", action="store_true", help="刪除多週期 K 線前不匯出封存檔")
+    args = parser.parse_args(argv)
+
+    compact_history(
+        lambda: Session(engine),
+        raw_retention_hours=args.retention_hours,
+        chunk_size=args.chunk_size,
+        dry_run=args.dry_run,
+        archive=not args.no_archive
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+5 秒 K 線寫入緩衝
+記憶體中只保留固定筆數的精簡紀錄 (stock_id, timestamp, open, high, low, close, volume)，
+超過上限（或寫入 DB 失敗）時整批附加到本機 journal 分段檔，
+下一次成功寫入 DB 時連同 journal 一起寫入後才刪除分段檔；重啟時殘留的分段檔同樣會被補寫。
+DB 故障期間記憶體用量固定，K 線也不會遺失。
+journal_dir=None 時不寫檔，溢出時直接丟棄最舊的一半（離線模擬器使用）；
+journal 無法寫入（目錄沒有權限、磁碟已滿）時同樣退回丟棄最舊的一半，tick 不會因此中斷。
+
+journal 預設在本機磁碟：主節點換手後（見 leader），舊主節點留下的分段檔要等該節點再次成為主節點才會補寫。
+多副本部署時把 HISTORY_JOURNAL_DIR 指到所有副本共同掛載的目錄，新的主節點下一次寫入即會一併補寫。
+"""
+import json
+import os
+import threading
+from datetime import datetime
+
+JOURNAL_DIR = os.getenv("HISTORY_JOURNAL_DIR", "history_journal")
+DEFAULT_CAPACITY = int(os.getenv("HISTORY_BUFFER_CAPACITY", "50000"))
+
+
+class HistoryBuffer:
+    def __init__(self, capacity=DEFAULT_CAPACITY, journal_dir=JOURNAL_DIR):
+        self.capacity = capacity
+        self.journal_dir = journal_dir
+        self._records = []
+        self._segment = None  # 目前附加中的分段檔路徑（取出後封存，下一次溢出開新檔）
+        self._seq = 0
+        self._lock = threading.Lock()  # tick 執行緒寫入，寫入執行緒取出
+
+    def __len__(self):
+        return len(self._records)
+
+    def append(self, record):
+        with self._lock:
+            self._records.append(record)
+            if len(self._records) < self.capacity:
+                return
+            if self.journal_dir is not None:
+                try:
+                    self._spill(self._records)
+                    self._records = []
+                    return
+                except OSError as e:
+                    print(f"[HistoryBuffer] Spill Error, dropping oldest candles: {e}")
+                    self._segment = None
+            del self._records[:self.capacity // 2]
+
+    def peek(self):
+        """記憶體中紀錄的複本（引擎狀態快照使用）"""
+        with self._lock:
+            return list(self._records)
+
+    def clear(self):
+        """丟棄記憶體中的紀錄（離線模擬器使用，不寫入 journal）"""
+        with self._lock:
+            self._records = []
+
+    def take(self):
+        """取出所有已封存分段檔與記憶體中的紀錄：回傳 (journaled, fresh, segments)"""
+        with self._lock:
+            fresh, self._records = self._records, []
+            self._segment = None
+            segments = self._segments()
+        journaled = []
+        for path in segments:
+            journaled.extend(self._read(path))
+        return journaled, fresh, segments
+
+    def commit(self, segments):
+        """DB 寫入成功：刪除已補寫的分段檔"""
+        for path in segments:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def rollback(self, fresh):
+        """DB 寫入失敗：取出的記憶體紀錄寫入新的分段檔（分段檔本身保留到下一次）；
+        journal 無法寫入時放回記憶體（超過上限的部分丟棄最舊的）"""
+        with self._lock:
+            try:
+                self._spill(fresh)
+            except OSError as e:
+                print(f"[HistoryBuffer] Spill Error, keeping candles in memory: {e}")
+                self._records[:0] = fresh
+                if len(self._records) >= self.capacity:
+                    del self._records[:len(self._records) - self.capacity // 2]
+            self._segment = None
+
+    def pending_segments(self):
+        with self._lock:
+            return self._segments()
+
+    def _segments(self):
+        if self.journal_dir is None:
+            return []
+        try:
+            names = os.listdir(self.journal_dir)
+        except FileNotFoundError:
+            return []
+        return sorted(
+            os.path.join(self.journal_dir, name) for name in names if name.endswith(".jsonl")
+        )
+
+    def _spill(self, records):
+        if not records or self.journal_dir is None:
+            return
+        if self._segment is None:
+            os.makedirs(self.journal_dir, exist_ok=True)
+            self._seq += 1
+            name = f"{datetime.now():%Y%m%d%H%M%S}-{os.getpid()}-{self._seq:06d}.jsonl"
+            self._segment = os.path.join(self.journal_dir, name)
+        with open(self._segment, "a", encoding="utf-8") as f:
+            for stock_id, timestamp, open_, high, low, close, volume in records:
+                f.write(json.dumps([stock_id, timestamp.isoformat(), open_, high, low, close, volume]) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        print(f"[HistoryBuffer] Spilled {len(records)} candles to {self._segment}")
+
+    def _read(self, path):
+        records = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    stock_id, timestamp, open_, high, low, close, volume = json.loads(line)
+                except ValueError:
+                    continue  # 當機時寫到一半的最後一行
+                records.append((stock_id, datetime.fromisoformat(timestamp), open_, high, low, close, volume))
+        return records
@@ -0,0 +1,171 @@
+"""
+行情主節點選舉
+多個 API 副本（uvicorn worker / 容器）中只有持有租約的一個執行行情模擬、寫入與排程工作，
+其他副本只把 Redis pub/sub 的 tick 轉送給自己的連線，並由 tick 串流維護唯讀快照供交易 API 使用。
+
+租約：Redis SET key token NX PX ttl，主節點每 RENEW_SECONDS 秒以 token 比對後延長；
+續約失敗（被其他副本取得）立刻降級；Redis 無法連線或呼叫卡住時（續約有逾時），
+在租約到期前 RENEW_SECONDS 秒降級，其他副本接手前已停止寫入。
+正常關閉時釋放租約，其他副本在下一次輪詢（RETRY_SECONDS）即可接手；當機則在租約過期後接手。
+沒有 Redis 時使用 LocalLease（同一個程序內的租約表，單機與測試用）。
+"""
+import asyncio
+import os
+import socket
+import time
+import uuid
+
+LEASE_KEY = "market_leader"
+LEASE_SECONDS = 10
+RENEW_SECONDS = 2
+RETRY_SECONDS = 1
+
+_RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def new_token():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class RedisLease:
+    def __init__(self, client, key=LEASE_KEY, ttl=LEASE_SECONDS):
+        self.client = client
+        self.key = key
+        self.ttl = ttl
+
+    async def acquire(self, token):
+        return bool(await self.client.set(self.key, token, nx=True, px=int(self.ttl * 1000)))
+
+    async def renew(self, token):
+        return bool(await self.client.eval(_RENEW_SCRIPT, 1, self.key, token, int(self.ttl * 1000)))
+
+    async def release(self, token):
+        await self.client.eval(_RELEASE_SCRIPT, 1, self.key, token)
+
+    async def holder(self):
+        return await self.client.get(self.key)
+
+
+class LocalLease:
+    """程序內的租約（語意同 RedisLease），多個 LeaderElector 共用同一個 table 即可模擬多副本"""
+
+    def __init__(self, table=None, key=LEASE_KEY, ttl=LEASE_SECONDS, clock=time.monotonic):
+        self.table = {} if table is None else table  # {key: (token, expires_at)}
+        self.key = key
+        self.ttl = ttl
+        self.clock = clock
+
+    def _current(self):
+        entry = self.table.get(self.key)
+        if entry and entry[1] > self.clock():
+            return entry[0]
+        return None
+
+    async def acquire(self, token):
+        if self._current() is not None:
+            return False
+        self.table[self.key] = (token, self.clock() + self.ttl)
+        return True
+
+    async def renew(self, token):
+        if self._current() != token:
+            return False
+        self.table[self.key] = (token, self.clock() + self.ttl)
+        return True
+
+    async def release(self, token):
+        if self._current() == token:
+            del self.table[self.key]
+
+    async def holder(self):
+        return self._current()
+
+
+class LeaderElector:
+    def __init__(self, lease, on_elected, on_demoted, token=None,
+                 renew_seconds=RENEW_SECONDS, retry_seconds=RETRY_SECONDS, clock=time.monotonic):
+        self.lease = lease
+        self.on_elected = on_elected  # async callable：取得租約後啟動行情
+        self.on_demoted = on_demoted  # async callable：失去租約後立即停止寫入
+        self.token = token or new_token()
+        self.renew_seconds = renew_seconds
+        self.retry_seconds = retry_seconds
+        self.clock = clock
+        self.is_leader = False
+        self.elections = 0
+        self._renewed_at = None
+        self._start_task = None
+
+    async def run(self):
+        while True:
+            try:
+                await self.step()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[Leader] Election Error: {e}")
+            await asyncio.sleep(self.renew_seconds if self.is_leader else self.retry_seconds)
+
+    async def step(self):
+        if self.is_leader:
+            # 必須在租約到期前 renew_seconds 秒得到結果，否則視為失敗
+            deadline = self._renewed_at + self.lease.ttl - self.renew_seconds
+            try:
+                renewed = await asyncio.wait_for(self.lease.renew(self.token), max(deadline - self.clock(), 0.01))
+            except Exception as e:
+                # 無法確認租約：到期前仍視為主節點，之後降級
+                print(f"[Leader] Renew Error: {type(e).__name__} {e}")
+                if self.clock() >= deadline:
+                    await self._demote("lease expiring without renewal")
+                return
+            if renewed:
+                self._renewed_at = self.clock()
+            else:
+                await self._demote("lease lost")
+            return
+
+        if await self.lease.acquire(self.token):
+            self._renewed_at = self.clock()
+            self.is_leader = True
+            self.elections += 1
+            print(f"[Leader] {self.token} elected")
+            # 啟動（還原狀態、載入快取）可能花上數秒：在背景執行，續約照常進行
+            self._start_task = asyncio.create_task(self._start())
+
+    async def _start(self):
+        try:
+            await self.on_elected()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[Leader] Start Error: {e}")
+            await self.resign("start failed")
+
+    async def _demote(self, reason):
+        print(f"[Leader] {self.token} demoted: {reason}")
+        self.is_leader = False
+        task, self._start_task = self._start_task, None
+        if task and not task.done() and task is not asyncio.current_task():
+            task.cancel()
+        await self.on_demoted()
+
+    async def resign(self, reason="shutdown"):
+        """停止後釋放租約，讓其他副本立即接手（正常關閉時呼叫）"""
+        if not self.is_leader:
+            return
+        await self._demote(reason)
+        try:
+            await self.lease.release(self.token)
+        except Exception as e:
+            print(f"[Leader] Release Error: {e}")
@@ -1,5 +1,7 @@
 import os
 import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
 try:
     import redis.asyncio as redis
 except ImportError:
@@ -9,16 +11,33 @@ from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from sqlmodel import Session, select
-from typing import List
+from typing import Dict, Optional
 import json
 
 from database import create_db_and_tables, engine, get_session
-from api import router
+from auth import user_id_from_token
+from api import router, slots_engine
 from models import Stock, EventLog, Prediction, User, Portfolio, Transaction, UserDailySnapshot, SystemConfig, LeaderboardSnapshot
-from race_engine import RaceEngine
-from market import MarketEngine
+from race_engine import RaceEngine, DEFAULT_RACE_PARAMS
+from market import MarketEngine, DEFAULT_MARKET_PARAMS, DIVIDEND_ANCHOR
+from slots_engine import DEFAULT_SLOTS_PARAMS
 from events import EventSystem
+from market_snapshot import SnapshotStore, build_snapshot
+from market_worker import MarketWorker
+from candle_rollup import backfill_rollups
+from history_compactor import compact_history
+from prediction_worker import PredictionWorker
+import tick_codec
+import tick_log
+import leader
+import margin_index
+from engine_commands import EngineCommands, install as install_engine_commands
+import ws_channels
+import ws_broadcast
+from ws_broadcast import ClientQueue
+import engine_state
 import admin_api
+from admin_api import config_registry
 
 # Redis Config
 # REDIS_URL = os.getenv("REDIS_URL") # Removed
@@ -38,30 +57,168 @@ def verify_admin(x_admin_key: str = Header(None)):
 # WebSocket Manager
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        self.active_connections: Dict[WebSocket, ClientQueue] = {}  # 每個連線有自己的送出佇列
+        self.subscriptions = {}  # {websocket: Subscription}
+        self.binary = set()  # 以 ?format=binary 連線的 websocket
+        self.users = {}  # {websocket: user_id}（帶有效 token 連線者）
+        self.user_sockets = {}  # {user_id: set(websocket)}，到價提醒只送給該用戶的連線
+        self.channel_filter = ws_channels.ChannelFilter()
+        self.stream = tick_codec.TickState()  # 由廣播還原的目前 tick（新連線的 keyframe）
+        self.replay = tick_log.TickLog()  # 最近的 tick（重新連線的 resume）
+        self._group_seq = {}  # {(Subscription, binary): 這組上一則訊息的序號}
+        self._awaiting_keyframe = set()  # 連線時尚無 keyframe（主節點剛啟動）的 websocket
+        self.evicted = 0
+        self._closed_dropped = 0
 
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket, binary=False, user_id=None):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        self.active_connections[websocket] = ClientQueue(websocket, self._on_queue_closed)
+        self.subscriptions[websocket] = ws_channels.ALL
+        if binary:
+            self.binary.add(websocket)
+        if user_id is not None:
+            self.users[websocket] = user_id
+            self.user_sockets.setdefault(user_id, set()).add(websocket)
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        queue = self.active_connections.get(websocket)
+        if queue is not None:
+            asyncio.create_task(queue.close())
 
-    async def send_to_local(self, message: str):
-        # Broadcast to locally connected clients
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message)
-            except Exception:
-                pass
+    def _on_queue_closed(self, queue, evicted):
+        self.active_connections.pop(queue.websocket, None)
+        self.subscriptions.pop(queue.websocket, None)
+        self.binary.discard(queue.websocket)
+        self._awaiting_keyframe.discard(queue.websocket)
+        user_id = self.users.pop(queue.websocket, None)
+        if user_id is not None:
+            sockets = self.user_sockets.get(user_id)
+            sockets.discard(queue.websocket)
+            if not sockets:
+                del self.user_sockets[user_id]
+        self._closed_dropped += queue.dropped
+        if evicted:
+            self.evicted += 1
+
+    async def send_to_local(self, message: dict):
+        # Broadcast to locally connected clients（相同訂閱的連線共用一份過濾與序列化結果，只放進佇列不等待送出）
+        if message.get("type") == "alert":
+            # 到價提醒是個人資料：只送給該用戶已驗證的連線，不進入共用的分組廣播
+            self.send_to_user(message["user_id"], message)
+            return
+        schema_changed = self._observe(message)
+        if self._awaiting_keyframe and self.stream.keyframe():
+            # 先補送目前的 keyframe，之後的 delta 才能套用
+            waiting, self._awaiting_keyframe = self._awaiting_keyframe, set()
+            for websocket in waiting:
+                await self.send_keyframe(websocket)
+        groups = {}
+        for connection, queue in self.active_connections.items():
+            key = (self.subscriptions.get(connection, ws_channels.ALL), connection in self.binary)
+            groups.setdefault(key, []).append(queue)
+        self._group_seq = {key: seq for key, seq in self._group_seq.items() if key in groups}
+
+        for key, queues in groups.items():
+            subscription, binary = key
+            filtered = self.channel_filter.apply(message, subscription)
+            if filtered is None:
+                continue
+            if "seq" in message:
+                filtered = dict(filtered, prev=self._group_seq.get(key))
+                self._group_seq[key] = message["seq"]
+            payload = None
+            if binary:
+                if schema_changed and filtered.get("type") == "tick":
+                    # 股票清單變動：keyframe 附上新的 index 對照（與 keyframe 同一個 frame，不會只丟掉其中之一）
+                    filtered = dict(filtered, schema=self.channel_filter.schema)
+                elif filtered.get("type") == "delta":
+                    payload = tick_codec.pack_delta(filtered, self.channel_filter.index, self.channel_filter.day_opens)
+            if payload is None:
+                payload = ws_broadcast.dumps(filtered)
+            for queue in queues:
+                queue.put(payload)
+
+    def send_to_user(self, user_id, message: dict):
+        sockets = self.user_sockets.get(user_id)
+        if not sockets:
+            return
+        payload = ws_broadcast.dumps(message)
+        for websocket in sockets:
+            if "alert" in self.subscriptions.get(websocket, ws_channels.ALL).channels:
+                self.active_connections[websocket].put(payload)
+
+    def _observe(self, message: dict):
+        """更新目前的 tick、重播記錄與股票對照；股票清單變動時回傳 True"""
+        if self.stream.apply(message):
+            self.replay.append(message)
+        return self.channel_filter.observe(message)
 
-    async def broadcast(self, message: str):
-        # If Redis is available, publish to channel
+    def restore(self, messages):
+        """啟動時由 Redis Stream 重建（最後一個 keyframe 起的訊息）"""
+        for message in messages:
+            self._observe(message)
+
+    async def broadcast(self, message: dict):
+        # If Redis is available, publish to channel（所有副本的 redis_listener 轉送給各自的連線）
         if redis_client:
-            await redis_client.publish("stock_updates", message)
+            try:
+                payload = ws_broadcast.dumps(message)
+                if tick_store and message.get("type") in ("tick", "delta"):
+                    # 先寫入 Stream：客戶端收到這則 tick 時重播記錄已包含它
+                    await tick_store.append(message["seq"], payload)
+                await redis_client.publish("stock_updates", payload)
+                return
+            except Exception as e:
+                print(f"[Redis] Publish Error: {e}")
+        # Local mode fallback
+        await self.send_to_local(message)
+
+    async def send_keyframe(self, websocket: WebSocket):
+        """依這個連線的訂閱送出目前的 keyframe（連線、resync、訂閱變更時）"""
+        keyframe = self.stream.keyframe()
+        queue = self.active_connections.get(websocket)
+        if queue is None:
+            return
+        if not keyframe:
+            self._awaiting_keyframe.add(websocket)
         else:
-            # Local mode fallback
-            await self.send_to_local(message)
+            filtered = self.channel_filter.apply(keyframe, self.subscriptions.get(websocket, ws_channels.ALL))
+            if websocket in self.binary and self.channel_filter.schema:
+                filtered = dict(filtered, schema=self.channel_filter.schema)
+            queue.put(ws_broadcast.dumps(filtered))
+
+    async def resume(self, websocket: WebSocket, seq: int):
+        """重新連線：補送 seq 之後漏掉的訊息，無法補送時改送 keyframe（見 tick_log）"""
+        queue = self.active_connections.get(websocket)
+        if queue is None:
+            return
+        messages = self.replay.since(seq)
+        if messages is None or any(m["type"] == "tick" for m in messages):
+            await self.send_keyframe(websocket)
+            return
+        subscription = self.subscriptions.get(websocket, ws_channels.ALL)
+        prev = seq
+        for message in messages:
+            filtered = self.channel_filter.apply(message, subscription)
+            if filtered is not None:
+                queue.put(ws_broadcast.dumps(dict(filtered, prev=prev)))
+                prev = message["seq"]
+        if prev != self.stream.seq:
+            # 最後幾則過濾後沒有內容：以空的 delta 把序號推進到目前，之後的 prev 不會被誤判為漏收
+            queue.put(ws_broadcast.dumps({"type": "delta", "seq": self.stream.seq, "ts": self.stream.ts, "s": [], "prev": prev}))
+
+    def stats(self):
+        """送出佇列指標（管理後台）"""
+        depths = [len(q) for q in self.active_connections.values()]
+        return {
+            "connections": len(depths),
+            "queued": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "queue_size": ws_broadcast.QUEUE_SIZE,
+            "dropped": self._closed_dropped + sum(q.dropped for q in self.active_connections.values()),
+            "evicted": self.evicted,
+            "groups": len(self._group_seq),
+        }
 
 manager = ConnectionManager()
 
@@ -105,14 +262,51 @@ scheduler = AsyncIOScheduler()
 
 # Market Systems
 market_engine = MarketEngine(lambda: Session(engine))
-event_system = EventSystem(lambda: Session(engine))
+event_system = EventSystem(lambda: Session(engine), market_engine=market_engine)
 race_engine = RaceEngine(lambda: Session(engine))
+prediction_worker = PredictionWorker(market_engine)
+
+# 最新市場快照（行情執行緒寫入，廣播與交易 API 無鎖讀取）
+market_snapshots = SnapshotStore()
+tick_encoder = tick_codec.TickEncoder()  # tick 廣播的序號與差量狀態（廣播工作專用）
+market_worker = None
+broadcaster_task = None
+elector = None  # 行情主節點選舉（lifespan 建立）
+engine_commands = install_engine_commands(EngineCommands(market_engine, lambda: is_leader()))  # API 變更引擎索引（轉送給主節點）
+margin_index.forward_dirty(engine_commands.margin_dirty)
+market_engine.write_allowed = lambda: is_leader()
+prepare_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="market-prepare")
+prepare_future = None  # 進行中的 prepare_market（降級時等待它結束）
+tick_store = None  # tick 的 Redis Stream（有 Redis 時由 lifespan 建立）
+tick_count = 0
+pending_state_blob = None  # 最新的引擎狀態快照，等待寫入 Redis
+
+def apply_configs(registry):
+    """配置重新載入後整份替換各引擎的參數（tick 只讀取 params 參考，不需要鎖）"""
+    market_engine.params = {**DEFAULT_MARKET_PARAMS, **registry.section("market")}
+    race_engine.params = {**DEFAULT_RACE_PARAMS, **registry.section("race")}
+    slots_engine.params = {**DEFAULT_SLOTS_PARAMS, **registry.section("slots")}
+
+    # 配息間隔變更時重新排程
+    minutes = registry.get("user.dividend_interval_minutes")
+    job = scheduler.get_job("payout_dividends")
+    if job and minutes and job.trigger.interval.total_seconds() != minutes * 60:
+        scheduler.reschedule_job("payout_dividends", trigger='interval', minutes=minutes, start_date=DIVIDEND_ANCHOR)
+        print(f"[Config] Dividend interval -> {minutes} min")
 
 # Set up Blackjack WebSocket broadcast callback
 from blackjack_ws import set_broadcast_callback
 set_broadcast_callback(blackjack_manager.broadcast_room)
 
 
+def compact_price_history():
+    """壓縮 K 線歷史（每天 03:30 執行，在排程器的執行緒上跑）"""
+    compact_history(
+        lambda: Session(engine),
+        raw_retention_hours=config_registry.get("market.history_retention_hours")
+    )
+
+
 def daily_asset_snapshot():
     """記錄所有用戶的每日資產快照（每天 00:00 執行）"""
     from datetime import datetime
@@ -237,23 +431,29 @@ def tick():
     
     # 3. Race Loop
     race_engine.process_race_loop()
-    
-async def async_tick_job():
-    # Wrapper for async operations
-    tick() # Synchronous part (updates memory)
-    
-    # Async broadcast
+
+    # 4. 引擎狀態快照（暖重啟用）
+    global tick_count
+    tick_count += 1
+    if tick_count % engine_state.SAVE_EVERY_TICKS == 0:
+        save_engine_state()
+
+def save_engine_state():
+    """在行情執行緒上擷取狀態並寫入本機檔案；Redis 由廣播工作在事件迴圈上寫入"""
+    global pending_state_blob
+    try:
+        blob = engine_state.dumps(engine_state.capture(market_engine, event_system))
+        engine_state.save_file(blob)
+        pending_state_blob = blob
+    except Exception as e:
+        print(f"[EngineState] Save Error: {e}")
+
+def snapshot_market(version):
+    """在行情執行緒上建立唯讀快照（含賽馬狀態的 DB 讀取）"""
     current_event = event_system.get_active_event()
-    
-    # Use In-Memory Stocks (No DB Read)
-    # Ensure cache is loaded (tick should have loaded it if needed)
     stocks_data = [s.model_dump() for s in market_engine.active_stocks]
     
     with Session(engine) as session:
-        # stocks = session.exec(select(Stock)).all() # REMOVED DB READ
-        
-        current_forecast = event_system.get_forecast()
-        
         # Get Race Info for Broadcast (Optional, or just let frontend poll)
         current_race = race_engine.get_current_race(session)
         race_info = None
@@ -265,29 +465,68 @@ async def async_tick_job():
                 "winner_id": current_race.winner_horse_id
             }
 
-        data = {
-            "type": "tick",
-            "stocks": stocks_data,
-            "event": current_event.model_dump() if current_event else None,
-            "forecast": current_forecast,
-            "race": race_info,
-            "market_regimes": market_engine.market_regimes,
-            "regime_durations": market_engine.regime_durations
-        }
+    return build_snapshot(
+        version,
+        stocks_data,
+        market_engine.market_regimes,
+        market_engine.regime_durations,
+        event=current_event.model_dump() if current_event else None,
+        forecast=event_system.get_forecast(),
+        race=race_info
+    )
     
-    # Validated: Redis persistence in tick job
-    # Use get_redis util to ensure we have the connection
-    from redis_utils import get_redis
-    client = await get_redis()
+async def broadcast_snapshot(snapshot):
+    """把快照寫入 Redis 並廣播（在事件迴圈上執行，不做任何阻塞 I/O）"""
+    message = tick_encoder.encode(snapshot)
+    
+    # Validated: Redis persistence in tick job（lifespan 確認連線後的 redis_client，單機模式為 None）
+    client = redis_client
     if client:
         try:
             # SAVE LATEST STATE TO REDIS
-            await client.set("market_stocks", json.dumps(stocks_data, default=str))
+            await client.set("market_stocks", json.dumps(snapshot.stocks_data(), default=str))
+            global pending_state_blob
+            blob, pending_state_blob = pending_state_blob, None
+            if blob:
+                await client.set(engine_state.REDIS_KEY, engine_state.to_redis(blob))
         except Exception as e:
             print(f"Redis Save Error: {e}")
 
-    # Broadcast in async context
-    await manager.broadcast(json.dumps(data, default=str))
+    # Broadcast in async context（keyframe 或只含變動欄位的 delta）
+    await manager.broadcast(message)
+
+    # 到價提醒（前端依 user_id 過濾）
+    for notification in market_engine.drain_alert_notifications():
+        await manager.broadcast(notification)
+
+async def snapshot_broadcaster(snapshot_ready: asyncio.Event):
+    """等待行情執行緒發佈新快照後廣播；tick 落後時只廣播最新一份"""
+    last_version = 0
+    while True:
+        await snapshot_ready.wait()
+        snapshot_ready.clear()
+        snapshot = market_snapshots.current
+        if not snapshot or snapshot.version == last_version:
+            continue
+        last_version = snapshot.version
+        try:
+            await broadcast_snapshot(snapshot)
+        except Exception as e:
+            print(f"[Broadcast] Error: {e}")
+
+def publish_stream_snapshot():
+    """非主節點：由 tick 串流建立唯讀快照，交易 API 的即時價格與 /stocks 照常可用"""
+    keyframe = manager.stream.keyframe()
+    if keyframe:
+        market_snapshots.publish(build_snapshot(
+            keyframe["seq"],
+            keyframe["stocks"],
+            keyframe["market_regimes"] or {},
+            keyframe["regime_durations"] or {},
+            event=keyframe["event"],
+            forecast=keyframe["forecast"],
+            race=keyframe["race"]
+        ))
 
 async def redis_listener():
     """Background task to subscribe to Redis and push to local clients"""
@@ -301,37 +540,66 @@ async def redis_listener():
     try:
         async for message in pubsub.listen():
             if message["type"] == "message":
-                await manager.send_to_local(message["data"]) # already decoded if decode_responses=True
+                data = json.loads(message["data"]) # already decoded if decode_responses=True
+                await manager.send_to_local(data)
+                if not is_leader() and data.get("type") in ("tick", "delta"):
+                    publish_stream_snapshot()
     except Exception as e:
         print(f"[Redis] Listener Error: {e}")
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    # 設置 Blackjack WebSocket 事件循環
-    from blackjack_ws import set_broadcast_callback
-    loop = asyncio.get_running_loop()
-    set_broadcast_callback(blackjack_manager.broadcast_room, loop)
-    
-    # Init Redis via Utils
-    redis_client = await get_redis()
-    
-    create_db_and_tables()
-    
+def prepare_market(redis_state, cached_stocks):
+    """取得主節點租約後載入 / 還原行情引擎（阻塞 I/O，在執行緒上執行）"""
+    # 完整引擎狀態：本機檔案與 Redis 取較新的一份
+    state = engine_state.newest(engine_state.load_file(), redis_state)
+
+    state_restored = False
+    if state:
+        try:
+            market_engine.initialize_market()
+            market_engine.load_cache()
+            engine_state.restore(market_engine, event_system, state)
+            state_restored = True
+        except Exception as e:
+            print(f"Engine State Restore Error: {e}")
+
     # TRY RESTORE FROM REDIS
-    restored = False
-    if redis_client:
+    restored = state_restored
+    if cached_stocks and not restored:
         try:
-            cached = await redis_client.get("market_stocks")
-            if cached:
-                market_engine.load_from_dict(json.loads(cached))
-                restored = True
+            market_engine.load_from_dict(json.loads(cached_stocks))
+            restored = True
         except Exception as e:
             print(f"Redis Restore Error: {e}")
             
     if not restored:
         market_engine.initialize_market()
         market_engine.load_cache() # Fallback to DB
-        
+
+    # 以下步驟會寫入 DB：啟動途中已被降級（租約逾時）時不再繼續
+    if not is_leader():
+        print("[Leader] Demoted during startup, aborting market preparation")
+        return
+
+    # 從最近 60 秒 EventLog 重建事件影響力索引
+    market_engine.rebuild_event_index()
+
+    # 載入尚未觸發的到價提醒
+    market_engine.load_alerts()
+
+    # 多週期 K 線：首次啟動時由既有 5 秒 K 線補建，再載回未收盤的區間
+    backfill_rollups(lambda: Session(engine))
+    if not state_restored:
+        market_engine.restore_rollups()  # 狀態快照已含較新的未收盤區間
+
+    # 上次 DB 故障或當機前溢出到 journal 的 5 秒 K 線
+    try:
+        market_engine.replay_history_journal()
+    except Exception as e:
+        print(f"History Journal Replay Error: {e}")
+
+    if not is_leader():
+        print("[Leader] Demoted during startup, aborting market preparation")
+        return
     race_engine.initialize_horses()
     
     # 遷移：為現有用戶設置預設暱稱
@@ -339,44 +607,154 @@ async def lifespan(app: FastAPI):
     
     # 啟動時先記錄一次今日快照（如果還沒有）
     daily_asset_snapshot()
-    
-    # Init Redis Listener
-    listener_task = None
+
+def leader_only(job):
+    """排程工作開始前確認仍是主節點（降級前已觸發、尚未執行的工作不再寫入）"""
+    @functools.wraps(job)
+    def run(*args, **kwargs):
+        if not is_leader():
+            print(f"[Leader] Skipping {getattr(job, '__name__', job)}: not the market leader")
+            return None
+        return job(*args, **kwargs)
+    return run
+
+async def start_market():
+    """成為主節點：還原引擎狀態，啟動行情執行緒、廣播與排程工作"""
+    global market_worker, broadcaster_task, tick_encoder, prepare_future
+    redis_state = None
+    cached_stocks = None
     if redis_client:
-        listener_task = asyncio.create_task(redis_listener())
+        try:
+            redis_state = engine_state.from_redis(await redis_client.get(engine_state.REDIS_KEY))
+            cached_stocks = await redis_client.get("market_stocks")
+        except Exception as e:
+            print(f"Redis State Restore Error: {e}")
+    prepare_future = prepare_executor.submit(prepare_market, redis_state, cached_stocks)
+    await asyncio.wrap_future(prepare_future)
+
+    # 序號接續前一個主節點，客戶端的 prev / seq 判斷不受換手影響
+    tick_encoder = tick_codec.TickEncoder()
+    tick_encoder.seq = manager.stream.seq
+
+    # 行情模擬在獨立執行緒上以 1 秒節拍執行，完成後通知事件迴圈廣播
+    loop = asyncio.get_running_loop()
+    snapshot_ready = asyncio.Event()
+    broadcaster_task = asyncio.create_task(snapshot_broadcaster(snapshot_ready))
+    market_worker = MarketWorker(
+        tick, snapshot_market, market_snapshots, interval=1.0,
+        on_publish=lambda snapshot: loop.call_soon_threadsafe(snapshot_ready.set)
+    )
+    market_worker.start()
     
     # Weekly IPO Check (Monday 9:00 AM)
-    scheduler.add_job(market_engine.attempt_weekly_ipo, 'cron', day_of_week='mon', hour=9, minute=0)
+    scheduler.add_job(leader_only(market_engine.attempt_weekly_ipo), 'cron', day_of_week='mon', hour=9, minute=0)
 
-    # Root Market Dividends (Every 2 hours for production)
-    scheduler.add_job(market_engine.payout_dividends, 'interval', minutes=120)
+    # Root Market Dividends (間隔由 user.dividend_interval_minutes 設定，預設 2 小時)
+    scheduler.add_job(
+        leader_only(lambda: market_engine.payout_dividends(config_registry.get("user.dividend_interval_minutes"))), 'interval',
+        minutes=config_registry.get("user.dividend_interval_minutes"), start_date=DIVIDEND_ANCHOR, id="payout_dividends"
+    )
     
     # PERSISTENCE JOB: Flush memory to DB every 60 seconds (Reduce Disk I/O)
-    scheduler.add_job(market_engine.persist_state, 'interval', seconds=60)
+    scheduler.add_job(leader_only(market_engine.persist_state_async), 'interval', seconds=60)
     
-    # Job runs every second (Updates Memory Only)
-    scheduler.add_job(async_tick_job, 'interval', seconds=1)
+    # 大師預測：產生排隊中的預測並結算到期 / 達標的預測
+    scheduler.add_job(leader_only(prediction_worker.run), 'interval', seconds=10)
     
     # Cleanup old news every hour (keep last 24h)
-    scheduler.add_job(event_system.cleanup_old_events, 'interval', hours=1, args=[24])
+    scheduler.add_job(leader_only(event_system.cleanup_old_events), 'interval', hours=1, args=[24])
     
     # 每日 00:00 記錄資產快照
-    scheduler.add_job(daily_asset_snapshot, 'cron', hour=0, minute=0)
+    scheduler.add_job(leader_only(daily_asset_snapshot), 'cron', hour=0, minute=0)
 
     # 每日 00:01 收取做空利息
-    scheduler.add_job(market_engine.charge_short_interest, 'cron', hour=0, minute=1)
+    scheduler.add_job(leader_only(market_engine.charge_short_interest), 'cron', hour=0, minute=1)
 
     # 每日 00:05 記錄排行榜快照（在資產快照之後）
-    scheduler.add_job(daily_leaderboard_snapshot, 'cron', hour=0, minute=5)
+    scheduler.add_job(leader_only(daily_leaderboard_snapshot), 'cron', hour=0, minute=5)
+
+    # 每日 03:30 壓縮 K 線歷史
+    scheduler.add_job(leader_only(compact_price_history), 'cron', hour=3, minute=30)
 
+async def stop_market():
+    """失去主節點租約或關閉：立即停止模擬與排程，不再寫入 DB 或發佈 tick"""
+    global market_worker, broadcaster_task
+    scheduler.remove_all_jobs()
+    if market_worker:
+        market_worker.stop()
+        await asyncio.to_thread(market_worker.join, 5)
+        market_worker = None
+    if broadcaster_task:
+        broadcaster_task.cancel()
+        broadcaster_task = None
+    # 仍在執行緒上的啟動與寫入：is_leader() 已為 False，會在下一個寫入點放棄；等它們結束再回報降級完成
+    if prepare_future is not None and not prepare_future.done():
+        await asyncio.wait([asyncio.wrap_future(prepare_future)], timeout=30)
+    await asyncio.to_thread(market_engine.wait_for_persist, 30)
+
+def is_leader():
+    return elector is not None and elector.is_leader
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global redis_client, elector, tick_store
+    # 設置 Blackjack WebSocket 事件循環
+    from blackjack_ws import set_broadcast_callback
+    loop = asyncio.get_running_loop()
+    set_broadcast_callback(blackjack_manager.broadcast_room, loop)
+    
+    # Init Redis via Utils（連不上時視為單機模式）
+    redis_client = await get_redis()
+    if redis_client:
+        try:
+            await redis_client.ping()
+        except Exception as e:
+            print(f"[Redis] Unavailable, running standalone: {e}")
+            redis_client = None
+    
+    create_db_and_tables()
+
+    # 載入系統配置並套用到各引擎；其他副本更新配置時經由 Redis 通知
+    config_registry.reload()
+    config_registry.subscribe(apply_configs)
+    config_registry.attach(loop, redis_client)
+    engine_commands.attach(loop, redis_client)
+    
+    # 由 Redis Stream 重建目前的 tick 與重播記錄（重新部署後立即可回應 resume，主節點序號也由此接續）
+    if redis_client:
+        tick_store = tick_log.RedisTickStore(redis_client)
+        try:
+            manager.restore(await tick_store.load())
+        except Exception as e:
+            print(f"[TickLog] Restore Error: {e}")
+
+    # Init Redis Listener（所有副本都由此把 tick 轉送給本機連線）
+    listener_task = None
+    config_listener_task = None
+    commands_listener_task = None
+    if redis_client:
+        listener_task = asyncio.create_task(redis_listener())
+        config_listener_task = asyncio.create_task(config_registry.listen())
+        commands_listener_task = asyncio.create_task(engine_commands.listen())
+
+    # 只有取得租約的副本執行行情模擬、寫入與排程工作
+    lease = leader.RedisLease(redis_client) if redis_client else leader.LocalLease()
+    elector = leader.LeaderElector(lease, start_market, stop_market)
+    elector_task = asyncio.create_task(elector.run())
     scheduler.start()
 
     
     yield
     
+    elector_task.cancel()
+    await elector.resign()
     scheduler.shutdown()
     if listener_task:
         listener_task.cancel()
+    if config_listener_task:
+        config_listener_task.cancel()
+    if commands_listener_task:
+        commands_listener_task.cancel()
     await close_redis()
 
 app = FastAPI(lifespan=lifespan)
@@ -387,6 +765,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],  # K 線歷史分頁游標與快取驗證
 )
 app.include_router(router, prefix="/api")
 
@@ -401,12 +780,45 @@ app.include_router(
 def read_root():
     return {"message": "Stock Market Simulation API"}
 
+def ws_user_id(token: str):
+    with Session(engine) as session:
+        return user_id_from_token(token, session)
+
 @app.websocket("/api/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+async def websocket_endpoint(websocket: WebSocket, format: str = "json", channels: Optional[str] = None,
+                             resume: Optional[int] = None, token: Optional[str] = None):
+    # format=binary：只含股價的 delta 以二進位 frame 送出（見 tick_codec）
+    # channels：初始訂閱的頻道（逗號分隔，省略為全部）；resume：重新連線時帶最後收到的 seq（見 tick_log）
+    # token：登入的 JWT，驗證通過的連線才會收到自己的到價提醒
+    user_id = None
+    if token:
+        user_id = await asyncio.to_thread(ws_user_id, token)
+    await manager.connect(websocket, binary=format == "binary", user_id=user_id)
+    if channels is not None:
+        manager.subscriptions[websocket] = ws_channels.ALL.update({"type": "subscribe", "channels": channels.split(",")})
     try:
+        if resume is not None:
+            await manager.resume(websocket, resume)
+        else:
+            # 連線時先送目前的 keyframe，之後的 delta 以此為基準
+            await manager.send_keyframe(websocket)
         while True:
-            await websocket.receive_text()
+            text = await websocket.receive_text()
+            try:
+                request = json.loads(text)
+            except ValueError:
+                continue
+            if not isinstance(request, dict):
+                continue
+            if request.get("type") == "resync":
+                # 客戶端發現漏收時要求重新同步
+                await manager.send_keyframe(websocket)
+                continue
+            # subscribe / unsubscribe：套用後送出新訂閱範圍的 keyframe
+            subscription = manager.subscriptions.get(websocket, ws_channels.ALL).update(request)
+            if subscription is not None:
+                manager.subscriptions[websocket] = subscription
+                await manager.send_keyframe(websocket)
     except WebSocketDisconnect:
         manager.disconnect(websocket)
 
@@ -594,12 +1006,19 @@ def admin_get_user_detail(user_id: int, session: Session = Depends(get_session),
 @app.get("/api/admin/market")
 def admin_get_market_status(_: bool = Depends(verify_admin)):
     """取得市場狀態"""
-    stocks_data = [s.model_dump() for s in market_engine.active_stocks]
+    snapshot = market_snapshots.current
+    if not snapshot:
+        raise HTTPException(status_code=503, detail="Market not ready")
     return {
-        "market_regimes": market_engine.market_regimes,
-        "regime_durations": market_engine.regime_durations,
-        "stocks": stocks_data,
-        "base_prices": market_engine.base_prices
+        "market_regimes": dict(snapshot.market_regimes),
+        "regime_durations": dict(snapshot.regime_durations),
+        "stocks": snapshot.stocks_data(),
+        "base_prices": dict(market_engine.base_prices),
+        "snapshot_version": snapshot.version,
+        "tick_duration": round(market_worker.last_duration, 4) if market_worker else None,
+        "leader": is_leader(),
+        "node": elector.token if elector else None,
+        "websocket": manager.stats()
     }
 
 @app.post("/api/admin/users/{user_id}/balance")
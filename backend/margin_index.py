@@ -0,0 +1,196 @@
+"""
+空單強平價格索引
+保證金比率 = (餘額 + 鎖定保證金) / (空單市值 + 未實現虧損)，對股價單調遞減，
+因此每筆空單都能換算成「股價高於多少時比率跌破 110% / 120%」的門檻價格。
+索引依股票保存排序好的門檻價格，每個 tick 只取出門檻被新價格越過的空單，
+不再每秒掃描全部空單並逐筆查詢使用者。
+
+使用者餘額或持倉在任何 Session 中變更並 commit 後（ORM 屬性事件），該使用者的空單會在下一個 tick 重新計算；
+其他副本上的變更經由 forward_dirty 註冊的轉送（engine_commands）通知主節點；
+另外每 REBUILD_SECONDS 秒整份重建一次，涵蓋批次 SQL 造成的變更。
+"""
+import bisect
+import threading
+import time
+import weakref
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session as OrmSession, object_session
+from sqlmodel import select
+
+from models import Portfolio, User
+
+LIQUIDATION_RATIO = 1.1
+WARNING_RATIO = 1.2
+REBUILD_SECONDS = 60
+
+_indexes = weakref.WeakSet()  # 目前存在的索引（離線模擬 / 參數掃描會建立多個引擎）
+_forwarders = []  # commit 後另外通知的 callable(user_ids)（轉送給其他副本上的主節點）
+
+
+def forward_dirty(callback):
+    """註冊 commit 後的通知；非主節點的交易由此讓主節點的索引知道"""
+    _forwarders.append(callback)
+
+
+def threshold_price(balance, margin_locked, quantity, average_cost, ratio):
+    """股價高於此值時保證金比率 < ratio"""
+    qty = abs(quantity)
+    limit = (balance + margin_locked) / ratio / qty  # 分母 / qty 允許的最大值
+    if limit < average_cost:
+        return limit  # 仍在獲利區：分母 = qty * price
+    return (limit + average_cost) / 2  # 虧損區：分母 = qty * (2 * price - average_cost)
+
+
+def margin_ratio(balance, margin_locked, quantity, average_cost, price):
+    short_qty = abs(quantity)
+    required_margin = short_qty * price + max(0, (price - average_cost) * short_qty)
+    if required_margin <= 0:
+        return 999  # 無風險
+    return (balance + margin_locked) / required_margin
+
+
+class ShortMarginIndex:
+    def __init__(self, rebuild_seconds=REBUILD_SECONDS):
+        self.rebuild_seconds = rebuild_seconds
+        self._liquidation = {}  # {stock_id: [(門檻價, user_id)]}（遞增排序）
+        self._warning = {}  # 同上（120%）
+        self._positions = {}  # {(user_id, stock_id): (liquidation 門檻, warning 門檻)}
+        self._by_user = {}  # {user_id: {stock_id}}
+        self._last_prices = {}  # {stock_id: 上一次掃描的價格}
+        self._dirty = set()
+        self._rebuilt_at = None
+        self._lock = threading.Lock()  # API 執行緒標記變更，tick 執行緒讀取
+        _indexes.add(self)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def invalidate(self):
+        """下一次 refresh 整份重建（批次 SQL 更新餘額後呼叫）"""
+        self._rebuilt_at = None
+
+    def mark_dirty(self, user_ids):
+        with self._lock:
+            self._dirty.update(user_ids)
+
+    def refresh(self, session):
+        """重建到期時整份重建，否則只重新計算有變更的使用者"""
+        if self._rebuilt_at is None or time.monotonic() - self._rebuilt_at >= self.rebuild_seconds:
+            self.rebuild(session)
+            return
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        if dirty:
+            self.refresh_users(session, dirty)
+
+    def rebuild(self, session):
+        with self._lock:
+            self._dirty = set()
+        rows = session.exec(
+            select(Portfolio, User.balance)
+            .join(User, User.id == Portfolio.user_id)
+            .where(Portfolio.quantity < 0)
+        ).all()
+        self._liquidation = {}
+        self._warning = {}
+        self._positions = {}
+        self._by_user = {}
+        for position, balance in rows:
+            self._insert(position, balance)
+        self._rebuilt_at = time.monotonic()
+        return len(rows)
+
+    def refresh_users(self, session, user_ids):
+        for user_id in user_ids:
+            for stock_id in list(self._by_user.get(user_id, ())):
+                self._remove(user_id, stock_id)
+        rows = session.exec(
+            select(Portfolio, User.balance)
+            .join(User, User.id == Portfolio.user_id)
+            .where(Portfolio.quantity < 0, Portfolio.user_id.in_(list(user_ids)))
+        ).all()
+        for position, balance in rows:
+            self._insert(position, balance)
+
+    def scan(self, prices):
+        """回傳門檻被越過的空單：(強平候選 [(user_id, stock_id)], 警告候選 [(user_id, stock_id)])"""
+        liquidate = []
+        warn = []
+        for stock_id, entries in self._liquidation.items():
+            price = prices.get(stock_id)
+            if not price:
+                continue
+            # 門檻 < 價格：比率已低於 110%（失敗的強平會在下一個 tick 重試）
+            end = bisect.bisect_left(entries, (price,))
+            liquidate.extend((user_id, stock_id) for _, user_id in entries[:end])
+
+            # 120% 門檻只在價格由下往上越過時警告一次
+            previous = self._last_prices.get(stock_id, 0.0)
+            if price > previous:
+                warnings = self._warning[stock_id]
+                start = bisect.bisect_left(warnings, (previous,))
+                stop = bisect.bisect_left(warnings, (price,))
+                warn.extend((user_id, stock_id) for _, user_id in warnings[start:stop])
+        self._last_prices = dict(prices)
+        return liquidate, warn
+
+    def _insert(self, position, balance):
+        key = (position.user_id, position.stock_id)
+        liquidation = threshold_price(balance, position.margin_locked, position.quantity, position.average_cost, LIQUIDATION_RATIO)
+        warning = threshold_price(balance, position.margin_locked, position.quantity, position.average_cost, WARNING_RATIO)
+        self._positions[key] = (liquidation, warning)
+        self._by_user.setdefault(position.user_id, set()).add(position.stock_id)
+        bisect.insort(self._liquidation.setdefault(position.stock_id, []), (liquidation, position.user_id))
+        bisect.insort(self._warning.setdefault(position.stock_id, []), (warning, position.user_id))
+
+    def _remove(self, user_id, stock_id):
+        liquidation, warning = self._positions.pop((user_id, stock_id))
+        self._by_user[user_id].discard(stock_id)
+        if not self._by_user[user_id]:
+            del self._by_user[user_id]
+        for entries, threshold in ((self._liquidation, liquidation), (self._warning, warning)):
+            items = entries[stock_id]
+            items.pop(bisect.bisect_left(items, (threshold, user_id)))
+            if not items:
+                del entries[stock_id]
+
+
+# --- ORM 事件：餘額 / 空單持倉變更，commit 後通知所有索引 ---
+
+def _touch(target, user_id):
+    if user_id is None:
+        return
+    session = object_session(target)
+    if session is None:
+        for index in list(_indexes):
+            index.mark_dirty([user_id])
+        return
+    session.info.setdefault("margin_dirty_users", set()).add(user_id)
+
+
+@event.listens_for(User.balance, "set")
+def _on_balance_set(target, value, oldvalue, initiator):
+    _touch(target, target.id)
+
+
+@event.listens_for(Portfolio.quantity, "set")
+@event.listens_for(Portfolio.margin_locked, "set")
+@event.listens_for(Portfolio.average_cost, "set")
+def _on_position_set(target, value, oldvalue, initiator):
+    _touch(target, target.user_id)
+
+
+@event.listens_for(OrmSession, "after_commit")
+def _on_commit(session):
+    user_ids = session.info.pop("margin_dirty_users", None)
+    if user_ids:
+        for index in list(_indexes):
+            index.mark_dirty(user_ids)
+        for callback in _forwarders:
+            callback(user_ids)
+
+
+@event.listens_for(OrmSession, "after_soft_rollback")
+def _on_rollback(session, previous_transaction):
+    session.info.pop("margin_dirty_users", None)
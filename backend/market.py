@@ -1,8 +1,21 @@
+import os
 import random
 import math
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from sqlalchemy import bindparam, update
 from sqlmodel import Session, select, delete
-from models import Stock, EventLog, StockPriceHistory, Portfolio, Prediction, Guru
+from models import Stock, EventLog, Portfolio
+from event_index import EventImpactIndex
+from candle_rollup import CandleRollup
+from history_cache import HistoryCache
+from bulk_persist import bulk_update_stocks, bulk_insert_history
+from history_journal import HistoryBuffer
+from alert_index import AlertIndex
+from settlement import claim_period, settle_dividends, settle_short_interest
+from margin_index import ShortMarginIndex, margin_ratio, LIQUIDATION_RATIO, WARNING_RATIO
 import ai_service
 
 INITIAL_FRUITS = [
@@ -40,16 +53,55 @@ INITIAL_GURUS = [
     {"name": "AI 量化機器人", "bio": "冷血的演算法，毫無感情的交易機器。"},
 ]
 
+# 可調整的行情參數（對應後台 SystemConfig 的 market.* 設定，鍵名去掉 "market." 前綴）
+DEFAULT_MARKET_PARAMS = {
+    "individual_weight": 0.6,  # 個別趨勢權重
+    "market_weight": 0.4,  # 市場權重
+    "major_event_market_weight": 0.7,  # CRASH/CHAOS 時市場權重（個別趨勢 = 1 - 此值）
+    "herd_effect_chance": 0.03,  # 群體效應機率
+    "trend_duration_min": 60,  # 個股趨勢持續秒數
+    "trend_duration_max": 600,
+    "gravity_strength": 0.01,  # 重力強度，0.01 = 原始回歸力道（各段強度依比例縮放）
+    "breakthrough_chance": 0.10,  # 假突破（暫時無重力）機率
+    "regime_change_interval": 120,  # NORMAL 狀態最短持續秒數
+}
+GRAVITY_STRENGTH_BASE = 0.01
+
+# {symbol: 初始價格}，用於基準價下限與軟下限
+INITIAL_PRICES = {
+    item["symbol"]: item["price"]
+    for lst in [INITIAL_FRUITS, INITIAL_MEATS, INITIAL_ROOTS]
+    for item in lst
+}
+
+
+# 配息排程的區間格線起點（本地時間午夜）：排程以此為 start_date，期別以 floor 對應到同一格
+DIVIDEND_ANCHOR = datetime(2000, 1, 1)
+
+
+def dividend_period(now, interval_minutes):
+    """now 所在配息區間的起點"""
+    interval = interval_minutes * 60
+    elapsed = (now - DIVIDEND_ANCHOR).total_seconds()
+    return DIVIDEND_ANCHOR + timedelta(seconds=elapsed // interval * interval)
+
 
 class MarketEngine:
-    def __init__(self, session_factory):
+    def __init__(self, session_factory, engine_mode=None, clock=None, seed=None):
         self.session_factory = session_factory
+        self.clock = clock or datetime.now  # 可注入模擬時鐘（離線模擬器使用）
         self.candles = {} # {stock_id: {open, high, low, close, volume, start_time}}
-        self.last_date = datetime.now().date()
+        self.last_date = self.clock().date()
         
         # In-Memory State
         self.active_stocks = [] # List of Stock objects (detached or dicts)
-        self.history_buffer = [] # List of StockPriceHistory objects to bulk insert
+        self.history_buffer = HistoryBuffer() # 5 秒 K 線（固定上限，溢出寫入 journal）
+        self._persist_lock = threading.Lock()
+        self._persist_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="market-persist")
+        self._persist_future = None
+        self.write_allowed = lambda: True  # 多副本時由 main 換成主節點判斷：失去租約後不再寫入
+        self.rollup = CandleRollup() # 1m/5m/15m/1h/4h/1d K 線（由 5 秒 K 線累加）
+        self.history_cache = HistoryCache() # 歷史 API 回應快取（K 線收盤時失效）
         
         # 各市場獨立 Regime
         self.market_regimes = {
@@ -67,6 +119,33 @@ class MarketEngine:
         # 個別股票趨勢（新增）
         # 格式: {stock_id: {"direction": 1/-1, "strength": 0.001, "duration": 100, "momentum": 0.0}}
         self.stock_trends = {}
+
+        # 行情參數（整份替換而非原地修改，tick 中途不會讀到一半的設定）
+        self.params = dict(DEFAULT_MARKET_PARAMS)
+
+        # 最近 60 秒事件影響力（取代每 tick 查詢 EventLog）
+        self.event_index = EventImpactIndex(window_seconds=60)
+
+        # 空單強平價格索引（取代每 tick 掃描全部空單）
+        self.margin_index = ShortMarginIndex()
+
+        # 到價提醒索引；觸發的提醒等待下一份市場快照廣播
+        self.alert_index = AlertIndex()
+        self.alert_notifications = deque()  # tick 執行緒 append，事件迴圈 popleft
+
+        # 待產生大師預測的股票（tick 執行緒 append，PredictionWorker popleft）
+        self.prediction_requests = deque()
+
+        # 引擎模式："scalar" 逐檔計算（預設）或 "vector" 以 numpy 批次計算
+        self.engine_mode = engine_mode or os.getenv("MARKET_ENGINE_MODE", "scalar")
+        self.vector_kernel = None
+        if self.engine_mode == "vector":
+            try:
+                from market_vector import VectorMarketKernel  # Late import (requires numpy)
+                self.vector_kernel = VectorMarketKernel(seed=seed)
+            except ImportError:
+                print("[Market] numpy not available, falling back to scalar engine.")
+                self.engine_mode = "scalar"
         
     def initialize_market(self):
         with self.session_factory() as session:
@@ -133,36 +212,106 @@ class MarketEngine:
                      
         print(f"[Market] Restored {len(self.active_stocks)} stocks from Redis Persistence.")
 
+    def record_event(self, event):
+        """登記新事件到影響力索引（EventSystem、IPO 與管理員事件呼叫）"""
+        self.event_index.add(event.target_stock_id, event.impact_multiplier, event.created_at)
+
+    def rebuild_event_index(self):
+        """啟動時從 EventLog 最近 60 秒重建事件索引"""
+        with self.session_factory() as session:
+            count = self.event_index.rebuild(session, self.clock())
+        print(f"[Market] Rebuilt event index from {count} recent events.")
+
+    def load_alerts(self):
+        """啟動時載入尚未觸發的到價提醒"""
+        with self.session_factory() as session:
+            count = self.alert_index.rebuild(session)
+        print(f"[Market] Loaded {count} price alerts.")
+
+    def restore_rollups(self):
+        """啟動時載回仍未收盤的多週期 K 線"""
+        with self.session_factory() as session:
+            count = self.rollup.restore(session, self.clock())
+        print(f"[Market] Restored {count} open rollup candles.")
+
+    def history_candles(self, stock_id, resolution):
+        """尚未寫入 DB 的多週期 K 線（含進行中的區間），供歷史 API 併入最新一頁"""
+        return self.rollup.snapshot(stock_id, resolution, live=self.candles.get(stock_id))
+
     def persist_state(self):
         """Flushes in-memory state to DB (Run every 60s)"""
         start_time = datetime.now()
-        with self.session_factory() as session:
-            # 1. Update Stocks
-            for mem_stock in self.active_stocks:
-                # merge() puts the state of mem_stock into the session
-                # If mem_stock is detached, it updates the DB row with same ID
-                session.merge(mem_stock)
-            
-            # 2. Bulk Insert History
-            if self.history_buffer:
-                session.add_all(self.history_buffer)
-                print(f"[Market] Persisting {len(self.history_buffer)} history records...")
-                self.history_buffer = [] # Clear buffer
-                
-            session.commit()
+        with self._persist_lock:
+            # 先取出要寫入的值再開 DB 連線：tick 在另一個執行緒上持續修改股價與 buffer
+            stock_rows = [(s.id, s.price, s.day_open) for s in list(self.active_stocks) if s.id is not None]
+            journaled, fresh, segments = self.history_buffer.take()
+            closed_candles, open_candles = self.rollup.take()
+
+            try:
+                with self.session_factory() as session:
+                    # 1. Update Stocks (single multi-row UPDATE)
+                    bulk_update_stocks(session, stock_rows)
+                    
+                    # 2. Bulk Insert History (先前溢出 / 失敗寫入 journal 的部分一起補寫)
+                    history_rows = journaled + fresh
+                    if history_rows:
+                        bulk_insert_history(session, history_rows)
+                        print(f"[Market] Persisting {len(history_rows)} history records ({len(journaled)} from journal)...")
+
+                    # 3. Rollup candles (closed + still-open buckets)
+                    self.rollup.write(session, closed_candles + open_candles)
+
+                    if not self.write_allowed():
+                        # 寫入途中失去主節點租約：不 commit，取出的部分放回（新主節點由狀態快照接手）
+                        raise RuntimeError("not the market leader, persistence aborted")
+                    session.commit()
+            except Exception:
+                # 寫入失敗：取出的 K 線改存 journal、已收盤的多週期 K 線放回，下一次成功時補寫
+                self.history_buffer.rollback(fresh)
+                self.rollup.rollback(closed_candles)
+                raise
+            self.history_buffer.commit(segments)
         
         duration = (datetime.now() - start_time).total_seconds()
-        print(f"[Market] Persistence completed in {duration:.2f}s")
+        print(f"[Market] Persistence completed in {duration:.3f}s")
+
+    def replay_history_journal(self):
+        """啟動時補寫上次執行殘留在 journal 的 K 線"""
+        segments = self.history_buffer.pending_segments()
+        if segments:
+            print(f"[Market] Replaying {len(segments)} history journal segment(s)...")
+            self.persist_state()
+
+    def persist_state_async(self):
+        """排程呼叫：交給專用的寫入執行緒，上一次尚未完成時略過這一輪"""
+        if self._persist_future is not None and not self._persist_future.done():
+            print("[Market] Previous persistence still running, skipping this round.")
+            return self._persist_future
+        self._persist_future = self._persist_executor.submit(self._persist_safely)
+        return self._persist_future
+
+    def wait_for_persist(self, timeout=None):
+        """等待進行中的寫入結束（停止行情時呼叫，避免降級後仍在寫入）"""
+        future = self._persist_future
+        if future is not None:
+            try:
+                future.result(timeout)
+            except Exception as e:
+                print(f"[Market] Persistence still running after stop: {e!r}")
+
+    def _persist_safely(self):
+        try:
+            self.persist_state()
+        except Exception as e:
+            print(f"[Market] Persistence Error: {e}")
 
     def get_base_price(self, symbol):
         """Returns dynamic base price for gravity calculation"""
         if symbol not in self.base_prices:
              # Find initial
-             for lst in [INITIAL_FRUITS, INITIAL_MEATS, INITIAL_ROOTS]:
-                 for item in lst:
-                     if item["symbol"] == symbol:
-                         self.base_prices[symbol] = item["price"]
-                         return item["price"]
+             if symbol in INITIAL_PRICES:
+                 self.base_prices[symbol] = INITIAL_PRICES[symbol]
+                 return INITIAL_PRICES[symbol]
              # If new IPO, return current if not found?
              # We should try to find from active stocks
              for s in self.active_stocks:
@@ -174,6 +323,7 @@ class MarketEngine:
 
     def update_regime(self):
         """各市場獨立更新 Regime"""
+        normal_min = int(self.params["regime_change_interval"])
         for category in ["FRUIT", "MEAT", "ROOT"]:
             self.regime_durations[category] -= 1
             if self.regime_durations[category] <= 0:
@@ -181,7 +331,7 @@ class MarketEngine:
                 roll = random.random()
                 if roll < 0.7:
                     new_regime = "NORMAL"
-                    duration = random.randint(120, 900)
+                    duration = random.randint(normal_min, max(normal_min, 900))
                 elif roll < 0.85:
                     new_regime = "BOOM"
                     duration = random.randint(30, 300)
@@ -201,7 +351,7 @@ class MarketEngine:
         if not self.active_stocks:
             self.load_cache()
 
-        now = datetime.now()
+        now = self.clock()
         current_date = now.date()
         
         # Check for day change
@@ -212,10 +362,25 @@ class MarketEngine:
             print(f"Day changed to {current_date}. Resetting day_open.")
         
         self.update_regime()
+        self.event_index.expire(now)
+        params = self.params
 
         # We need a session mainly for reading Events/Predictions?
         with self.session_factory() as session:
-            
+            if self.vector_kernel is not None:
+                # 向量模式：所有股票一次批次計算
+                self.vector_kernel.step(self, session, now, day_changed, params)
+                if session.new or session.dirty:
+                    session.commit()
+                self.check_margin_requirements()
+                self.check_alerts()
+                return
+
+            individual_weight = params["individual_weight"]
+            market_weight = params["market_weight"]
+            major_market_weight = params["major_event_market_weight"]
+            gravity_scale = params["gravity_strength"] / GRAVITY_STRENGTH_BASE
+
             for stock in self.active_stocks:
                 if day_changed:
                     stock.day_open = stock.price
@@ -231,7 +396,7 @@ class MarketEngine:
                     # 新趨勢：隨機方向和強度
                     direction = random.choice([1, 1, 1, -1, -1, -1, 0])  # 70% 有方向，30% 橫盤
                     strength = random.uniform(0.0002, 0.0012)  # 趨勢強度
-                    duration = random.randint(60, 600)  # 1-10分鐘持續
+                    duration = random.randint(int(params["trend_duration_min"]), int(params["trend_duration_max"]))  # 1-10分鐘持續
                     momentum = random.uniform(0.8, 1.2)  # 動能係數
                     self.stock_trends[stock.id] = {
                         "direction": direction,
@@ -246,7 +411,7 @@ class MarketEngine:
                 # 2. 計算個別股票的變化（60%）
                 individual_noise = random.gauss(0, 0.0003)  # 微小隨機
                 individual_trend = trend["direction"] * trend["strength"] * trend["momentum"]
-                individual_change = (individual_trend + individual_noise) * 0.6
+                individual_change = (individual_trend + individual_noise) * individual_weight
                 
                 # 3. 計算市場影響（40%）
                 # 取得該市場的 Regime
@@ -270,20 +435,20 @@ class MarketEngine:
                 
                 # 市場隨機波動
                 market_noise = random.gauss(regime_bias, 0.0005 * regime_vol_mult)
-                market_change = market_noise * 0.4
+                market_change = market_noise * market_weight
                 
                 # 4. 大事件時市場影響增強（從 40% 變成 70%）
                 if is_major_event:
                     # 市場影響增強，個別趨勢減弱
-                    total_individual = individual_change * 0.3  # 降到 30%
-                    total_market = market_noise * 0.7  # 升到 70%
+                    total_individual = individual_change * (1 - major_market_weight)  # 降到 30%
+                    total_market = market_noise * major_market_weight  # 升到 70%
                 else:
                     total_individual = individual_change
                     total_market = market_change
                 
                 # 5. 群體效應（5% 機率，讓同類股票短暫同向）
                 herd_effect = 0.0
-                if random.random() < 0.03:  # 3% 機率觸發群體效應
+                if random.random() < params["herd_effect_chance"]:  # 3% 機率觸發群體效應
                     herd_direction = random.choice([1, -1])
                     herd_effect = herd_direction * random.uniform(0.0003, 0.0008)
                 
@@ -294,14 +459,7 @@ class MarketEngine:
                     self.base_prices[stock.symbol] = base_price
 
                 # 取得初始價格（用於限制基準價不會跌太低）
-                initial_price = None
-                for lst in [INITIAL_FRUITS, INITIAL_MEATS, INITIAL_ROOTS]:
-                    for item in lst:
-                        if item["symbol"] == stock.symbol:
-                            initial_price = item["price"]
-                            break
-                    if initial_price:
-                        break
+                initial_price = INITIAL_PRICES.get(stock.symbol)
 
                 # 應用漂移
                 new_base = self.base_prices[stock.symbol] * (1 + base_drift)
@@ -333,7 +491,7 @@ class MarketEngine:
                 gravity_threshold_mid = 0.25 * random.uniform(0.80, 1.25)      # 20% ~ 31%
 
                 # 假突破機制：10% 機率暫時關閉重力（允許續跌/續漲）
-                is_breakthrough = (market_regime == "CHAOS") or (random.random() < 0.10)
+                is_breakthrough = (market_regime == "CHAOS") or (random.random() < params["breakthrough_chance"])
 
                 # 假突破後快速拉回：8% 機率觸發強力反轉
                 sudden_reversal = random.random() < 0.08 and abs(deviation) > 0.20
@@ -350,41 +508,35 @@ class MarketEngine:
 
                 elif sudden_reversal:
                     # 假突破快速反轉：強力拉回
-                    reversal_strength = random.uniform(0.020, 0.035)  # 2-3.5% 反轉力
+                    reversal_strength = random.uniform(0.020, 0.035) * gravity_scale  # 2-3.5% 反轉力
                     gravity = -deviation * reversal_strength
                     print(f"[Market] ⚡ {stock.name} 假突破反轉！快速回拉 {reversal_strength*100:.1f}%")
 
                 elif extreme_deviation:
                     # 極端偏離：超強回歸力（不可突破）
-                    extreme_strength = random.uniform(0.015, 0.025)  # 1.5-2.5%
+                    extreme_strength = random.uniform(0.015, 0.025) * gravity_scale  # 1.5-2.5%
                     gravity = -deviation * extreme_strength
                     if random.random() < 0.1:  # 10% 機率顯示
                         print(f"[Market] 🔴 {stock.name} 極端偏離 {deviation*100:.1f}%，觸發強制回歸")
 
                 elif abs(deviation) > gravity_threshold_high:
                     # 高度偏離：強回歸（隨機強度 0.8-1.5%）
-                    gravity = -deviation * random.uniform(0.008, 0.015)
+                    gravity = -deviation * random.uniform(0.008, 0.015) * gravity_scale
 
                 elif abs(deviation) > gravity_threshold_mid:
                     # 中度偏離：中等回歸（隨機強度 0.3-0.8%）
-                    gravity = -deviation * random.uniform(0.003, 0.008)
+                    gravity = -deviation * random.uniform(0.003, 0.008) * gravity_scale
 
                 # ROOT 類別更穩定（但仍保留隨機性）
                 if category == 'ROOT':
                     if not is_breakthrough:
                         # ROOT 回歸更強，但仍有隨機性
-                        gravity = -deviation * random.uniform(0.012, 0.018)
+                        gravity = -deviation * random.uniform(0.012, 0.018) * gravity_scale
                     total_individual *= random.uniform(0.45, 0.55)  # 40-50% 影響（微隨機）
                     total_market *= random.uniform(0.25, 0.35)      # 25-35% 影響
                 
-                # 8. 事件影響（從 DB 讀取）
-                statement = select(EventLog).where(
-                    EventLog.target_stock_id == stock.id,
-                    EventLog.created_at >= now - timedelta(seconds=60)
-                )
-                active_events = session.exec(statement).all()
-                total_impact = sum(e.impact_multiplier for e in active_events)
-                event_force = (total_impact / 60.0)
+                # 8. 事件影響（記憶體索引，O(1)）
+                event_force = self.event_index.force(stock.id)
                 
                 # 9. 狙擊手效應（罕見的大波動）
                 sniper_effect = 0
@@ -400,14 +552,7 @@ class MarketEngine:
 
                 # 動態下限保護：使用初始價格的 20-35% 作為軟下限
                 # 計算該股票的初始價格（來自預設列表）
-                initial_price = None
-                for lst in [INITIAL_FRUITS, INITIAL_MEATS, INITIAL_ROOTS]:
-                    for item in lst:
-                        if item["symbol"] == stock.symbol:
-                            initial_price = item["price"]
-                            break
-                    if initial_price:
-                        break
+                initial_price = INITIAL_PRICES.get(stock.symbol)
 
                 # 動態軟下限（有隨機性）
                 if initial_price:
@@ -429,33 +574,7 @@ class MarketEngine:
 
                 # B. Generate New Prediction (Rarely)
                 if random.random() < 0.0005:
-                    # Only check DB if we hit the probability (Save IO)
-                    active_preds = session.exec(select(Prediction).where(Prediction.stock_id == stock.id, Prediction.status == "ACTIVE")).all()
-                    
-                    if len(active_preds) < 1:
-                        try:
-                            gurus = session.exec(select(Guru)).all()
-                            if gurus:
-                                selected_guru = random.choice(gurus)
-                                persona = {"name": selected_guru.name, "bio": selected_guru.bio}
-                                
-                                base_p = self.get_base_price(stock.symbol)
-                                guru_data = ai_service.generate_guru_forecast(stock.name, stock.price, base_price=base_p, guru_persona=persona)
-                                
-                                if guru_data:
-                                    new_pred = Prediction(
-                                        guru_id=selected_guru.id,
-                                        guru_name=guru_data['guru_name'],
-                                        stock_id=stock.id,
-                                        target_price=guru_data['target_price'],
-                                        start_price=stock.price,
-                                        prediction_type=guru_data['prediction_type'],
-                                        description=guru_data['rationale'],
-                                        deadline=datetime.now() + timedelta(minutes=60) 
-                                    )
-                                    session.add(new_pred)
-                        except Exception as e:
-                            print(f"Error generating guru pred: {e}")
+                    self.request_prediction(stock)
 
                 # [OPTIMIZATION] Do NOT add stock to session here. 
                 # Stock updates are In-Memory only until persist_state is called.
@@ -463,13 +582,18 @@ class MarketEngine:
                 # OHLC Aggregation (Buffer)
                 self._update_candle(stock, now)
                 
-            # Only commit if we actually changed Predictions/Events/Gurus
+            # Only commit if we actually changed Events
             if session.new or session.dirty:
                  session.commit()
 
         # 檢查空單保證金（每次 tick 執行）
         self.check_margin_requirements()
-                
+        self.check_alerts()
+
+    def request_prediction(self, stock):
+        """排入大師預測（由 PredictionWorker 在 tick 之外產生）"""
+        self.prediction_requests.append(stock.id)
+
     def _update_candle(self, stock, now):
         sec_bucket = (now.second // 5) * 5
         current_minute = now.replace(second=sec_bucket, microsecond=0)
@@ -488,16 +612,12 @@ class MarketEngine:
         
         if current_minute > candle["start_time"]:
             # Finalize old candle -> Buffer it
-            history = StockPriceHistory(
-                stock_id=stock.id,
-                timestamp=candle["start_time"],
-                open=candle["open"],
-                high=candle["high"],
-                low=candle["low"],
-                close=candle["close"],
-                volume=candle["volume"]
-            )
-            self.history_buffer.append(history) # Add to buffer instead of session
+            self.history_buffer.append((
+                stock.id, candle["start_time"], candle["open"], candle["high"],
+                candle["low"], candle["close"], candle["volume"]
+            )) # Add to buffer instead of session
+            self.rollup.add(stock.id, candle)
+            self.history_cache.invalidate(stock.id)
             
             # Start new candle
             self.candles[stock.id] = {
@@ -589,121 +709,108 @@ class MarketEngine:
                     )
                     session.add(ipo_event)
                     session.commit()
+                    self.record_event(ipo_event)
                     print(f"[Market] IPO Successful: {new_stock.name} ({category})")
                         
                 except Exception as e:
                     print(f"IPO Failed ({category}): {e}")
 
-    def payout_dividends(self):
-        """Pays dividends and Rerolls Yield"""
+    def payout_dividends(self, interval_minutes=120):
+        """Pays dividends and Rerolls Yield（同一個配息區間只結算一次）"""
         print("[Market] Processing dividend payouts for ROOT stocks...")
-        from models import Transaction, TransactionType, BonusLog, User # Late import
+        now = self.clock()
+        # 排程對齊 DIVIDEND_ANCHOR 起的區間格線，觸發只會延遲不會提早：取所在區間的起點作為本期鍵
+        period = dividend_period(now, interval_minutes).strftime("%Y-%m-%dT%H:%M")
+        memory = {s.id: s for s in self.active_stocks}
         
         with self.session_factory() as session:
             # 1. Find all ROOT stocks
             root_stocks = session.exec(select(Stock).where(Stock.category == "ROOT")).all()
             if not root_stocks:
                 return
+
+            run = claim_period(session, "dividend", period)
+            if run is None:
+                print(f"[Market] Dividends for {period} already paid, skipping.")
+                return
             
-            payout_count = 0
-            
+            # Use Stored Yield (or default 1%) at the live in-memory price
+            rates = {}
+            symbols = {stock.id: stock.symbol for stock in root_stocks}
             for stock in root_stocks:
-                # Use Stored Yield (or default 1%)
-                current_yield = getattr(stock, 'dividend_yield', 0.01)
+                current_yield = stock.dividend_yield or 0.01
                 if current_yield <= 0: current_yield = 0.01
-                
-                # Pay Holders
-                portfolios = session.exec(select(Portfolio).where(Portfolio.stock_id == stock.id, Portfolio.quantity > 0)).all()
-                for port in portfolios:
-                    dividend_amount = round(stock.price * port.quantity * current_yield, 2)
-                    
-                    if dividend_amount > 0:
-                        user = session.get(User, port.user_id)
-                        if user:
-                            user.balance += dividend_amount
-                            session.add(user)
-                            
-                            trans = Transaction(
-                                user_id=user.id,
-                                stock_id=stock.id,
-                                type=TransactionType.DIVIDEND,
-                                price=stock.price,
-                                quantity=port.quantity,
-                                profit=dividend_amount # Profit field used for Amount
-                            )
-                            session.add(trans)
-                            payout_count += 1
-                
-                # ROTATE YIELD FOR NEXT 2 HOURS (1% to 5%)
-                next_yield = round(random.uniform(0.01, 0.05), 4)
-                stock.dividend_yield = next_yield
-                session.add(stock)
-                print(f"[Div] {stock.symbol}: Paid {(current_yield*100):.2f}%. Next Payout Rate: {(next_yield*100):.2f}%")
+                price = memory[stock.id].price if stock.id in memory else stock.price
+                rates[stock.id] = (price, current_yield)
+            
+            # Pay Holders (INSERT ... SELECT + 單一 UPDATE)
+            payout_count, total = settle_dividends(session, rates, now)
             
+            # ROTATE YIELD FOR NEXT PERIOD (1% to 5%)
+            next_yields = {sid: round(random.uniform(0.01, 0.05), 4) for sid in symbols}
+            table = Stock.__table__
+            session.execute(
+                update(table).where(table.c.id == bindparam("b_id")).values(dividend_yield=bindparam("b_yield")),
+                [{"b_id": sid, "b_yield": y} for sid, y in next_yields.items()]
+            )
+            run.rows = payout_count
+            run.amount = total
+            session.add(run)
             session.commit()
-            if payout_count > 0:
-                print(f"[Market] Dividends paid to {payout_count} holders.")
+
+        for sid, symbol in symbols.items():
+            if sid in memory:
+                memory[sid].dividend_yield = next_yields[sid]
+            print(f"[Div] {symbol}: Paid {(rates[sid][1]*100):.2f}%. Next Payout Rate: {(next_yields[sid]*100):.2f}%")
+        # 餘額以 SQL 直接更新（不經 ORM 事件）：強平索引下一個 tick 整份重建
+        self.margin_index.invalidate()
+        if payout_count > 0:
+            print(f"[Market] Dividends paid to {payout_count} holders (${total:.2f}).")
 
     def check_margin_requirements(self):
         """
-        檢查所有空單的保證金比率，低於 110% 強制平倉
-        每秒在 update_prices() 後執行
+        檢查空單的保證金比率，低於 110% 強制平倉
+        每秒在 update_prices() 後執行；只處理強平價格索引中門檻被新價格越過的空單
         """
         from models import User, Transaction, TransactionType  # Late import
         from trader import Trader
 
+        prices = {s.id: s.price for s in self.active_stocks}
+
         with self.session_factory() as session:
-            # 找出所有空單持倉
-            short_positions = session.exec(
-                select(Portfolio).where(Portfolio.quantity < 0)
-            ).all()
+            self.margin_index.refresh(session)
+            liquidate, warn = self.margin_index.scan(prices)
 
-            if not short_positions:
+            if not liquidate and not warn:
                 return
 
             force_closed = 0
-
-            for position in short_positions:
-                # 取得股票當前價格（從記憶體）
-                stock_price = None
-                for s in self.active_stocks:
-                    if s.id == position.stock_id:
-                        stock_price = s.price
-                        break
-
-                if not stock_price:
+            stale = set()
+
+            candidates = [(k, True) for k in liquidate] + [(k, False) for k in warn if k not in set(liquidate)]
+            for (user_id, stock_id), is_liquidation in candidates:
+                position = session.exec(select(Portfolio).where(
+                    Portfolio.user_id == user_id, Portfolio.stock_id == stock_id
+                )).first()
+                user = session.get(User, user_id)
+                if not position or not user or position.quantity >= 0:
+                    stale.add(user_id)
                     continue
 
-                # 計算當前空單市值
+                # 以 DB 目前的值重新確認（索引可能尚未反映最新的餘額）
+                stock_price = prices[stock_id]
                 short_qty = abs(position.quantity)
-                current_value = short_qty * stock_price
-
-                # 計算未實現虧損
-                unrealized_loss = (stock_price - position.average_cost) * short_qty
-
-                # 取得使用者餘額
-                user = session.get(User, position.user_id)
-                if not user:
-                    continue
-
-                # 計算保證金比率 = (餘額 + 鎖定保證金) / (當前市值 + 虧損)
-                available_margin = user.balance + position.margin_locked
-                required_margin = current_value + max(0, unrealized_loss)
-
-                if required_margin > 0:
-                    margin_ratio = available_margin / required_margin
-                else:
-                    margin_ratio = 999  # 無風險
+                ratio = margin_ratio(user.balance, position.margin_locked, position.quantity, position.average_cost, stock_price)
 
                 # 強制平倉條件：保證金比率 < 110% (1.1)
-                if margin_ratio < 1.1:
-                    print(f"[Market] 強制平倉！使用者 {user.username} 的 {position.stock_id} 空單，保證金比率 {margin_ratio*100:.2f}%")
+                if ratio < LIQUIDATION_RATIO:
+                    print(f"[Market] 強制平倉！使用者 {user.username} 的 {position.stock_id} 空單，保證金比率 {ratio*100:.2f}%")
 
                     # 執行強制平倉
                     trader = Trader(session)
                     result = trader.cover_short(user, position.stock_id, short_qty, live_price=stock_price)
 
-                    if isinstance(result, Transaction):
+                    if isinstance(result, Transaction) or (isinstance(result, dict) and result.get("status") == "success"):
                         force_closed += 1
 
                         # 記錄強平事件（可選：發送通知給使用者）
@@ -712,78 +819,86 @@ class MarketEngine:
                     session.commit()
 
                 # 警告通知：保證金比率 < 120% (1.2) 但 > 110%
-                elif margin_ratio < 1.2:
-                    print(f"[Market] ⚠️ 保證金警告！使用者 {user.username} 的空單保證金比率 {margin_ratio*100:.2f}%，接近強平線")
+                elif ratio < WARNING_RATIO:
+                    print(f"[Market] ⚠️ 保證金警告！使用者 {user.username} 的空單保證金比率 {ratio*100:.2f}%，接近強平線")
                     # TODO: 發送 WebSocket 通知給使用者
+                    if is_liquidation:
+                        stale.add(user_id)
+                else:
+                    stale.add(user_id)
+
+            # 門檻已過時（餘額增加、已平倉）：重新計算
+            if stale:
+                self.margin_index.refresh_users(session, stale)
 
             if force_closed > 0:
                 print(f"[Market] 本次強制平倉 {force_closed} 個空單")
 
+    def check_alerts(self):
+        """彈出價格已越過門檻的到價提醒，標記為已觸發並排入通知"""
+        from models import Alert  # Late import
+
+        if self.alert_index.needs_rebuild():
+            with self.session_factory() as session:
+                self.alert_index.rebuild(session)
+
+        crossed = self.alert_index.pop_crossed({s.id: s.price for s in self.active_stocks})
+        if not crossed:
+            return
+
+        with self.session_factory() as session:
+            session.exec(update(Alert).where(Alert.id.in_([c[0] for c in crossed])).values(is_triggered=True))
+            session.commit()
+
+        symbols = {s.id: s.symbol for s in self.active_stocks}
+        prices = {s.id: s.price for s in self.active_stocks}
+        notifications = [
+            {
+                "type": "alert",
+                "alert_id": alert_id,
+                "user_id": user_id,
+                "stock_id": stock_id,
+                "symbol": symbols.get(stock_id),
+                "condition": condition,
+                "target_price": target_price,
+                "price": prices.get(stock_id)
+            }
+            for alert_id, user_id, stock_id, target_price, condition in crossed
+        ]
+        self.alert_notifications.extend(notifications)
+
+    def drain_alert_notifications(self):
+        """取出待廣播的提醒通知（廣播工作呼叫）"""
+        notifications = []
+        while self.alert_notifications:
+            notifications.append(self.alert_notifications.popleft())
+        return notifications
+
     def charge_short_interest(self):
         """
-        收取做空利息（每日執行一次）
+        收取做空利息（每日執行一次，同一天只結算一次）
         利率：0.01% per day (年化約 3.65%)
         """
-        from models import User, Transaction, TransactionType  # Late import
-
         DAILY_INTEREST_RATE = 0.0001  # 0.01% 日利率
 
+        now = self.clock()
         with self.session_factory() as session:
-            # 找出所有空單持倉
-            short_positions = session.exec(
-                select(Portfolio).where(Portfolio.quantity < 0)
-            ).all()
-
-            if not short_positions:
+            run = claim_period(session, "short_interest", now.strftime("%Y-%m-%d"))
+            if run is None:
+                print("[Market] 今日做空利息已收取，略過")
                 return
 
-            total_interest = 0
-            interest_count = 0
-
-            for position in short_positions:
-                # 計算利息金額 = |數量| * 平均成本 * 利率
-                short_qty = abs(position.quantity)
-                interest_amount = round(short_qty * position.average_cost * DAILY_INTEREST_RATE, 2)
-
-                if interest_amount <= 0:
-                    continue
-
-                # 取得使用者
-                user = session.get(User, position.user_id)
-                if not user:
-                    continue
-
-                # 扣除利息
-                if user.balance >= interest_amount:
-                    user.balance -= interest_amount
-                    session.add(user)
-
-                    # 記錄利息交易
-                    stock = session.get(Stock, position.stock_id)
-                    if stock:
-                        tx = Transaction(
-                            user_id=user.id,
-                            stock_id=position.stock_id,
-                            type=TransactionType.SHORT_INTEREST,
-                            price=position.average_cost,
-                            quantity=short_qty,
-                            profit=-interest_amount,  # 負數表示支出
-                            timestamp=datetime.utcnow()
-                        )
-                        session.add(tx)
-
-                        total_interest += interest_amount
-                        interest_count += 1
-
-                    # 更新最後收費時間
-                    position.last_interest_charged = datetime.utcnow()
-                    session.add(position)
-                else:
-                    # 餘額不足支付利息 - 強制平倉
-                    print(f"[Market] 使用者 {user.username} 餘額不足支付做空利息，觸發強制平倉")
-                    # 由 check_margin_requirements 處理
-
+            interest_count, total_interest, skipped = settle_short_interest(session, DAILY_INTEREST_RATE, now)
+            run.rows = interest_count
+            run.amount = total_interest
+            session.add(run)
             session.commit()
 
-            if interest_count > 0:
-                print(f"[Market] 做空利息收取完成：共 {interest_count} 筆，總計 ${total_interest:.2f}")
+        # 餘額以 SQL 直接更新（不經 ORM 事件）：強平索引下一個 tick 整份重建
+        self.margin_index.invalidate()
+
+        if skipped:
+            # 餘額不足支付利息 - 由 check_margin_requirements 處理
+            print(f"[Market] {skipped} 位使用者餘額不足支付做空利息")
+        if interest_count > 0:
+            print(f"[Market] 做空利息收取完成：共 {interest_count} 筆，總計 ${total_interest:.2f}")
@@ -0,0 +1,83 @@
+"""
+市場快照
+行情執行緒每個 tick 產生一份不可變、帶版本號的快照，
+廣播與交易 API 直接讀取目前的快照參考，不需要任何鎖。
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from types import MappingProxyType
+from typing import Any, Mapping, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class MarketSnapshot:
+    version: int
+    created_at: datetime
+    stocks: Tuple[Mapping[str, Any], ...]  # 每檔股票的 model_dump()（唯讀）
+    prices: Mapping[int, float]  # {stock_id: price}
+    market_regimes: Mapping[str, str]
+    regime_durations: Mapping[str, int]
+    event: Optional[Mapping[str, Any]] = None
+    forecast: Optional[Mapping[str, Any]] = None
+    race: Optional[Mapping[str, Any]] = None
+
+    def price(self, stock_id):
+        return self.prices.get(stock_id)
+
+    def stocks_data(self):
+        """可序列化的股票清單（複本）"""
+        return [dict(s) for s in self.stocks]
+
+    def meta(self):
+        """股票以外的廣播內容（事件、預告、賽馬、Regime）"""
+        return {
+            "event": dict(self.event) if self.event else None,
+            "forecast": dict(self.forecast) if self.forecast else None,
+            "race": dict(self.race) if self.race else None,
+            "market_regimes": dict(self.market_regimes),
+            "regime_durations": dict(self.regime_durations)
+        }
+
+    def tick_message(self):
+        """WebSocket tick 廣播內容"""
+        return {"type": "tick", "stocks": self.stocks_data(), **self.meta()}
+
+
+def build_snapshot(version, stocks_data, market_regimes, regime_durations, event=None, forecast=None, race=None):
+    """由可變的引擎狀態複製出一份唯讀快照"""
+    stocks = tuple(MappingProxyType(dict(s)) for s in stocks_data)
+    return MarketSnapshot(
+        version=version,
+        created_at=datetime.now(),
+        stocks=stocks,
+        prices=MappingProxyType({s["id"]: s["price"] for s in stocks}),
+        market_regimes=MappingProxyType(dict(market_regimes)),
+        regime_durations=MappingProxyType(dict(regime_durations)),
+        event=MappingProxyType(dict(event)) if event else None,
+        forecast=MappingProxyType(dict(forecast)) if forecast else None,
+        race=MappingProxyType(dict(race)) if race else None
+    )
+
+
+class SnapshotStore:
+    """單一寫入者（行情執行緒）/ 多讀取者；發佈只是替換參考，讀取端無鎖"""
+
+    def __init__(self):
+        self._current = None
+
+    @property
+    def current(self) -> Optional[MarketSnapshot]:
+        return self._current
+
+    @property
+    def version(self):
+        snapshot = self._current
+        return snapshot.version if snapshot else 0
+
+    def publish(self, snapshot: MarketSnapshot):
+        self._current = snapshot
+
+    def price(self, stock_id):
+        """取得最新價格，尚無快照時回傳 None（呼叫端改用 DB 價格）"""
+        snapshot = self._current
+        return snapshot.price(stock_id) if snapshot else None
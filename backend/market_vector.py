@@ -0,0 +1,242 @@
+"""
+向量化行情引擎 (Structure-of-Arrays)
+與 MarketEngine.update_prices 的逐檔邏輯相同（相同的機率分佈），
+但把每檔股票的狀態存成 numpy 陣列，一次批次計算所有股票。
+逐檔版本的 print（基準價重設、假突破反轉、狙擊手）不輸出，批次計算中不逐檔寫 stdout。
+"""
+import numpy as np
+
+from market import INITIAL_PRICES, GRAVITY_STRENGTH_BASE
+
+CATEGORY_CODES = {"FRUIT": 0, "MEAT": 1, "ROOT": 2}
+OTHER_CATEGORY = 3  # 未知分類：視為 NORMAL 市場，無 ROOT 特殊規則
+
+REGIME_CODES = {"NORMAL": 0, "BOOM": 1, "CRASH": 2, "CHAOS": 3}
+
+TREND_DIRECTIONS = np.array([1, 1, 1, -1, -1, -1, 0], dtype=np.int8)  # 70% 有方向，30% 橫盤
+SNIPER_EFFECTS = np.array([0.02, -0.02, 0.01, -0.01])
+HERD_DIRECTIONS = np.array([1.0, -1.0])
+
+
+class VectorMarketKernel:
+    def __init__(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+        self.stocks = []  # 與陣列同序的 Stock 物件
+        self._layout = None  # (id(active_stocks), len(active_stocks))
+
+    def _load(self, engine):
+        """從 engine.active_stocks / base_prices / stock_trends 建立陣列"""
+        stocks = list(engine.active_stocks)
+        self.stocks = stocks
+        self.ids = [s.id for s in stocks]
+        self.symbols = [s.symbol for s in stocks]
+        self.index = {sid: i for i, sid in enumerate(self.ids)}
+
+        self.price = np.array([s.price for s in stocks], dtype=np.float64)
+        self.day_open = np.array([s.day_open for s in stocks], dtype=np.float64)
+        self.base = np.array([engine.get_base_price(s.symbol) for s in stocks], dtype=np.float64)
+        # 沒有初始價格（IPO 新股）的位置為 NaN，所有下限比較自動失效
+        self.initial = np.array([INITIAL_PRICES.get(s.symbol, np.nan) for s in stocks], dtype=np.float64)
+        self.category = np.array(
+            [CATEGORY_CODES.get(getattr(s, 'category', 'FRUIT'), OTHER_CATEGORY) for s in stocks],
+            dtype=np.int8
+        )
+
+        n = len(stocks)
+        self.t_direction = np.zeros(n, dtype=np.int8)
+        self.t_strength = np.zeros(n, dtype=np.float64)
+        self.t_duration = np.zeros(n, dtype=np.int32)  # 0 = 下一個 tick 重新產生趨勢
+        self.t_momentum = np.zeros(n, dtype=np.float64)
+        for i, sid in enumerate(self.ids):
+            trend = engine.stock_trends.get(sid)
+            if trend:
+                self.t_direction[i] = trend["direction"]
+                self.t_strength[i] = trend["strength"]
+                self.t_duration[i] = trend["duration"]
+                self.t_momentum[i] = trend["momentum"]
+
+        self._layout = (id(engine.active_stocks), len(engine.active_stocks))
+
+    def export_state(self, engine):
+        """把陣列狀態寫回 engine.base_prices / stock_trends（切換股票清單或快照時使用）"""
+        if self._layout is None:
+            return
+        engine.base_prices.update(zip(self.symbols, self.base.tolist()))
+        for i, sid in enumerate(self.ids):
+            engine.stock_trends[sid] = {
+                "direction": int(self.t_direction[i]),
+                "strength": float(self.t_strength[i]),
+                "duration": int(self.t_duration[i]),
+                "momentum": float(self.t_momentum[i])
+            }
+
+    def sync(self, engine):
+        """active_stocks 被替換或新增股票時重建陣列"""
+        layout = (id(engine.active_stocks), len(engine.active_stocks))
+        if layout != self._layout:
+            self.export_state(engine)
+            self._load(engine)
+
+    def step(self, engine, session, now, day_changed, params):
+        self.sync(engine)
+        n = len(self.stocks)
+        if n == 0:
+            return
+        rng = self.rng
+        price = self.price
+
+        if day_changed:
+            self.day_open[:] = price
+        unset_open = self.day_open == 0
+        if unset_open.any():
+            self.day_open[unset_open] = price[unset_open]
+
+        # 1. 個別趨勢：到期者重新產生
+        expired = self.t_duration <= 0
+        k = int(np.count_nonzero(expired))
+        if k:
+            self.t_direction[expired] = rng.choice(TREND_DIRECTIONS, k)
+            self.t_strength[expired] = rng.uniform(0.0002, 0.0012, k)
+            self.t_duration[expired] = rng.integers(int(params["trend_duration_min"]), int(params["trend_duration_max"]) + 1, k)
+            self.t_momentum[expired] = rng.uniform(0.8, 1.2, k)
+        self.t_duration -= 1
+
+        # 2. 個別股票的變化（60%）
+        individual_trend = self.t_direction * self.t_strength * self.t_momentum
+        individual_change = (individual_trend + rng.normal(0, 0.0003, n)) * params["individual_weight"]
+
+        # 3. 市場影響（40%）：依分類取得各自的 Regime
+        regime_by_category = np.array([
+            REGIME_CODES[engine.market_regimes.get("FRUIT", "NORMAL")],
+            REGIME_CODES[engine.market_regimes.get("MEAT", "NORMAL")],
+            REGIME_CODES[engine.market_regimes.get("ROOT", "NORMAL")],
+            REGIME_CODES["NORMAL"],
+        ], dtype=np.int8)
+        regime = regime_by_category[self.category]
+        boom = regime == REGIME_CODES["BOOM"]
+        crash = regime == REGIME_CODES["CRASH"]
+        chaos = regime == REGIME_CODES["CHAOS"]
+
+        regime_bias = np.zeros(n)
+        regime_vol_mult = np.ones(n)
+        k = int(np.count_nonzero(boom))
+        if k:
+            regime_bias[boom] = rng.uniform(0.0003, 0.0005, k)
+            regime_vol_mult[boom] = rng.uniform(1.2, 1.4, k)
+        k = int(np.count_nonzero(crash))
+        if k:
+            regime_bias[crash] = rng.uniform(-0.0005, -0.0003, k)
+            regime_vol_mult[crash] = rng.uniform(1.3, 1.6, k)
+        k = int(np.count_nonzero(chaos))
+        if k:
+            regime_vol_mult[chaos] = rng.uniform(2.0, 3.0, k)
+        is_major_event = crash | chaos
+
+        market_noise = rng.normal(regime_bias, 0.0005 * regime_vol_mult)
+
+        # 4. 大事件時市場影響增強（從 40% 變成 70%），個別趨勢降到 30%
+        major_market_weight = params["major_event_market_weight"]
+        total_individual = np.where(is_major_event, individual_change * (1 - major_market_weight), individual_change)
+        total_market = market_noise * np.where(is_major_event, major_market_weight, params["market_weight"])
+
+        # 5. 群體效應（3% 機率）
+        herd = rng.random(n) < params["herd_effect_chance"]
+        herd_effect = np.zeros(n)
+        k = int(np.count_nonzero(herd))
+        if k:
+            herd_effect[herd] = rng.choice(HERD_DIRECTIONS, k) * rng.uniform(0.0003, 0.0008, k)
+
+        # 6. 基準價動態漂移，下限為初始價格的 50%
+        base = self.base * (1 + rng.normal(0, 0.0005, n))
+        base = np.fmax(base, self.initial * 0.50)  # fmax 忽略 NaN（無初始價格）
+        reset = rng.random(n) < 0.002
+        base[reset] = price[reset]
+        np.maximum(base, 1.0, out=base)
+        self.base = base
+
+        # 7. 重力回歸
+        deviation = (price - base) / base
+        abs_dev = np.abs(deviation)
+        threshold_mult = rng.uniform(0.80, 1.25, (3, n))
+        gravity_threshold_extreme = 0.60 * threshold_mult[0]
+        gravity_threshold_high = 0.40 * threshold_mult[1]
+        gravity_threshold_mid = 0.25 * threshold_mult[2]
+
+        is_breakthrough = chaos | (rng.random(n) < params["breakthrough_chance"])
+        sudden_reversal = (rng.random(n) < 0.08) & (abs_dev > 0.20)
+        extreme_deviation = abs_dev > gravity_threshold_extreme
+
+        # 與逐檔版本的 if/elif 鏈相同：第一個成立的條件決定重力強度
+        gravity_strength = np.select(
+            [
+                is_breakthrough & ~sudden_reversal & ~extreme_deviation,
+                sudden_reversal,
+                extreme_deviation,
+                abs_dev > gravity_threshold_high,
+                abs_dev > gravity_threshold_mid,
+            ],
+            [
+                0.0,
+                rng.uniform(0.020, 0.035, n),
+                rng.uniform(0.015, 0.025, n),
+                rng.uniform(0.008, 0.015, n),
+                rng.uniform(0.003, 0.008, n),
+            ],
+            default=0.0
+        )
+        gravity_scale = params["gravity_strength"] / GRAVITY_STRENGTH_BASE
+        gravity_strength *= gravity_scale
+        gravity = -deviation * gravity_strength
+
+        # ROOT 類別更穩定
+        root = self.category == CATEGORY_CODES["ROOT"]
+        k = int(np.count_nonzero(root))
+        if k:
+            root_gravity = root & ~is_breakthrough
+            kg = int(np.count_nonzero(root_gravity))
+            if kg:
+                gravity[root_gravity] = -deviation[root_gravity] * rng.uniform(0.012, 0.018, kg) * gravity_scale
+            total_individual[root] *= rng.uniform(0.45, 0.55, k)
+            total_market[root] *= rng.uniform(0.25, 0.35, k)
+
+        # 8. 事件影響
+        event_force = np.zeros(n)
+        for stock_id, force in engine.event_index.forces().items():
+            i = self.index.get(stock_id)
+            if i is not None:
+                event_force[i] = force
+
+        # 9. 狙擊手效應
+        sniper = rng.random(n) < 0.0002
+        sniper_effect = np.zeros(n)
+        k = int(np.count_nonzero(sniper))
+        if k:
+            sniper_effect[sniper] = rng.choice(SNIPER_EFFECTS, k)
+
+        # FINAL CALCULATION
+        change_percent = total_individual + total_market + gravity + herd_effect + event_force + sniper_effect
+        price = price * (1 + change_percent)
+
+        # 動態軟下限：初始價格的 20-35%，跌破時 85% 機率反彈 2-8%
+        soft_floor = self.initial * rng.uniform(0.20, 0.35, n)
+        bounce = (price < soft_floor) & (rng.random(n) < 0.85)
+        k = int(np.count_nonzero(bounce))
+        if k:
+            price[bounce] = soft_floor[bounce] * rng.uniform(1.02, 1.08, k)
+
+        # 絕對硬下限：$0.01
+        price = np.maximum(np.round(price, 2), 0.01)
+        self.price = price
+
+        # 寫回 Stock 物件（廣播與交易讀取）並更新 K 線
+        day_open_list = self.day_open.tolist() if (day_changed or unset_open.any()) else None
+        for i, (stock, p) in enumerate(zip(self.stocks, price.tolist())):
+            stock.price = p
+            if day_open_list is not None:
+                stock.day_open = day_open_list[i]
+            engine._update_candle(stock, now)
+        engine.base_prices.update(zip(self.symbols, base.tolist()))
+
+        # B. Generate New Prediction (Rarely)
+        for i in np.flatnonzero(rng.random(n) < 0.0005):
+            engine.request_prediction(self.stocks[i])
@@ -0,0 +1,51 @@
+"""
+行情模擬執行緒
+在獨立執行緒上以固定頻率執行 tick（含阻塞的 DB I/O），
+完成後發佈新的市場快照，asyncio 事件迴圈只負責廣播。
+"""
+import math
+import threading
+import time
+import traceback
+
+
+class MarketWorker(threading.Thread):
+    def __init__(self, tick_fn, snapshot_fn, store, interval=1.0, on_publish=None):
+        super().__init__(name="market-tick", daemon=True)
+        self.tick_fn = tick_fn  # 執行一次模擬（更新價格、事件、賽馬）
+        self.snapshot_fn = snapshot_fn  # snapshot_fn(version) -> MarketSnapshot
+        self.store = store
+        self.interval = interval
+        self.on_publish = on_publish  # 發佈後的通知（會在行情執行緒上呼叫）
+        self._stop_event = threading.Event()
+        self.last_duration = 0.0
+        self.overruns = 0
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        print(f"[MarketWorker] Started (interval {self.interval}s)")
+        next_deadline = time.monotonic()
+        while not self._stop_event.is_set():
+            started = time.monotonic()
+            try:
+                self.tick_fn()
+                snapshot = self.snapshot_fn(self.store.version + 1)
+                self.store.publish(snapshot)
+                if self.on_publish:
+                    self.on_publish(snapshot)
+            except Exception as e:
+                print(f"[MarketWorker] Tick Error: {e}")
+                traceback.print_exc()
+            self.last_duration = time.monotonic() - started
+
+            # 固定節拍：超時則跳過落後的節拍，不連續補跑
+            next_deadline += self.interval
+            now = time.monotonic()
+            if now > next_deadline:
+                self.overruns += 1
+                missed = math.ceil((now - next_deadline) / self.interval)
+                next_deadline += missed * self.interval
+            self._stop_event.wait(next_deadline - now)
+        print("[MarketWorker] Stopped")
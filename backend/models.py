@@ -1,6 +1,6 @@
 from typing import Optional, List
 from sqlmodel import Field, SQLModel, Relationship
-from sqlalchemy import BigInteger, Column
+from sqlalchemy import BigInteger, Column, Index, UniqueConstraint
 from datetime import datetime
 from enum import Enum
 
@@ -46,8 +46,11 @@ class Stock(SQLModel, table=True):
     predictions: List["Prediction"] = Relationship(back_populates="stock")
 
 class StockPriceHistory(SQLModel, table=True):
+    # 查詢一律是「某檔股票的一段時間」，用 (stock_id, timestamp) 複合索引
+    __table_args__ = (Index("ix_stockpricehistory_stock_id_timestamp", "stock_id", "timestamp"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    stock_id: int = Field(foreign_key="stock.id", index=True)
+    stock_id: int = Field(foreign_key="stock.id")
     timestamp: datetime = Field(default_factory=datetime.now, index=True)
     open: float
     high: float
@@ -55,6 +58,20 @@ class StockPriceHistory(SQLModel, table=True):
     close: float
     volume: int = Field(default=0)
 
+class StockCandle(SQLModel, table=True):
+    """多週期 K 線（1m/5m/15m/1h/4h/1d），由 5 秒 K 線收盤時即時累加"""
+    __table_args__ = (UniqueConstraint("stock_id", "resolution", "timestamp"),)  # 同時作為範圍查詢索引
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    stock_id: int = Field(foreign_key="stock.id")
+    resolution: str = Field(max_length=4)  # "1m", "5m", "15m", "1h", "4h", "1d"
+    timestamp: datetime  # 區間起點（本地時間，與 StockPriceHistory 相同）
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: int = Field(default=0)
+
 class EventLog(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     title: str
@@ -92,6 +109,17 @@ class Transaction(SQLModel, table=True):
     user: User = Relationship(back_populates="transactions")
     stock: Stock = Relationship(back_populates="transactions")
 
+class SettlementRun(SQLModel, table=True):
+    """已完成的結算（配息 / 做空利息），同一期只能結算一次"""
+    __table_args__ = (UniqueConstraint("kind", "period"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    kind: str  # "dividend", "short_interest"
+    period: str  # 結算期間，如 "2025-01-01" 或 "2025-01-01T10:00"
+    rows: int = Field(default=0)
+    amount: float = Field(default=0.0)
+    created_at: datetime = Field(default_factory=datetime.now)
+
 class Alert(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="user.id")
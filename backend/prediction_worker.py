@@ -0,0 +1,175 @@
+"""
+大師預測工作
+tick 只把抽中的股票排入 MarketEngine.prediction_requests，
+由排程（每 10 秒，在排程器的執行緒上）批次產生預測，並一次結算所有 ACTIVE 預測：
+  - 建立後的最高價 / 最低價觸及目標價 → FULFILLED（大師勝場 +1）
+  - 超過期限仍未觸及 → FAILED
+價格區間由 5 秒 K 線 (StockPriceHistory) 的單一聚合查詢，加上尚未寫入 DB 的 K 線與進行中的 K 線取得。
+"""
+import random
+import threading
+from datetime import timedelta
+
+from sqlalchemy import and_, bindparam, func, update
+from sqlmodel import select
+
+from models import Guru, Prediction, StockPriceHistory
+import ai_service
+
+PREDICTION_MINUTES = 60
+
+
+class PredictionWorker:
+    def __init__(self, market, session_factory=None, clock=None):
+        self.market = market
+        self.session_factory = session_factory or market.session_factory
+        self.clock = clock or market.clock
+        self._lock = threading.Lock()  # 排程與手動呼叫不重疊
+
+    def run(self):
+        with self._lock:
+            try:
+                self.generate()
+                self.resolve()
+            except Exception as e:
+                print(f"[Predictions] Error: {e}")
+
+    def generate(self):
+        """為排隊中的股票產生預測（已有 ACTIVE 預測的股票略過），回傳新增筆數"""
+        requests = self.market.prediction_requests
+        stock_ids = set()
+        while requests:
+            stock_ids.add(requests.popleft())
+        if not stock_ids:
+            return 0
+
+        now = self.clock()
+        stocks = {s.id: s for s in self.market.active_stocks}
+        with self.session_factory() as session:
+            busy = set(session.exec(select(Prediction.stock_id).where(
+                Prediction.status == "ACTIVE",
+                Prediction.stock_id.in_(stock_ids)
+            )).all())
+            gurus = session.exec(select(Guru)).all()
+            if not gurus:
+                return 0
+
+            created = []
+            for stock_id in stock_ids - busy:
+                stock = stocks.get(stock_id)
+                if stock is None:
+                    continue
+                guru = random.choice(gurus)
+                persona = {"name": guru.name, "bio": guru.bio}
+                try:
+                    guru_data = ai_service.generate_guru_forecast(
+                        stock.name, stock.price,
+                        base_price=self.market.get_base_price(stock.symbol), guru_persona=persona
+                    )
+                except Exception as e:
+                    print(f"Error generating guru pred: {e}")
+                    continue
+                if not guru_data:
+                    continue
+                created.append(Prediction(
+                    guru_id=guru.id,
+                    guru_name=guru_data['guru_name'],
+                    stock_id=stock.id,
+                    target_price=guru_data['target_price'],
+                    start_price=stock.price,
+                    prediction_type=guru_data['prediction_type'],
+                    description=guru_data['rationale'],
+                    deadline=now + timedelta(minutes=PREDICTION_MINUTES),
+                    created_at=now
+                ))
+            if created:
+                session.add_all(created)
+                session.commit()
+        return len(created)
+
+    def _price_ranges(self, session, active):
+        """{prediction_id: [最高價, 最低價]}（建立後到期限前）"""
+        ranges = {}
+        rows = session.exec(
+            select(Prediction.id, func.max(StockPriceHistory.high), func.min(StockPriceHistory.low))
+            .join(StockPriceHistory, and_(
+                StockPriceHistory.stock_id == Prediction.stock_id,
+                StockPriceHistory.timestamp >= Prediction.created_at,
+                StockPriceHistory.timestamp <= Prediction.deadline
+            ))
+            .where(Prediction.status == "ACTIVE")
+            .group_by(Prediction.id)
+        ).all()
+        for pred_id, high, low in rows:
+            ranges[pred_id] = [high, low]
+
+        by_stock = {}
+        for p in active:
+            by_stock.setdefault(p.stock_id, []).append(p)
+
+        def merge(stock_id, ts, high, low):
+            for p in by_stock.get(stock_id, ()):
+                if p.created_at <= ts <= p.deadline:
+                    current = ranges.setdefault(p.id, [high, low])
+                    current[0] = max(current[0], high)
+                    current[1] = min(current[1], low)
+
+        # 尚未寫入 DB 的 5 秒 K 線與進行中的 K 線
+        for stock_id, ts, _, high, low, _, _ in self.market.history_buffer.peek():
+            merge(stock_id, ts, high, low)
+        for stock_id, candle in list(self.market.candles.items()):
+            merge(stock_id, candle["start_time"], candle["high"], candle["low"])
+        return ranges
+
+    def resolve(self):
+        """一次結算所有 ACTIVE 預測並批次更新大師戰績，回傳 (fulfilled, failed)"""
+        now = self.clock()
+        with self.session_factory() as session:
+            active = session.exec(select(
+                Prediction.id, Prediction.guru_id, Prediction.stock_id, Prediction.prediction_type,
+                Prediction.target_price, Prediction.created_at, Prediction.deadline
+            ).where(Prediction.status == "ACTIVE")).all()
+            if not active:
+                return 0, 0
+
+            ranges = self._price_ranges(session, active)
+            fulfilled = []
+            failed = []
+            stats = {}  # {guru_id: [wins, total]}
+            for p in active:
+                high, low = ranges.get(p.id, (None, None))
+                if p.prediction_type == "BULL":
+                    hit = high is not None and high >= p.target_price
+                else:
+                    hit = low is not None and low <= p.target_price
+                if hit:
+                    fulfilled.append(p.id)
+                elif now >= p.deadline:
+                    failed.append(p.id)
+                else:
+                    continue
+                if p.guru_id is not None:
+                    counts = stats.setdefault(p.guru_id, [0, 0])
+                    counts[0] += 1 if hit else 0
+                    counts[1] += 1
+
+            if not fulfilled and not failed:
+                return 0, 0
+            if fulfilled:
+                session.exec(update(Prediction).where(Prediction.id.in_(fulfilled)).values(status="FULFILLED"))
+            if failed:
+                session.exec(update(Prediction).where(Prediction.id.in_(failed)).values(status="FAILED"))
+            if stats:
+                guru = Guru.__table__
+                session.execute(
+                    update(guru)
+                    .where(guru.c.id == bindparam("b_id"))
+                    .values(
+                        wins=guru.c.wins + bindparam("b_wins"),
+                        total_predictions=guru.c.total_predictions + bindparam("b_total")
+                    ),
+                    [{"b_id": gid, "b_wins": wins, "b_total": total} for gid, (wins, total) in stats.items()]
+                )
+            session.commit()
+        print(f"[Predictions] Resolved {len(fulfilled)} fulfilled, {len(failed)} failed")
+        return len(fulfilled), len(failed)
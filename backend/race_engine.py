@@ -6,11 +6,21 @@ from sqlmodel import select, Session
 from models import Horse, Race, Bet, User, Transaction, TransactionType, EventLog
 
 HORSE_NAMES_PREFIX = ["超級", "閃電", "無敵", "暴風", "黃金", "赤兔", "飛天", "神速", "絕影", "快樂", "幸運", "瘋狂"]
+# 可調整的賽馬參數（對應後台 SystemConfig 的 race.* 設定）
+DEFAULT_RACE_PARAMS = {
+    "bet_deadline_seconds": 20,  # 起跑前多久關閉下注
+    "race_duration_seconds": 30,  # 起跑到結算
+    "min_odds": 1.01,
+    "max_odds": 0.0,  # 0：不設上限
+    "interval_seconds": 600,  # 排定新比賽時距離起跑的時間
+}
+
 HORSE_NAMES_SUFFIX = ["馬", "龍", "虎", "豹", "王", "星", "寶貝", "戰士", "刺客", "老爹", "小子", "旋風"]
 
 class RaceEngine:
     def __init__(self, session_factory):
         self.session_factory = session_factory
+        self.params = dict(DEFAULT_RACE_PARAMS)
     
     def initialize_horses(self):
         """Creates initial batch of horses if none exist."""
@@ -75,6 +85,7 @@ class RaceEngine:
         # 3. Fair Odds = 1 / Probability
         # 4. House Edge = 1.15x (lower odds)
         
+        params = self.params
         snapshot = []
         for i, p in enumerate(scores):
             prob = p["score"] / total_score
@@ -85,7 +96,9 @@ class RaceEngine:
             house_edge_factor = 0.90
             final_odds = round(fair_odds * house_edge_factor, 2)
             
-            if final_odds < 1.01: final_odds = 1.01
+            final_odds = max(final_odds, params["min_odds"])
+            if params["max_odds"] > 0:
+                final_odds = min(final_odds, params["max_odds"])
             
             snapshot.append({
                 "lane": i + 1,
@@ -95,7 +108,7 @@ class RaceEngine:
                 "score": p["score"] # hidden debug info
             })
         
-        start_time = datetime.now() + timedelta(minutes=10) # 10 mins interval for production
+        start_time = datetime.now() + timedelta(seconds=params["interval_seconds"])
         race = Race(
             start_time=start_time,
             status="OPEN", # Allow betting immediately
@@ -115,11 +128,12 @@ class RaceEngine:
                 return
 
             now = datetime.now()
+            params = self.params
             
             # State Machine
             if race.status == "OPEN":
-                # Close betting 20s before start
-                if now >= race.start_time - timedelta(seconds=20):
+                # Close betting before start
+                if now >= race.start_time - timedelta(seconds=params["bet_deadline_seconds"]):
                     race.status = "CLOSED"
                     session.add(race)
                     print(f"Race {race.id} Betting CLOSED.")
@@ -175,10 +189,9 @@ class RaceEngine:
                     session.commit()
             
             elif race.status == "RUNNING":
-                # Run for 45 seconds then Finish
+                # Run for race_duration_seconds then Finish
                 # We determine result NOW if we haven't already (actually we settle at finish)
-                # Let's say race takes 30s
-                if now >= race.start_time + timedelta(seconds=30):
+                if now >= race.start_time + timedelta(seconds=params["race_duration_seconds"]):
                     self._finish_race(session, race)
 
     def _finish_race(self, session: Session, race: Race):
@@ -0,0 +1,112 @@
+"""
+集合式結算
+配息與做空利息以少數幾個 SQL 語句結算（INSERT ... SELECT 寫入交易紀錄、單一 UPDATE 調整餘額），
+DB 往返次數與持有人數無關；持有人極多時依 user_id 區間分批。
+每次結算先寫入 SettlementRun (kind, period)，同一期重複觸發（排程重試、多副本）會因唯一鍵衝突而略過。
+"""
+from sqlalchemy import Float, Numeric, and_, case, cast, func, insert, literal, select, update
+from sqlalchemy.exc import IntegrityError
+
+from models import Portfolio, SettlementRun, Transaction, TransactionType, User
+
+CHUNK_USERS = 10000  # 每批涵蓋的 user_id 區間
+
+_tx = Transaction.__table__
+_pf = Portfolio.__table__
+_user = User.__table__
+
+
+def _money(expr):
+    """四捨五入到分（Postgres 的 round(x, n) 只接受 numeric）"""
+    return cast(func.round(cast(expr, Numeric), 2), Float)
+
+
+def claim_period(session, kind, period):
+    """登記本期結算，已結算過回傳 None"""
+    run = SettlementRun(kind=kind, period=period)
+    session.add(run)
+    try:
+        session.flush()
+    except IntegrityError:
+        session.rollback()
+        return None
+    return run
+
+
+def _user_chunks(session, condition, chunk_users):
+    low, high = session.execute(select(func.min(_pf.c.user_id), func.max(_pf.c.user_id)).where(condition)).one()
+    if low is None:
+        return []
+    return [(start, start + chunk_users - 1) for start in range(low, high + 1, chunk_users)]
+
+
+def _ledger_columns():
+    return ["user_id", "stock_id", "type", "price", "quantity", "profit", "timestamp"]
+
+
+def settle_dividends(session, rates, now, chunk_users=CHUNK_USERS):
+    """rates: {stock_id: (price, yield)}；回傳 (筆數, 總金額)"""
+    if not rates:
+        return 0, 0.0
+    price = case({sid: p for sid, (p, _) in rates.items()}, value=_pf.c.stock_id)
+    rate = case({sid: y for sid, (_, y) in rates.items()}, value=_pf.c.stock_id)
+    amount = _money(_pf.c.quantity * price * rate)
+    holders = and_(_pf.c.stock_id.in_(list(rates)), _pf.c.quantity > 0, amount > 0)
+
+    rows, total = 0, 0.0
+    for low, high in _user_chunks(session, holders, chunk_users):
+        chunk = and_(holders, _pf.c.user_id.between(low, high))
+        count, paid = session.execute(select(func.count(), func.coalesce(func.sum(amount), 0.0)).where(chunk)).one()
+        if not count:
+            continue
+
+        session.execute(insert(_tx).from_select(_ledger_columns(), select(
+            _pf.c.user_id, _pf.c.stock_id, literal(TransactionType.DIVIDEND, _tx.c.type.type),
+            price, _pf.c.quantity, amount, literal(now, _tx.c.timestamp.type)
+        ).where(chunk)))
+
+        owed = select(func.sum(amount)).where(chunk, _pf.c.user_id == _user.c.id).scalar_subquery()
+        session.execute(
+            update(_user)
+            .where(_user.c.id.in_(select(_pf.c.user_id).where(chunk)))
+            .values(balance=_user.c.balance + owed)
+        )
+        rows += count
+        total += paid
+    return rows, total
+
+
+def settle_short_interest(session, daily_rate, now, chunk_users=CHUNK_USERS):
+    """收取做空利息；餘額不足支付全部利息的使用者略過（由強平處理）。回傳 (筆數, 總金額, 略過人數)"""
+    shorts = _pf.alias("p2")
+    interest = _money(-_pf.c.quantity * _pf.c.average_cost * daily_rate)
+    user_interest = select(func.coalesce(func.sum(_money(-shorts.c.quantity * shorts.c.average_cost * daily_rate)), 0.0)).where(
+        shorts.c.user_id == _user.c.id, shorts.c.quantity < 0
+    ).scalar_subquery()
+    positions = and_(_pf.c.quantity < 0, interest > 0)
+
+    rows, total, skipped = 0, 0.0, 0
+    for low, high in _user_chunks(session, positions, chunk_users):
+        users = and_(_user.c.id.between(low, high), _user.c.id.in_(select(_pf.c.user_id).where(positions)))
+        eligible = select(_user.c.id).where(users, _user.c.balance >= user_interest)
+        chunk = and_(positions, _pf.c.user_id.in_(eligible))
+
+        count, charged = session.execute(select(func.count(), func.coalesce(func.sum(interest), 0.0)).where(chunk)).one()
+        skipped += session.execute(select(func.count()).select_from(_user).where(users, _user.c.balance < user_interest)).scalar()
+        if not count:
+            continue
+
+        session.execute(insert(_tx).from_select(_ledger_columns(), select(
+            _pf.c.user_id, _pf.c.stock_id, literal(TransactionType.SHORT_INTEREST, _tx.c.type.type),
+            _pf.c.average_cost, -_pf.c.quantity, -interest, literal(now, _tx.c.timestamp.type)
+        ).where(chunk)))
+        # 先更新持倉再扣餘額（eligible 以扣款前的餘額判斷）
+        session.execute(update(_pf).where(chunk).values(last_interest_charged=now))
+        session.execute(
+            update(_user)
+            .where(users, _user.c.balance >= user_interest)
+            .values(balance=_user.c.balance - user_interest)
+        )
+        rows += count
+        total += charged
+    return rows, total, skipped
@@ -0,0 +1,246 @@
+"""
+離線快轉市場模擬器
+在記憶體 SQLite 上驅動 MarketEngine / EventSystem / Regime 機制，
+不需要排程器、Redis 與真實時鐘，以 CPU 最快速度跑完數天到數週的 1 秒 tick。
+輸出 K 線序列與統計摘要（最大回撤、跌破軟下限時間、各 Regime 停留時間）。
+
+用法:
+    python simulator.py --days 1 --seed 42 --out sim_result.json
+    python simulator.py --hours 6 --mode vector
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy.pool import StaticPool
+from sqlmodel import SQLModel, Session, create_engine
+
+from models import Stock, Guru
+from market import MarketEngine, INITIAL_FRUITS, INITIAL_MEATS, INITIAL_ROOTS, INITIAL_GURUS, INITIAL_PRICES
+from events import EventSystem
+from history_journal import HistoryBuffer
+
+SOFT_FLOOR_RATIO = 0.35  # 軟下限區間上緣（update_prices 使用初始價格的 20-35%）
+DEFAULT_START = datetime(2024, 1, 1, 9, 0, 0)
+
+
+class SimClock:
+    """手動推進的時鐘，取代 datetime.now"""
+
+    def __init__(self, start):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds=1):
+        self.now += timedelta(seconds=seconds)
+
+
+def create_memory_store():
+    """建立記憶體 SQLite，寫入初始股票與大師"""
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        for category, items in [("FRUIT", INITIAL_FRUITS), ("MEAT", INITIAL_MEATS), ("ROOT", INITIAL_ROOTS)]:
+            for item in items:
+                session.add(Stock(
+                    symbol=item["symbol"],
+                    name=item["name"],
+                    price=item["price"],
+                    day_open=item["price"],
+                    category=category,
+                    volatility=0.005 if category == "ROOT" else 0.02,
+                    dividend_yield=0.01 if category == "ROOT" else 0.0
+                ))
+        for guru in INITIAL_GURUS:
+            session.add(Guru(name=guru["name"], bio=guru["bio"]))
+        session.commit()
+    return engine
+
+
+class MarketSimulator:
+    def __init__(self, seed=None, engine_mode="scalar", start=None, with_events=True, candle_seconds=60, params=None):
+        if seed is not None:
+            random.seed(seed)
+        self.clock = SimClock(start or DEFAULT_START)
+        self.db = create_memory_store()
+        session_factory = lambda: Session(self.db)
+        self.market = MarketEngine(session_factory, engine_mode=engine_mode, clock=self.clock, seed=seed)
+        self.market.history_buffer = HistoryBuffer(journal_dir=None)  # 模擬不寫 journal
+        if params:
+            self.market.params.update(params)
+        self.events = EventSystem(session_factory, market_engine=self.market, clock=self.clock) if with_events else None
+        self.candle_seconds = candle_seconds
+        self.ticks = 0
+
+        self.market.load_cache()
+        self._init_stats()
+
+    def _init_stats(self):
+        self.candles = {}  # {symbol: [[time, open, high, low, close], ...]}
+        self.stats = {}
+        for s in self.market.active_stocks:
+            self.candles[s.symbol] = []
+            self.stats[s.symbol] = {
+                "category": s.category,
+                "start": s.price,
+                "min": s.price,
+                "max": s.price,
+                "peak": s.price,
+                "max_drawdown": 0.0,
+                "below_floor_ticks": 0
+            }
+        # Regime 停留時間 {category: {regime: [秒數, ...]}}
+        self.regime_dwell = {c: {} for c in self.market.market_regimes}
+        self._regime_since = {c: (r, 0) for c, r in self.market.market_regimes.items()}
+
+    def step(self):
+        self.clock.advance(1)
+        self.market.update_prices()
+        if self.events:
+            self.events.generate_random_event()
+        self.ticks += 1
+        self._record()
+
+    def run(self, ticks, quiet=True):
+        """執行 ticks 次 1 秒 tick，quiet 時隱藏引擎的 print 輸出"""
+        started = time.perf_counter()
+        out = io.StringIO() if quiet else sys.stdout
+        with contextlib.redirect_stdout(out):
+            for _ in range(ticks):
+                self.step()
+                # 引擎的 K 線 buffer 在模擬中不寫入 DB，定期丟棄避免無限成長
+                if self.ticks % 3600 == 0:
+                    self.market.history_buffer.clear()
+                    self.market.rollup.pending = []
+        elapsed = time.perf_counter() - started
+        return self.result(elapsed)
+
+    def _record(self):
+        t = int(self.clock.now.timestamp())
+        bucket = t - t % self.candle_seconds
+        for s in self.market.active_stocks:
+            price = s.price
+            series = self.candles[s.symbol]
+            if series and series[-1][0] == bucket:
+                candle = series[-1]
+                candle[2] = max(candle[2], price)
+                candle[3] = min(candle[3], price)
+                candle[4] = price
+            else:
+                series.append([bucket, price, price, price, price])
+
+            st = self.stats[s.symbol]
+            st["min"] = min(st["min"], price)
+            st["max"] = max(st["max"], price)
+            if price > st["peak"]:
+                st["peak"] = price
+            else:
+                st["max_drawdown"] = max(st["max_drawdown"], 1 - price / st["peak"])
+            initial = INITIAL_PRICES.get(s.symbol)
+            if initial and price < initial * SOFT_FLOOR_RATIO:
+                st["below_floor_ticks"] += 1
+
+        for category, regime in self.market.market_regimes.items():
+            current, since = self._regime_since[category]
+            if regime != current:
+                self.regime_dwell[category].setdefault(current, []).append(self.ticks - since)
+                self._regime_since[category] = (regime, self.ticks)
+
+    def result(self, elapsed=None):
+        stocks = {}
+        for s in self.market.active_stocks:
+            st = self.stats[s.symbol]
+            closes = [c[4] for c in self.candles[s.symbol]]
+            returns = [math.log(b / a) for a, b in zip(closes, closes[1:]) if a > 0 and b > 0]
+            stocks[s.symbol] = {
+                "category": st["category"],
+                "start": st["start"],
+                "end": s.price,
+                "min": st["min"],
+                "max": st["max"],
+                "return_pct": round((s.price / st["start"] - 1) * 100, 2),
+                "max_drawdown_pct": round(st["max_drawdown"] * 100, 2),
+                "below_soft_floor_pct": round(st["below_floor_ticks"] / max(1, self.ticks) * 100, 3),
+                "candle_volatility_pct": round(_stdev(returns) * 100, 4)
+            }
+
+        # 仍在進行中的 Regime 也計入停留時間
+        dwell = {}
+        for category, by_regime in self.regime_dwell.items():
+            current, since = self._regime_since[category]
+            spans = {r: list(v) for r, v in by_regime.items()}
+            spans.setdefault(current, []).append(self.ticks - since)
+            dwell[category] = {
+                r: {
+                    "count": len(v),
+                    "mean_s": round(sum(v) / len(v), 1),
+                    "min_s": min(v),
+                    "max_s": max(v),
+                    "share_pct": round(sum(v) / max(1, self.ticks) * 100, 2)
+                }
+                for r, v in spans.items()
+            }
+
+        summary = {
+            "ticks": self.ticks,
+            "simulated_seconds": self.ticks,
+            "engine_mode": self.market.engine_mode,
+            "stocks": stocks,
+            "regime_dwell": dwell
+        }
+        if elapsed is not None:
+            summary["elapsed_s"] = round(elapsed, 2)
+            summary["ticks_per_s"] = round(self.ticks / elapsed, 1) if elapsed > 0 else None
+        return {"summary": summary, "candles": self.candles}
+
+
+def _stdev(values):
+    if len(values) < 2:
+        return 0.0
+    mean = sum(values) / len(values)
+    return math.sqrt(sum((v - mean) ** 2 for v in values) / (len(values) - 1))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless fast-forward market simulator")
+    parser.add_argument("--days", type=float, default=0)
+    parser.add_argument("--hours", type=float, default=0)
+    parser.add_argument("--ticks", type=int, default=0, help="直接指定 tick 數（優先於 days/hours）")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--mode", choices=["scalar", "vector"], default="scalar")
+    parser.add_argument("--candle-seconds", type=int, default=60)
+    parser.add_argument("--no-events", action="store_true", help="不產生隨機新聞事件")
+    parser.add_argument("--out", default=None, help="輸出完整結果 (含 K 線) 的 JSON 路徑")
+    parser.add_argument("--verbose", action="store_true", help="顯示引擎的 print 輸出")
+    args = parser.parse_args(argv)
+
+    ticks = args.ticks or int((args.days * 86400) + (args.hours * 3600)) or 3600
+    sim = MarketSimulator(
+        seed=args.seed,
+        engine_mode=args.mode,
+        with_events=not args.no_events,
+        candle_seconds=args.candle_seconds
+    )
+    result = sim.run(ticks, quiet=not args.verbose)
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False)
+        print(f"[Simulator] Wrote {args.out}")
+    print(json.dumps(result["summary"], ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -43,6 +43,31 @@ PAYTABLE = {
     f"{S_CHERRY}-{S_CHERRY}-{S_CHERRY}": 5, # Was 3
 }
 
+JACKPOT_COMBO = f"{S_7}-{S_7}-{S_7}"
+TWO_CHERRY_MULTIPLIER = 2.0
+
+# 可調整的老虎機參數（對應後台 SystemConfig 的 slots.* 設定）
+DEFAULT_SLOTS_PARAMS = {
+    "base_rtp": 0.9225,  # 目標回報率；賠率表依比例縮放（預設即為目前賠率表的理論值）
+    "jackpot_multiplier": 150,  # 三個 7️⃣ 的倍率
+    "min_bet": 1,
+    "max_bet": 0,  # 0：不設上限
+}
+
+
+def theoretical_rtp(jackpot_multiplier):
+    """目前權重與賠率表（指定頭獎倍率）下的理論回報率"""
+    total = sum(WEIGHTS.values())
+    prob = {sym: w / total for sym, w in WEIGHTS.items()}
+    rtp = 0.0
+    for sym in SYMBOLS:
+        combo = f"{sym}-{sym}-{sym}"
+        multiplier = jackpot_multiplier if combo == JACKPOT_COMBO else PAYTABLE[combo]
+        rtp += prob[sym] ** 3 * multiplier
+    cherry = prob[S_CHERRY]
+    rtp += 3 * cherry ** 2 * (1 - cherry) * TWO_CHERRY_MULTIPLIER
+    return rtp
+
 # Special handling for Cherry: 
 # 2 Cherries (any position) = 1x
 # But we simplify to: Any 2 matching cherries? No, standard slot logic is usually left-to-right or any.
@@ -55,6 +80,8 @@ PAYTABLE = {
 class SlotsEngine:
     def __init__(self, session_factory):
         self.session_factory = session_factory
+        self.params = dict(DEFAULT_SLOTS_PARAMS)
+        self._rtp_scale = (None, 1.0)  # (params, scale)：參數替換時重新計算
         self.reel_strip = []
         for sym, weight in WEIGHTS.items():
             self.reel_strip.extend([sym] * weight)
@@ -62,23 +89,31 @@ class SlotsEngine:
     def _spin_reel(self):
         return random.choice(self.reel_strip)
 
+    def _payout_scale(self, params):
+        cached_params, scale = self._rtp_scale
+        if cached_params is not params:
+            scale = params["base_rtp"] / theoretical_rtp(params["jackpot_multiplier"])
+            self._rtp_scale = (params, scale)
+        return scale
+
     def calculate_payout(self, symbols, bet):
         # symbols: list of 3 strings
         combo = f"{symbols[0]}-{symbols[1]}-{symbols[2]}"
         
+        params = self.params
         multiplier = 0
         win_type = "MISS"
         
         # 1. Check exact 3-of-a-kind
         if combo in PAYTABLE:
-            multiplier = PAYTABLE[combo]
+            multiplier = params["jackpot_multiplier"] if combo == JACKPOT_COMBO else PAYTABLE[combo]
             win_type = "BIG_WIN" if multiplier >= 20 else "WIN"
         
         # 2. Check 2 Cherries or 1 Cherry (Simple low pay)
         # Classic usually: 1 Cherry (leftmost) = 2x, 2 Cherries = 5x?
         # Let's do: Count cherries
         elif symbols.count(S_CHERRY) == 2:
-            multiplier = 2.0 # Was 1.0
+            multiplier = TWO_CHERRY_MULTIPLIER # Was 1.0
             win_type = "SMALL_WIN"
         elif symbols.count(S_CHERRY) == 3: 
              # Should match PAYTABLE above (3x), but just in case
@@ -86,12 +121,19 @@ class SlotsEngine:
         
         # 3. Any 3 Mixed Bars/Fruits? (Simplification: No)
         
+        if multiplier:
+            multiplier = round(multiplier * self._payout_scale(params), 2)
         total_payout = bet * multiplier
         return total_payout, win_type, multiplier
 
     def spin(self, user_id: int, bet_amount: float):
         if bet_amount <= 0:
             raise ValueError("Bet amount must be positive")
+        params = self.params
+        if bet_amount < params["min_bet"]:
+            raise ValueError(f"Bet amount must be at least {params['min_bet']}")
+        if params["max_bet"] > 0 and bet_amount > params["max_bet"]:
+            raise ValueError(f"Bet amount must be at most {params['max_bet']}")
             
         with self.session_factory() as session:
             user = session.get(User, user_id)
@@ -0,0 +1,254 @@
+"""
+市場參數掃描
+以 simulator.MarketSimulator 對 admin_api.DEFAULT_CONFIGS 的 market.* 參數做網格或隨機取樣，
+每組參數 × 每個 seed 交給 process pool 的一個 worker 執行，
+彙整波動度、均值回歸與尾部風險指標成一份比較報表。
+選定數值後再透過 PUT /api/admin/config/{key} 套用到線上。
+
+用法:
+    python sweep.py --grid market.gravity_strength=0.005,0.01,0.02 --seeds 4 --hours 2
+    python sweep.py --random 16 --range market.breakthrough_chance=0.02:0.15 --out sweep.json --csv sweep.csv
+"""
+import argparse
+import contextlib
+import csv
+import io
+import itertools
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from admin_api import DEFAULT_CONFIGS
+from market import DEFAULT_MARKET_PARAMS, INITIAL_PRICES
+
+CONFIG_PREFIX = "market."
+# 整數型參數（秒數）
+INTEGER_PARAMS = {"trend_duration_min", "trend_duration_max", "regime_change_interval"}
+
+METRIC_COLUMNS = [
+    "volatility_pct",  # 每根 K 線對數報酬的標準差（各股平均）
+    "autocorr_lag1",  # K 線報酬一階自相關，越負代表回歸越強
+    "base_deviation_pct",  # 收盤價偏離初始價格的平均絕對百分比
+    "excess_kurtosis",  # 超額峰態，越大代表肥尾
+    "p01_return_pct",
+    "p99_return_pct",
+    "max_drawdown_pct",  # 各股最大回撤的平均
+    "worst_drawdown_pct",
+    "below_soft_floor_pct",
+]
+
+
+def market_config_keys():
+    """DEFAULT_CONFIGS 中可由引擎讀取的 market.* 參數"""
+    return [
+        key for key in DEFAULT_CONFIGS
+        if key.startswith(CONFIG_PREFIX) and key[len(CONFIG_PREFIX):] in DEFAULT_MARKET_PARAMS
+    ]
+
+
+def to_param_name(key):
+    """接受 market.gravity_strength 或 gravity_strength"""
+    name = key[len(CONFIG_PREFIX):] if key.startswith(CONFIG_PREFIX) else key
+    if name not in DEFAULT_MARKET_PARAMS:
+        raise ValueError(f"未知的市場參數: {key}（可用: {', '.join(market_config_keys())}）")
+    return name
+
+
+def coerce(name, value):
+    return int(round(float(value))) if name in INTEGER_PARAMS else float(value)
+
+
+def normalize(params):
+    """修正互相矛盾的組合（趨勢最短時間大於最長時間）"""
+    if params.get("trend_duration_min", 0) > params.get("trend_duration_max", float("inf")):
+        params["trend_duration_max"] = params["trend_duration_min"]
+    return params
+
+
+def build_grid(specs):
+    """--grid key=v1,v2,... → 所有組合的笛卡兒積"""
+    axes = []
+    for spec in specs:
+        key, _, values = spec.partition("=")
+        name = to_param_name(key.strip())
+        axes.append([(name, coerce(name, v)) for v in values.split(",") if v.strip()])
+    return [normalize(dict(combo)) for combo in itertools.product(*axes)]
+
+
+def build_random(count, specs, rng):
+    """--random N：在 --range key=lo:hi 內均勻取樣；未指定範圍時對所有參數取預設值 ±50%"""
+    ranges = {}
+    for spec in specs:
+        key, _, bounds = spec.partition("=")
+        lo, _, hi = bounds.partition(":")
+        ranges[to_param_name(key.strip())] = (float(lo), float(hi))
+    if not ranges:
+        for key in market_config_keys():
+            name = to_param_name(key)
+            default = DEFAULT_MARKET_PARAMS[name]
+            ranges[name] = (default * 0.5, default * 1.5)
+
+    configs = []
+    for _ in range(count):
+        configs.append(normalize({
+            name: coerce(name, rng.uniform(lo, hi)) for name, (lo, hi) in ranges.items()
+        }))
+    return configs
+
+
+def run_one(config_id, params, seed, ticks, engine_mode, with_events):
+    """worker 入口：一個 seed 一次模擬，只回傳指標（不回傳 K 線，避免大量 pickle）"""
+    from simulator import MarketSimulator  # Late import: 在子行程內建立
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim = MarketSimulator(seed=seed, engine_mode=engine_mode, with_events=with_events, params=params)
+    result = sim.run(ticks)
+    metrics = compute_metrics(result)
+    metrics["ticks_per_s"] = result["summary"].get("ticks_per_s")
+    return config_id, seed, metrics
+
+
+def compute_metrics(result):
+    summary = result["summary"]["stocks"]
+    vols, autocorrs, kurts, deviations, pooled = [], [], [], [], []
+    for symbol, candles in result["candles"].items():
+        closes = np.array([c[4] for c in candles], dtype=np.float64)
+        if len(closes) < 3 or (closes <= 0).any():
+            continue
+        returns = np.diff(np.log(closes))
+        pooled.append(returns)
+        std = returns.std(ddof=1)
+        vols.append(std)
+        if std > 0:
+            centered = returns - returns.mean()
+            autocorrs.append(float(np.dot(centered[:-1], centered[1:]) / np.dot(centered, centered)))
+            kurts.append(float(np.mean(centered ** 4) / np.mean(centered ** 2) ** 2 - 3))
+        anchor = INITIAL_PRICES.get(symbol, closes[0])
+        deviations.append(float(np.mean(np.abs(closes / anchor - 1))))
+
+    pooled = np.concatenate(pooled) if pooled else np.zeros(1)
+    drawdowns = [s["max_drawdown_pct"] for s in summary.values()] or [0.0]
+    below = [s["below_soft_floor_pct"] for s in summary.values()] or [0.0]
+    return {
+        "volatility_pct": float(np.mean(vols) * 100) if vols else 0.0,
+        "autocorr_lag1": float(np.mean(autocorrs)) if autocorrs else 0.0,
+        "base_deviation_pct": float(np.mean(deviations) * 100) if deviations else 0.0,
+        "excess_kurtosis": float(np.mean(kurts)) if kurts else 0.0,
+        "p01_return_pct": float(np.percentile(pooled, 1) * 100),
+        "p99_return_pct": float(np.percentile(pooled, 99) * 100),
+        "max_drawdown_pct": float(np.mean(drawdowns)),
+        "worst_drawdown_pct": float(np.max(drawdowns)),
+        "below_soft_floor_pct": float(np.mean(below)),
+    }
+
+
+def aggregate(configs, runs):
+    """依參數組合彙整各 seed 的結果（平均值 + 標準差）"""
+    rows = []
+    for config_id, params in enumerate(configs):
+        samples = [m for (cid, _), m in runs.items() if cid == config_id]
+        row = {"config_id": config_id, "params": params, "seeds": len(samples)}
+        for column in METRIC_COLUMNS:
+            values = np.array([m[column] for m in samples], dtype=np.float64)
+            row[column] = round(float(values.mean()), 5) if len(values) else None
+            row[column + "_std"] = round(float(values.std()), 5) if len(values) > 1 else 0.0
+        rows.append(row)
+    return rows
+
+
+def print_report(rows, varied):
+    headers = ["id"] + varied + ["vol%", "ac1", "dev%", "kurt", "p01%", "p99%", "mdd%", "floor%"]
+    print(" | ".join(f"{h:>12}" for h in headers))
+    print("-" * (15 * len(headers)))
+    for row in rows:
+        cells = [str(row["config_id"])] + [f"{row['params'].get(name, DEFAULT_MARKET_PARAMS[name]):g}" for name in varied]
+        cells += [f"{row[c]:.4f}" if row[c] is not None else "-" for c in METRIC_COLUMNS if c != "worst_drawdown_pct"]
+        print(" | ".join(f"{c:>12}" for c in cells))
+
+
+def write_csv(path, rows, varied):
+    columns = ["config_id", "seeds"] + varied + [c for m in METRIC_COLUMNS for c in (m, m + "_std")]
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        for row in rows:
+            flat = {k: row[k] for k in columns if k in row}
+            for name in varied:
+                flat[name] = row["params"].get(name, DEFAULT_MARKET_PARAMS[name])
+            writer.writerow(flat)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parallel parameter sweep over market.* configs")
+    parser.add_argument("--grid", action="append", default=[], metavar="KEY=V1,V2", help="網格掃描的參數值")
+    parser.add_argument("--random", type=int, default=0, metavar="N", help="隨機取樣 N 組參數")
+    parser.add_argument("--range", action="append", default=[], metavar="KEY=LO:HI", help="隨機取樣範圍")
+    parser.add_argument("--seeds", type=int, default=3, help="每組參數跑幾個 seed")
+    parser.add_argument("--seed", type=int, default=0, help="第一個 seed（各組參數共用同一批 seed）")
+    parser.add_argument("--hours", type=float, default=2)
+    parser.add_argument("--ticks", type=int, default=0, help="直接指定 tick 數（優先於 hours）")
+    parser.add_argument("--mode", choices=["scalar", "vector"], default="vector")
+    parser.add_argument("--no-events", action="store_true", help="不產生隨機新聞事件")
+    parser.add_argument("--no-baseline", action="store_true", help="不加入預設參數組作為對照")
+    parser.add_argument("--workers", type=int, default=None, help="worker 數，預設為 CPU 核心數")
+    parser.add_argument("--out", default=None, help="輸出 JSON 報表路徑")
+    parser.add_argument("--csv", default=None, help="輸出 CSV 報表路徑")
+    args = parser.parse_args(argv)
+
+    if args.grid:
+        configs = build_grid(args.grid)
+    elif args.random:
+        configs = build_random(args.random, args.range, random.Random(args.seed))
+    else:
+        parser.error("請指定 --grid 或 --random")
+    if not args.no_baseline:
+        configs.insert(0, {})  # config 0 = 目前預設值
+
+    varied = sorted({name for params in configs for name in params})
+    ticks = args.ticks or int(args.hours * 3600)
+    seeds = [args.seed + i for i in range(args.seeds)]
+    workers = args.workers or os.cpu_count() or 1
+    jobs = [(cid, params, seed) for cid, params in enumerate(configs) for seed in seeds]
+    print(f"[Sweep] {len(configs)} configs x {len(seeds)} seeds = {len(jobs)} runs, {ticks} ticks each, {workers} workers")
+
+    started = time.perf_counter()
+    runs = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(run_one, cid, params, seed, ticks, args.mode, not args.no_events)
+            for cid, params, seed in jobs
+        ]
+        for done, future in enumerate(as_completed(futures), 1):
+            config_id, seed, metrics = future.result()
+            runs[(config_id, seed)] = metrics
+            print(f"[Sweep] {done}/{len(jobs)} config={config_id} seed={seed} vol={metrics['volatility_pct']:.4f}%")
+    elapsed = time.perf_counter() - started
+
+    rows = aggregate(configs, runs)
+    print_report(rows, varied)
+    print(f"[Sweep] Finished in {elapsed:.1f}s")
+
+    if args.out:
+        report = {
+            "ticks": ticks,
+            "seeds": seeds,
+            "engine_mode": args.mode,
+            "with_events": not args.no_events,
+            "defaults": DEFAULT_MARKET_PARAMS,
+            "results": rows,
+            "elapsed_s": round(elapsed, 2)
+        }
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"[Sweep] Wrote {args.out}")
+    if args.csv:
+        write_csv(args.csv, rows, varied)
+        print(f"[Sweep] Wrote {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+行情 tick 差量編碼
+/api/ws 每秒的 tick 不再每次送出全部股票的 model_dump()：
+  - keyframe：{"type": "tick", "keyframe": true, "seq": n, "ts": 秒, 完整內容（同舊版 tick）}
+    連線時、每 KEYFRAME_SECONDS 秒、或股票清單 / 價格以外的欄位變動時送出
+  - delta：{"type": "delta", "seq": n, "ts": 秒, "s": [[id, price], [id, price, day_open], ...]}
+    只列出有變動的股票（day_open 有變才附上），event / forecast / race / regime 有變才帶該欄位
+序號連續遞增；客戶端發現跳號時送 {"type": "resync"} 取得目前的 keyframe。
+
+/api/ws?format=binary 的連線，只含股價的 delta 改以二進位 frame 送出（little-endian）：
+  header : version u8, flags u8（bit0：有 prev）, seq u32, prev u32, ts f64（unix 秒）, count u16
+  record : index u16, price u32（分）, day_open u32（分），每筆 10 bytes
+index 是股票在 schema [[id, symbol], ...] 中的位置；schema 在連線時與股票清單變動時
+附在 keyframe 的 "schema" 欄位（股票清單變動必定送出 keyframe）。keyframe 與含 meta 欄位的 delta 仍為 JSON。
+"""
+import struct
+import time
+
+KEYFRAME_SECONDS = 10
+PRICE_FIELDS = ("price", "day_open")
+META_FIELDS = ("event", "forecast", "race", "market_regimes", "regime_durations")
+PRICE_SCALE = 100  # 價格量化到 0.01
+
+BINARY_VERSION = 1
+_HEADER = struct.Struct("<BBIIdH")
+_RECORD = struct.Struct("<HII")
+_NO_PREV = 0xFFFFFFFF
+
+
+def pack_delta(message, index, day_opens):
+    """只含股價的 delta 轉成二進位 frame；帶 meta 欄位或有不在 schema 中的股票時回傳 None（改送 JSON）"""
+    if any(k not in ("type", "seq", "prev", "ts", "s") for k in message):
+        return None
+    rows = message["s"]
+    prev = message.get("prev")
+    out = bytearray(_HEADER.size + _RECORD.size * len(rows))
+    _HEADER.pack_into(
+        out, 0, BINARY_VERSION, 1 if prev is not None else 0,
+        message["seq"], _NO_PREV if prev is None else prev, message.get("ts") or 0.0, len(rows)
+    )
+    offset = _HEADER.size
+    for row in rows:
+        i = index.get(row[0])
+        if i is None:
+            return None
+        day_open = row[2] if len(row) > 2 else day_opens[row[0]]
+        _RECORD.pack_into(out, offset, i, round(row[1] * PRICE_SCALE), round(day_open * PRICE_SCALE))
+        offset += _RECORD.size
+    return bytes(out)
+
+
+def unpack_delta(frame, ids):
+    """pack_delta 的反向（ids：schema 的 stock_id 清單），回傳 delta 訊息"""
+    version, flags, seq, prev, ts, count = _HEADER.unpack_from(frame, 0)
+    if version != BINARY_VERSION:
+        raise ValueError(f"unsupported tick frame version {version}")
+    rows = [
+        [ids[i], price / PRICE_SCALE, day_open / PRICE_SCALE]
+        for i, price, day_open in _RECORD.iter_unpack(frame[_HEADER.size:_HEADER.size + count * _RECORD.size])
+    ]
+    return {"type": "delta", "seq": seq, "prev": prev if flags & 1 else None, "ts": ts, "s": rows}
+
+
+class TickEncoder:
+    """在事件迴圈上使用（單一廣播工作），不需要鎖"""
+
+    def __init__(self, keyframe_seconds=KEYFRAME_SECONDS, clock=time.monotonic):
+        self.keyframe_seconds = keyframe_seconds
+        self.clock = clock
+        self.seq = 0
+        self._snapshot = None  # 最近一次編碼的快照
+        self._stocks = {}  # {stock_id: 唯讀 model_dump()}
+        self._meta = None
+        self._keyframe_at = None
+        self._keyframe = None  # (seq, message)
+
+    def encode(self, snapshot):
+        """回傳本 tick 要廣播的訊息（keyframe 或 delta）"""
+        self.seq += 1
+        stocks = {s["id"]: s for s in snapshot.stocks}
+        meta = snapshot.meta()
+        now = self.clock()
+
+        changes = None
+        if self._keyframe_at is not None and now - self._keyframe_at < self.keyframe_seconds:
+            changes = self._diff(stocks)
+
+        self._snapshot = snapshot
+        previous_meta, self._meta = self._meta, meta
+        self._stocks = stocks
+        if changes is None:
+            self._keyframe_at = now
+            return self.keyframe()
+
+        message = {"type": "delta", "seq": self.seq, "ts": snapshot.created_at.timestamp(), "s": changes}
+        for key, value in meta.items():
+            if value != previous_meta[key]:
+                message[key] = value
+        return message
+
+    def keyframe(self):
+        """目前序號的完整 tick（新連線與 resync 使用），尚未廣播過時回傳 None"""
+        if self._snapshot is None:
+            return None
+        if self._keyframe is None or self._keyframe[0] != self.seq:
+            message = self._snapshot.tick_message()
+            message.update(keyframe=True, seq=self.seq, ts=self._snapshot.created_at.timestamp())
+            self._keyframe = (self.seq, message)
+        return self._keyframe[1]
+
+    def _diff(self, stocks):
+        """[[id, price], [id, price, day_open]]；股票清單或其他欄位變動時回傳 None（改送 keyframe）"""
+        if stocks.keys() != self._stocks.keys():
+            return None
+        changes = []
+        for stock_id, stock in stocks.items():
+            previous = self._stocks[stock_id]
+            if stock == previous:
+                continue
+            if any(stock[k] != previous[k] for k in stock if k not in PRICE_FIELDS):
+                return None
+            if stock["day_open"] != previous["day_open"]:
+                changes.append([stock_id, stock["price"], stock["day_open"]])
+            else:
+                changes.append([stock_id, stock["price"]])
+        return changes
+
+
+class TickState:
+    """由廣播的 keyframe / delta 還原目前的完整 tick
+    每個副本都維護（包含主節點），新連線的 keyframe 與非主節點的唯讀快照都由此取得。
+    股票 dict 只整份替換、不就地修改，已交出去的 keyframe 不會被之後的 delta 改動。"""
+
+    def __init__(self):
+        self.seq = 0
+        self.ts = None
+        self._stocks = None  # [dict]（keyframe 的順序）
+        self._index = {}  # {stock_id: 位置}
+        self._meta = {}
+        self._keyframe = None  # (seq, message)
+
+    def apply(self, message):
+        """套用一則廣播訊息，狀態有更新時回傳 True"""
+        kind = message.get("type")
+        if kind == "tick":
+            self._stocks = [dict(s) for s in message["stocks"]]
+            self._index = {s["id"]: i for i, s in enumerate(self._stocks)}
+            self._meta = {k: message.get(k) for k in META_FIELDS}
+        elif kind == "delta":
+            if self._stocks is None or message["seq"] <= self.seq:
+                return False
+            for row in message["s"]:
+                i = self._index.get(row[0])
+                if i is None:
+                    continue
+                stock = dict(self._stocks[i], price=row[1])
+                if len(row) > 2:
+                    stock["day_open"] = row[2]
+                self._stocks[i] = stock
+            for key in META_FIELDS:
+                if key in message:
+                    self._meta[key] = message[key]
+        else:
+            return False
+        self.seq = message["seq"]
+        self.ts = message.get("ts")
+        return True
+
+    def keyframe(self):
+        """目前序號的完整 tick，尚未收到任何 keyframe 時回傳 None"""
+        if self._stocks is None:
+            return None
+        if self._keyframe is None or self._keyframe[0] != self.seq:
+            message = {"type": "tick", "stocks": list(self._stocks), **self._meta}
+            message.update(keyframe=True, seq=self.seq, ts=self.ts)
+            self._keyframe = (self.seq, message)
+        return self._keyframe[1]
@@ -0,0 +1,78 @@
+"""
+可重播的 tick 記錄
+每個副本把收到的 keyframe / delta 依序號保存在記憶體環形緩衝（TickLog），
+重新連線的客戶端以 /api/ws?resume=<最後的 seq> 連線，只補送漏掉的 delta：
+  - 漏掉的範圍都在緩衝內且連續、其間沒有 keyframe：依訂閱過濾後補送
+  - 其他情況（過舊、伺服器重啟後序號不接續、其間已有 keyframe）：改送目前的 keyframe
+    （keyframe 每 KEYFRAME_SECONDS 秒一次，跨過 keyframe 時目前的 keyframe 不會比補送更大）
+
+有 Redis 時主節點同時把 tick 寫入有上限的 Redis Stream（RedisTickStore，entry id = "<seq>-0"），
+重新部署後的副本啟動時由最後一個 keyframe 起重建緩衝與目前的 tick，
+不必等下一則廣播就能回應連線與 resume，新的主節點序號也由此接續。
+"""
+import json
+
+REPLAY_SIZE = 64  # 約一分鐘的 tick
+STREAM_KEY = "tick_stream"
+
+
+class TickLog:
+    """記憶體環形緩衝（在事件迴圈上使用）"""
+
+    def __init__(self, maxlen=REPLAY_SIZE):
+        self.maxlen = maxlen
+        self._messages = []  # 依 seq 遞增
+
+    def __len__(self):
+        return len(self._messages)
+
+    @property
+    def last_seq(self):
+        return self._messages[-1]["seq"] if self._messages else None
+
+    def append(self, message):
+        seq = message["seq"]
+        if self._messages and seq <= self.last_seq:
+            # 序號倒退（序號未接續的新主節點）：舊記錄無法再對應
+            self._messages.clear()
+        self._messages.append(message)
+        if len(self._messages) > self.maxlen:
+            del self._messages[:len(self._messages) - self.maxlen]
+
+    def since(self, seq):
+        """seq 之後的訊息（依序、序號連續），無法完整補上時回傳 None"""
+        if not self._messages or seq > self.last_seq or seq < self._messages[0]["seq"] - 1:
+            return None
+        messages = [m for m in self._messages if m["seq"] > seq]
+        for expected, message in enumerate(messages, seq + 1):
+            if message["seq"] != expected:
+                return None  # 這個副本漏收過 pub/sub 訊息
+        return messages
+
+
+class RedisTickStore:
+    """主節點寫入、副本啟動時讀取的 Redis Stream"""
+
+    def __init__(self, client, key=STREAM_KEY, maxlen=REPLAY_SIZE):
+        self.client = client
+        self.key = key
+        self.maxlen = maxlen
+
+    async def append(self, seq, payload):
+        try:
+            await self.client.xadd(self.key, {"m": payload}, id=f"{seq}-0", maxlen=self.maxlen, approximate=True)
+        except Exception as e:
+            # 通常是 Stream 內序號比目前的大（舊叢集留下的記錄）：清空，下一個 tick 重新開始
+            print(f"[TickLog] Append Error: {e}")
+            await self.client.delete(self.key)
+
+    async def load(self):
+        """最後一個 keyframe 起的訊息（依序），沒有 keyframe 時回傳 []"""
+        entries = await self.client.xrevrange(self.key, count=self.maxlen)
+        messages = []
+        for _, fields in entries:
+            message = json.loads(fields["m"])
+            messages.append(message)
+            if message.get("type") == "tick":
+                return messages[::-1]
+        return []
@@ -0,0 +1,30 @@
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+import history_archive
+
+def verify():
+    history_archive.ARCHIVE_DIR = tempfile.mkdtemp(prefix="history_archive_")
+    start = datetime(2024, 1, 31, 23, 0)
+    rows = [(start + timedelta(minutes=i), 10.0 + i, 11.0 + i, 9.0 + i, 10.5 + i, i) for i in range(120)]
+
+    print("1. Writing 120 candles across two months...")
+    history_archive.write_candles(1, "1m", rows)
+    print(f"   Files: {sorted(os.listdir(os.path.join(history_archive.ARCHIVE_DIR, '1', '1m')))}")
+    assert history_archive.watermark(1, "1m") == int(rows[-1][0].timestamp())
+
+    print("2. Reading a page across the month boundary (memmap)...")
+    page = history_archive.read_before(1, "1m", rows[70][0].timestamp(), 20)
+    assert [c["time"] for c in page] == [r[0] for r in rows[50:70]]
+    print(f"   {page[0]['time']} .. {page[-1]['time']}")
+
+    print("3. Rewriting the same candles (same count) must not serve the cached array...")
+    history_archive.write_candles(1, "1m", [(t, o, h, l, 99.0, v) for t, o, h, l, c, v in rows[:60]])
+    page = history_archive.read_before(1, "1m", rows[30][0].timestamp(), 5)
+    assert all(c["close"] == 99.0 for c in page), page
+
+    print("4. Verification Successful!")
+
+if __name__ == "__main__":
+    verify()
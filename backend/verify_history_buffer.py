@@ -0,0 +1,46 @@
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+from history_journal import HistoryBuffer
+
+def candles(count, start=0):
+    t0 = datetime(2024, 1, 1, 9, 0)
+    return [(1, t0 + timedelta(seconds=5 * i), 10.0, 11.0, 9.0, 10.5, i) for i in range(start, start + count)]
+
+def verify():
+    journal_dir = tempfile.mkdtemp(prefix="history_journal_")
+    buffer = HistoryBuffer(capacity=4, journal_dir=journal_dir)
+
+    print("1. Overflowing the buffer spills to the journal...")
+    records = candles(6)
+    for record in records:
+        buffer.append(record)
+    assert len(buffer) == 2 and len(buffer.pending_segments()) == 1
+
+    print("2. A failed DB write rolls back into a new segment...")
+    journaled, fresh, segments = buffer.take()
+    assert journaled + fresh == records
+    buffer.rollback(fresh)
+    buffer.append(candles(1, start=6)[0])
+
+    print("3. The next successful write gets everything exactly once...")
+    journaled, fresh, segments = buffer.take()
+    assert journaled + fresh == candles(7)
+    buffer.commit(segments)
+    assert os.listdir(journal_dir) == [] and buffer.take() == ([], [], [])
+
+    print("4. An unwritable journal falls back to dropping the oldest half...")
+    blocker = os.path.join(journal_dir, "not_a_dir")
+    open(blocker, "w").close()
+    broken = HistoryBuffer(capacity=4, journal_dir=os.path.join(blocker, "journal"))
+    for record in records:
+        broken.append(record)  # 不可丟出例外（tick 執行緒）
+    assert broken.peek() == records[4:]
+    broken.rollback(candles(1, start=6))
+    assert len(broken) <= 4
+
+    print("5. Verification Successful!")
+
+if __name__ == "__main__":
+    verify()
@@ -0,0 +1,67 @@
+import asyncio
+
+from leader import LeaderElector, LocalLease
+
+class BrokenLease(LocalLease):
+    """取得後 Redis 失聯：續約一律失敗"""
+    async def renew(self, token):
+        raise ConnectionError("redis unavailable")
+
+def replica(name, lease, clock, events):
+    async def on_elected():
+        events.append(f"{name} elected")
+
+    async def on_demoted():
+        events.append(f"{name} demoted")
+
+    return LeaderElector(lease, on_elected, on_demoted, token=name, renew_seconds=2, clock=clock)
+
+async def verify():
+    now = [100.0]
+    clock = lambda: now[0]
+    table = {}
+    events = []
+    a = replica("a", LocalLease(table, ttl=10, clock=clock), clock, events)
+    b = replica("b", LocalLease(table, ttl=10, clock=clock), clock, events)
+
+    print("1. Only one replica acquires the lease...")
+    await a.step()
+    await b.step()
+    await asyncio.sleep(0)  # 背景的 on_elected
+    assert a.is_leader and not b.is_leader
+
+    print("2. Renewing keeps it past the original ttl...")
+    for _ in range(3):
+        now[0] += 8
+        await a.step()
+        await b.step()
+    assert a.is_leader and not b.is_leader
+
+    print("3. Resign releases the lease for the next poll...")
+    await a.resign()
+    await b.step()
+    await asyncio.sleep(0)
+    assert not a.is_leader and b.is_leader
+
+    print("4. A lost lease demotes on the next renew...")
+    now[0] += 11  # b 當機：租約過期後 a 接手
+    await a.step()
+    await b.step()
+    assert a.is_leader and not b.is_leader
+
+    print("5. Renew errors demote before the lease expires...")
+    c = replica("c", BrokenLease({}, ttl=10, clock=clock), clock, events)
+    await c.step()
+    now[0] += 5
+    await c.step()
+    assert c.is_leader  # 到期前 renew_seconds 秒內仍是主節點
+    now[0] += 3
+    await c.step()
+    assert not c.is_leader
+
+    print(f"   {events}")
+    assert events == ["a elected", "a demoted", "b elected", "a elected", "b demoted", "c elected", "c demoted"]
+    print("6. Verification Successful!")
+
+if __name__ == "__main__":
+    asyncio.run(verify())
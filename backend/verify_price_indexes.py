@@ -0,0 +1,61 @@
+from types import SimpleNamespace
+
+from sqlmodel import Session, SQLModel, create_engine
+from sqlalchemy.pool import StaticPool
+
+from alert_index import AlertIndex
+from margin_index import LIQUIDATION_RATIO, ShortMarginIndex, margin_ratio, threshold_price
+from models import Portfolio, Stock, User
+
+def verify_margin():
+    print("1. Short margin index...")
+    # 記憶體 SQLite，不影響 database.db
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        user = User(username="VerifyShort", hashed_password="x", balance=1000.0)
+        stock = Stock(symbol="VRFY", name="Verify", price=100.0)
+        session.add_all([user, stock])
+        session.commit()
+        session.add(Portfolio(user_id=user.id, stock_id=stock.id, quantity=-10, average_cost=100.0, margin_locked=1000.0))
+        session.commit()
+        key = (user.id, stock.id)
+
+        liquidation = threshold_price(1000.0, 1000.0, -10, 100.0, LIQUIDATION_RATIO)
+        assert abs(margin_ratio(1000.0, 1000.0, -10, 100.0, liquidation) - LIQUIDATION_RATIO) < 1e-9
+        print(f"   Liquidation threshold ${liquidation:.2f}")
+
+        index = ShortMarginIndex()
+        index.rebuild(session)
+        assert index.scan({stock.id: 120.0}) == ([], [])
+        assert index.scan({stock.id: 135.0}) == ([], [key])  # 由下往上越過 120%：警告一次
+        assert index.scan({stock.id: 136.0}) == ([], [])
+        assert index.scan({stock.id: liquidation + 0.01}) == ([key], [])
+
+        # 入金 commit 後，下一次 refresh 重新計算門檻
+        user.balance = 5000.0
+        session.add(user)
+        session.commit()
+        index.refresh(session)
+        assert index.scan({stock.id: liquidation + 0.01}) == ([], [])
+    print("   OK")
+
+def verify_alerts():
+    print("2. Price alert index...")
+    index = AlertIndex()
+    for alert_id, target, condition in ((1, 105.0, "above"), (2, 110.0, "above"), (3, 95.0, "below"), (4, 90.0, "below")):
+        index.add(SimpleNamespace(id=alert_id, user_id=alert_id, stock_id=10, target_price=target,
+                                  condition=condition, is_triggered=False))
+    index.remove(2)
+
+    assert index.pop_crossed({10: 100.0}) == []
+    assert index.pop_crossed({10: 105.0}) == [(1, 1, 10, 105.0, "above")]  # 剛好等於門檻也算
+    assert index.pop_crossed({10: 120.0}) == []  # 已刪除、已彈出的不再出現
+    assert [a[0] for a in index.pop_crossed({10: 89.0})] == [3, 4]  # 一次越過多個門檻
+    assert len(index) == 0
+    print("   OK")
+
+if __name__ == "__main__":
+    verify_margin()
+    verify_alerts()
+    print("Verification Successful!")
@@ -0,0 +1,77 @@
+from market_snapshot import build_snapshot
+from tick_codec import TickEncoder, TickState, pack_delta, unpack_delta
+from tick_log import TickLog
+
+def make_stocks():
+    return [
+        {"id": 1, "symbol": "APPLE", "name": "蘋果", "price": 100.0, "day_open": 98.0},
+        {"id": 2, "symbol": "BEEF", "name": "牛肉", "price": 50.0, "day_open": 50.0},
+        {"id": 3, "symbol": "CORN", "name": "玉米", "price": 10.0, "day_open": 11.0},
+    ]
+
+def verify_round_trip():
+    print("1. Keyframe / delta round trip...")
+    now = [0.0]
+    encoder = TickEncoder(clock=lambda: now[0])
+    state = TickState()
+    stocks = make_stocks()
+    kinds = []
+    for step in range(1, 31):
+        now[0] = step
+        stocks = [dict(s, price=round(s["price"] * (1.01 if (step + s["id"]) % 3 else 0.98), 2)) for s in stocks]
+        if step == 12:
+            stocks[2] = dict(stocks[2], day_open=stocks[2]["price"])  # delta 附上 day_open
+        if step == 17:
+            stocks[0] = dict(stocks[0], name="青蘋果")  # 價格以外的欄位：改送 keyframe
+        event = {"title": "乾旱", "stock_id": 3} if 20 <= step < 25 else None
+        message = encoder.encode(build_snapshot(step, stocks, {"FRUIT": "BULL"}, {"FRUIT": 30}, event=event))
+        kinds.append(message["type"])
+        assert state.apply(message) and state.seq == encoder.seq
+        expected = {k: v for k, v in encoder.keyframe().items() if k != "ts"}
+        assert {k: v for k, v in state.keyframe().items() if k != "ts"} == expected
+    print(f"   {kinds.count('tick')} keyframes, {kinds.count('delta')} deltas")
+    assert kinds[0] == "tick" and kinds[16] == "tick" and kinds.count("delta") > 20
+
+    # 重複的序號不套用；已交出去的 keyframe 不被之後的 delta 改動
+    held = state.keyframe()
+    assert not state.apply({"type": "delta", "seq": state.seq, "ts": 0.0, "s": [[1, 1.0]]})
+    assert state.apply({"type": "delta", "seq": state.seq + 1, "ts": 0.0, "s": [[1, 1.0]]})
+    assert held["stocks"][0]["price"] != 1.0 and state.keyframe()["stocks"][0]["price"] == 1.0
+    print("   OK")
+
+def verify_binary():
+    print("2. Binary delta frames...")
+    ids = [1, 2, 3]
+    index = {stock_id: i for i, stock_id in enumerate(ids)}
+    day_opens = {1: 98.0, 2: 50.0, 3: 11.0}
+    message = {"type": "delta", "seq": 42, "prev": 40, "ts": 1700000000.5, "s": [[1, 101.23], [3, 9.87, 9.5]]}
+    frame = pack_delta(message, index, day_opens)
+    print(f"   {len(frame)} bytes for {len(message['s'])} stocks")
+    assert len(frame) == 20 + 10 * 2  # header 20 bytes、每筆 10 bytes
+    assert unpack_delta(frame, ids) == dict(message, s=[[1, 101.23, 98.0], [3, 9.87, 9.5]])  # 一律帶 day_open
+
+    # 帶 meta 欄位或不在 schema 中的股票：改送 JSON
+    assert pack_delta(dict(message, event=None), index, day_opens) is None
+    assert pack_delta(dict(message, s=[[9, 1.0, 1.0]]), index, day_opens) is None
+    print("   OK")
+
+def verify_replay():
+    print("3. Resume replay (TickLog.since)...")
+    log = TickLog(maxlen=8)
+    for seq in list(range(1, 21)) + [22, 23]:  # 21 漏收
+        log.append({"type": "delta", "seq": seq, "s": []})
+    assert [m["seq"] for m in log.since(22)] == [23]
+    assert log.since(23) == []  # 已是最新
+    assert log.since(20) is None  # 其間有跳號：改送 keyframe
+    assert log.since(10) is None  # 超出緩衝
+    assert log.since(30) is None  # 比伺服器新（重啟後序號未接續）
+
+    log.append({"type": "delta", "seq": 3, "s": []})  # 序號倒退（新主節點）：舊記錄丟棄
+    assert len(log) == 1 and log.since(22) is None
+    print("   OK")
+
+if __name__ == "__main__":
+    verify_round_trip()
+    verify_binary()
+    verify_replay()
+    print("Verification Successful!")
@@ -0,0 +1,84 @@
+"""
+WebSocket 廣播出口
+每個連線有一個固定上限的送出佇列，由該連線自己的工作依序送出；
+廣播端只把已序列化好的訊息放進佇列，不會被任何一個慢速連線卡住。
+  - 佇列滿時丟棄最舊的訊息（tick 串流由客戶端以 prev 偵測漏收後 resync 補上）
+  - 單次送出超過 SEND_TIMEOUT 秒或送出失敗的連線會被關閉並移除
+安裝 orjson 時以 orjson 序列化（每則訊息每個訂閱組只序列化一次）。
+"""
+import asyncio
+import json
+from collections import deque
+
+try:
+    import orjson  # Optional: 較快的 JSON 編碼
+except ImportError:
+    orjson = None
+
+QUEUE_SIZE = 32  # 約 30 秒的 tick
+SEND_TIMEOUT = 10.0
+
+
+def dumps(message):
+    if orjson is not None:
+        return orjson.dumps(message, default=str).decode()
+    return json.dumps(message, default=str, separators=(",", ":"))
+
+
+class ClientQueue:
+    """單一連線的送出佇列與送出工作"""
+
+    def __init__(self, websocket, on_close, queue_size=QUEUE_SIZE, send_timeout=SEND_TIMEOUT):
+        self.websocket = websocket
+        self.send_timeout = send_timeout
+        self.dropped = 0
+        self.closed = False
+        self._queue = deque(maxlen=queue_size)
+        self._ready = asyncio.Event()
+        self._on_close = on_close
+        self._task = asyncio.create_task(self._drain())
+
+    def __len__(self):
+        return len(self._queue)
+
+    def put(self, payload):
+        """payload：str（文字 frame）或 bytes（二進位 frame）"""
+        if self.closed:
+            return
+        if len(self._queue) == self._queue.maxlen:
+            self.dropped += 1  # deque 自動丟棄最舊的一則
+        self._queue.append(payload)
+        self._ready.set()
+
+    async def _drain(self):
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+                while self._queue:
+                    payload = self._queue.popleft()
+                    if isinstance(payload, bytes):
+                        send = self.websocket.send_bytes(payload)
+                    else:
+                        send = self.websocket.send_text(payload)
+                    await asyncio.wait_for(send, self.send_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # 送出逾時（停滯的連線）或連線已關閉
+            print(f"[WS] Evicting connection: {type(e).__name__}")
+            await self.close(evicted=True)
+
+    async def close(self, evicted=False):
+        if self.closed:
+            return
+        self.closed = True
+        self._queue.clear()
+        if asyncio.current_task() is not self._task:
+            self._task.cancel()
+        if evicted:
+            try:
+                await self.websocket.close()
+            except Exception:
+                pass
+        self._on_close(self, evicted)
@@ -0,0 +1,123 @@
+"""
+/api/ws 訂閱頻道
+客戶端送出：
+  {"type": "subscribe", "channels": ["tick", "race"], "symbols": ["APPLE"], "categories": ["FRUIT"]}
+  {"type": "unsubscribe", "channels": [...], "symbols": [...], "categories": [...]}
+頻道：tick（股價，可限定 symbols / categories，兩者皆空時為全部股票）、news（事件）、
+forecast、race、regimes、alert（只收到自己的到價提醒，需以 token 連線）。連線預設訂閱全部；第一次 subscribe 起只收到訂閱的內容。
+subscribe 帶 "replace": true 時整份取代目前的訂閱（切換頁面時使用）。
+
+廣播時依訂閱內容分組，每組只過濾、序列化一次。過濾後沒有內容的 delta 不送出，
+因此每則訊息帶 prev（這組上一則訊息的序號），客戶端以 prev 大於自己的序號判斷漏收。
+"""
+from dataclasses import dataclass, field
+from typing import FrozenSet
+
+CHANNELS = frozenset({"tick", "news", "forecast", "race", "regimes", "alert"})
+META_CHANNELS = {
+    "event": "news",
+    "forecast": "forecast",
+    "race": "race",
+    "market_regimes": "regimes",
+    "regime_durations": "regimes",
+}
+
+
+@dataclass(frozen=True)
+class Subscription:
+    channels: FrozenSet[str] = CHANNELS
+    symbols: FrozenSet[str] = field(default_factory=frozenset)
+    categories: FrozenSet[str] = field(default_factory=frozenset)
+    explicit: bool = False  # 是否已送過 subscribe（預設訂閱全部）
+
+    def update(self, request):
+        """套用 subscribe / unsubscribe 訊息，回傳新的訂閱（不合法的訊息回傳 None）"""
+        kind = request.get("type")
+        if kind not in ("subscribe", "unsubscribe"):
+            return None
+        channels = frozenset(request.get("channels") or ()) & CHANNELS
+        symbols = frozenset(request.get("symbols") or ())
+        categories = frozenset(request.get("categories") or ())
+        if kind == "subscribe":
+            if self.explicit and not request.get("replace"):
+                base = self
+            else:
+                base = Subscription(channels=frozenset(), explicit=True)
+            if symbols or categories:
+                channels |= {"tick"}
+            return Subscription(
+                channels=base.channels | channels,
+                symbols=base.symbols | symbols,
+                categories=base.categories | categories,
+                explicit=True
+            )
+        return Subscription(
+            channels=self.channels - channels,
+            symbols=self.symbols - symbols,
+            categories=self.categories - categories,
+            explicit=True
+        )
+
+    def wants_stock(self, symbol, category):
+        if "tick" not in self.channels:
+            return False
+        if not self.symbols and not self.categories:
+            return True
+        return symbol in self.symbols or category in self.categories
+
+
+ALL = Subscription()
+
+
+class ChannelFilter:
+    """依訂閱過濾廣播訊息；delta 只有 stock_id，由最近的 keyframe 對應 symbol / category"""
+
+    def __init__(self):
+        self._stocks = {}  # {stock_id: (symbol, category)}
+        self.index = {}  # {stock_id: schema 中的位置}（二進位 delta 使用）
+        self.day_opens = {}  # {stock_id: day_open}
+        self.schema = None  # [[stock_id, symbol], ...]（依 index 排列）
+
+    def observe(self, message):
+        """更新股票對照；股票清單變動（需要送出新的 schema）時回傳 True"""
+        kind = message.get("type")
+        if kind == "delta":
+            for row in message["s"]:
+                if len(row) > 2:
+                    self.day_opens[row[0]] = row[2]
+            return False
+        if kind != "tick":
+            return False
+        self._stocks = {s["id"]: (s["symbol"], s.get("category")) for s in message["stocks"]}
+        self.day_opens = {s["id"]: s["day_open"] for s in message["stocks"]}
+        ids = [s["id"] for s in message["stocks"]]
+        if self.schema is not None and [row[0] for row in self.schema] == ids:
+            return False
+        self.index = {stock_id: i for i, stock_id in enumerate(ids)}
+        self.schema = [[s["id"], s["symbol"]] for s in message["stocks"]]
+        return True
+
+    def apply(self, message, subscription):
+        """回傳這個訂閱要收到的訊息，沒有相關內容時回傳 None"""
+        if subscription == ALL:
+            return message
+        kind = message.get("type")
+        if kind == "tick":
+            filtered = {k: v for k, v in message.items() if k not in META_CHANNELS or META_CHANNELS[k] in subscription.channels}
+            filtered["stocks"] = [s for s in message["stocks"] if subscription.wants_stock(s["symbol"], s.get("category"))]
+            return filtered
+        if kind == "delta":
+            filtered = {k: v for k, v in message.items() if k in META_CHANNELS and META_CHANNELS[k] in subscription.channels}
+            rows = [row for row in message["s"] if self._wants(subscription, row[0])]
+            if not rows and not filtered:
+                return None
+            filtered.update(type="delta", seq=message["seq"], ts=message.get("ts"), s=rows)
+            return filtered
+        return message
+
+    def _wants(self, subscription, stock_id):
+        meta = self._stocks.get(stock_id)
+        if meta is None:
+            # 尚未收到 keyframe：只有訂閱全部股票時才能確定
+            return "tick" in subscription.channels and not subscription.symbols and not subscription.categories
+        return subscription.wants_stock(*meta)
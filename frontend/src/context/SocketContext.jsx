@@ -1,38 +1,88 @@
 import React, { createContext, useContext, useEffect, useState } from "react";
+import { toast } from "sonner";
+import { useLocation } from "react-router-dom";
 import { useAuth } from "./AuthContext";
+import { createTickDecoder } from "../utils/tickStream";
 
 const SocketContext = createContext();
 
+const ALL_CHANNELS = ["tick", "news", "forecast", "race", "regimes", "alert"];
+
+// 遊戲頁面不需要每秒的股價（保留新聞跑馬燈與到價提醒）
+const channelsForPath = (pathname) => {
+  if (pathname.startsWith("/race")) return ["news", "forecast", "race", "alert"];
+  if (pathname.startsWith("/slots") || pathname.startsWith("/blackjack")) return ["news", "forecast", "alert"];
+  return ALL_CHANNELS;
+};
+
 export const SocketProvider = ({ children }) => {
-  const { API_URL } = useAuth();
+  const { API_URL, user, token } = useAuth();
+  const userIdRef = React.useRef(null);
+  userIdRef.current = user?.id ?? null;
   const [socket, setSocket] = useState(null);
   const [marketData, setMarketData] = useState({ stocks: [], event: null });
   const [isConnected, setIsConnected] = useState(false);
   const [retry, setRetry] = useState(0);
+  const { pathname } = useLocation();
+  const channels = channelsForPath(pathname);
+  const channelsRef = React.useRef(channels);
+  channelsRef.current = channels;
+  // 重新連線時沿用，伺服器由最後的序號補送漏掉的 tick
+  const decoderRef = React.useRef(null);
+  if (!decoderRef.current) decoderRef.current = createTickDecoder();
 
   useEffect(() => {
-    // Determine WS URL
-    const wsUrl = API_URL.replace("http", "ws") + "/ws";
+    const decoder = decoderRef.current;
+    const connectedChannels = channelsRef.current.join(",");
+
+    // Determine WS URL（初始訂閱頻道；重新連線時帶最後的序號；登入時帶 token 以接收自己的到價提醒）
+    const lastSeq = decoder.seq();
+    const wsUrl = API_URL.replace("http", "ws") + `/ws?format=binary&channels=${connectedChannels}`
+      + (lastSeq !== null ? `&resume=${lastSeq}` : "")
+      + (token ? `&token=${encodeURIComponent(token)}` : "");
     
-    // Connect
+    // Connect（股價 delta 以二進位 frame 接收）
     const ws = new WebSocket(wsUrl);
+    ws.binaryType = "arraybuffer";
+
+    const applyMarket = ({ market, resync }) => {
+      if (market) {
+        // 未訂閱 tick 時保留最後的股價（Navbar 淨值仍需要）
+        const tickOn = channelsRef.current.includes("tick");
+        setMarketData(prev => ({
+            stocks: tickOn ? market.stocks : prev.stocks,
+            event: market.event || null,
+            race: market.race || null,
+            forecast: market.forecast || null
+        }));
+      } else if (resync) {
+        ws.send(JSON.stringify({ type: "resync" }));
+      }
+    };
 
     ws.onopen = () => {
       console.log("Connected to Market Stream");
       setIsConnected(true);
+      if (channelsRef.current.join(",") !== connectedChannels) {
+        // 連線期間切換了頁面
+        ws.send(JSON.stringify({ type: "subscribe", replace: true, channels: channelsRef.current }));
+      }
     };
 
     ws.onmessage = (event) => {
       try {
+        if (event.data instanceof ArrayBuffer) {
+            applyMarket(decoder.applyBinary(event.data));
+            return;
+        }
         const data = JSON.parse(event.data);
-        if (data.type === "tick") {
-            // Update market state
-            setMarketData({
-                stocks: data.stocks,
-                event: data.event || null,
-                race: data.race || null,
-                forecast: data.forecast || null
-            });
+        if (data.type === "tick" || data.type === "delta") {
+            // Update market state（keyframe 或差量）
+            applyMarket(decoder.apply(data));
+        } else if (data.type === "alert" && data.user_id === userIdRef.current) {
+            // 到價提醒
+            const dir = data.condition === "above" ? "漲破" : "跌破";
+            toast.info(`${data.symbol} ${dir} $${data.target_price}（目前 $${data.price}）`);
         }
       } catch (e) {
         console.error("WS Parse Error", e);
@@ -49,9 +99,19 @@ export const SocketProvider = ({ children }) => {
     setSocket(ws);
 
     return () => {
-        if (ws.readyState === 1) ws.close();
+        // 登入 / 登出換 token 時重新連線：主動關閉的連線不再排程自動重連
+        ws.onclose = null;
+        ws.close();
     };
-  }, [API_URL, retry]);
+  }, [API_URL, retry, token]);
+
+  // 切換頁面時更新訂閱頻道
+  const channelsKey = channels.join(",");
+  useEffect(() => {
+    if (socket && socket.readyState === WebSocket.OPEN) {
+      socket.send(JSON.stringify({ type: "subscribe", replace: true, channels: channelsKey.split(",") }));
+    }
+  }, [socket, channelsKey]);
 
   return (
     <SocketContext.Provider value={{ socket, isConnected, marketData }}>
@@ -4,6 +4,7 @@ import {
   Settings, Users, TrendingUp, Gamepad2, Calendar, BarChart3,
   ChevronDown, ChevronUp, RefreshCw, Save, RotateCcw
 } from "lucide-react";
+import { createTickDecoder } from "../utils/tickStream";
 
 // 使用環境變數，支援部署到任何環境
 const API_URL = import.meta.env.VITE_API_URL || "";
@@ -51,18 +52,24 @@ export default function AdminPage() {
   useEffect(() => {
     if (isAuthenticated) {
       const ws = new WebSocket(WS_URL);
+      const decoder = createTickDecoder();
       wsRef.current = ws;
       ws.onopen = () => setWsConnected(true);
       ws.onmessage = (event) => {
         try {
           const data = JSON.parse(event.data);
-          if (data.type === "tick") {
-            setMarket(prev => ({
-              ...prev,
-              market_regimes: data.market_regimes,
-              regime_durations: data.regime_durations,
-              stocks: data.stocks
-            }));
+          if (data.type === "tick" || data.type === "delta") {
+            const { market, resync } = decoder.apply(data);
+            if (market) {
+              setMarket(prev => ({
+                ...prev,
+                market_regimes: market.market_regimes,
+                regime_durations: market.regime_durations,
+                stocks: market.stocks
+              }));
+            } else if (resync) {
+              ws.send(JSON.stringify({ type: "resync" }));
+            }
           }
         } catch (err) {}
       };
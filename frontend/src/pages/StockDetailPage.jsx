@@ -319,21 +319,20 @@ export default function StockDetailPage() {
     const [loadingMore, setLoadingMore] = useState(false);
     const lastEventRef = React.useRef(null);
     const hasMoreHistory = React.useRef(true);
+    const nextCursor = React.useRef(null); // 後端回傳的分頁游標 (X-Next-Cursor)
 
     const handleLoadMore = async () => {
         if (loadingMore || !history.length || !hasMoreHistory.current) return;
         
         setLoadingMore(true);
         try {
-            const oldestTime = history[0].time;
-            // API expects unix timestamp for 'before'
-            const res = await axios.get(`${API_URL}/stocks/${id}/history`, { 
-                params: { 
-                    interval, 
-                    limit: 5000, 
-                    before: oldestTime 
-                } 
-            });
+            // Keyset pagination: cursor from the previous page, fall back to oldest candle time
+            const params = nextCursor.current
+                ? { interval, limit: 5000, cursor: nextCursor.current }
+                : { interval, limit: 5000, before: history[0].time };
+            const res = await axios.get(`${API_URL}/stocks/${id}/history`, { params });
+            nextCursor.current = res.headers["x-next-cursor"] || null;
+            if (!nextCursor.current) hasMoreHistory.current = false;
             
             if (res.data.length > 0) {
                 // Prepend data using functional update to avoid race conditions
@@ -380,6 +379,8 @@ export default function StockDetailPage() {
                 // Fetch History
                 const histRes = await axios.get(`${API_URL}/stocks/${id}/history`, { params: { interval } });
                 setHistory(histRes.data);
+                nextCursor.current = histRes.headers["x-next-cursor"] || null;
+                hasMoreHistory.current = true;
                 
                 // Fetch News
                 const newsRes = await axios.get(`${API_URL}/stocks/${id}/news`);
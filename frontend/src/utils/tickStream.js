@@ -0,0 +1,119 @@
+/**
+ * 行情串流解碼（/api/ws）
+ * keyframe（type: "tick"）帶完整內容；delta 只帶變動的股票 [id, price, day_open?]
+ * 與有變動的 event / forecast / race / regime 欄位。
+ * 伺服器依訂閱過濾後不送空的 delta，每則訊息的 prev 是同一訂閱上一則訊息的序號；
+ * prev 大於目前序號代表漏收，需要重新同步。
+ *
+ * 以 ?format=binary 連線時，只含股價的 delta 為二進位 frame（little-endian）：
+ *   header 20 bytes: version u8, flags u8（bit0：有 prev）, seq u32, prev u32, ts f64, count u16
+ *   record 10 bytes: index u16, price u32（分）, day_open u32（分）
+ * index 對照 keyframe 的 schema 欄位 [[id, symbol], ...]。
+ *
+ * 重新連線時沿用同一個解碼器，以 ?resume=<seq()> 連線：伺服器只補送漏掉的 delta，
+ * 無法補送時送出新的 keyframe。
+ */
+
+const META_FIELDS = ["event", "forecast", "race", "market_regimes", "regime_durations"];
+const BINARY_VERSION = 1;
+const HEADER_SIZE = 20;
+const RECORD_SIZE = 10;
+const PRICE_SCALE = 100;
+
+/**
+ * 解碼二進位 delta
+ * @param {ArrayBuffer} buffer
+ * @param {number[]} ids - schema 的 stock_id（依 index 排列）
+ * @returns {object} - 與 JSON delta 相同格式
+ */
+export const decodeBinaryDelta = (buffer, ids) => {
+    const view = new DataView(buffer);
+    if (view.getUint8(0) !== BINARY_VERSION) {
+        throw new Error(`unsupported tick frame version ${view.getUint8(0)}`);
+    }
+    const hasPrev = view.getUint8(1) & 1;
+    const count = view.getUint16(18, true);
+    const s = new Array(count);
+    for (let i = 0, offset = HEADER_SIZE; i < count; i++, offset += RECORD_SIZE) {
+        s[i] = [
+            ids[view.getUint16(offset, true)],
+            view.getUint32(offset + 2, true) / PRICE_SCALE,
+            view.getUint32(offset + 6, true) / PRICE_SCALE
+        ];
+    }
+    return {
+        type: "delta",
+        seq: view.getUint32(2, true),
+        prev: hasPrev ? view.getUint32(6, true) : null,
+        ts: view.getFloat64(10, true),
+        s
+    };
+};
+
+/**
+ * 建立解碼器
+ * @returns {{apply: function(object), applyBinary: function(ArrayBuffer), seq: function(): ?number}}
+ *   apply / applyBinary 回傳 {market, resync}：
+ *   market - 套用後的完整行情（無法套用時為 null）
+ *   resync - 需要送出 {type: "resync"} 取得 keyframe
+ */
+export const createTickDecoder = () => {
+    let seq = null;
+    let market = null;
+    let ids = null; // 二進位 delta 的 index 對照
+
+    const apply = (data) => {
+        if (data.type === "tick") {
+            if (data.schema) ids = data.schema.map((row) => row[0]);
+            seq = data.seq ?? null;
+            market = { stocks: data.stocks };
+            META_FIELDS.forEach((key) => { market[key] = data[key] ?? null; });
+            return { market, resync: false };
+        }
+        if (data.type !== "delta") {
+            return { market: null, resync: false };
+        }
+        if (seq === null) {
+            // 等待 keyframe（已要求過重新同步）
+            return { market: null, resync: false };
+        }
+        if (data.seq <= seq) {
+            // 已包含在 keyframe 中
+            return { market: null, resync: false };
+        }
+        const prev = "prev" in data ? data.prev : data.seq - 1;
+        if (prev !== null && prev > seq) {
+            seq = null;
+            return { market: null, resync: true };
+        }
+
+        seq = data.seq;
+        const changes = new Map(data.s.map((row) => [row[0], row]));
+        // 未變動的股票保留原物件，方便元件略過重繪
+        const stocks = changes.size === 0 ? market.stocks : market.stocks.map((stock) => {
+            const row = changes.get(stock.id);
+            if (!row) return stock;
+            return { ...stock, price: row[1], day_open: row.length > 2 ? row[2] : stock.day_open };
+        });
+        market = { ...market, stocks };
+        META_FIELDS.forEach((key) => {
+            if (key in data) market[key] = data[key];
+        });
+        return { market, resync: false };
+    };
+
+    const applyBinary = (buffer) => {
+        if (!ids) {
+            // 尚未收到 schema：要求附 schema 的 keyframe（只要求一次）
+            const resync = seq !== null;
+            seq = null;
+            return { market: null, resync };
+        }
+        return apply(decodeBinaryDelta(buffer, ids));
+    };
+
+    // 目前已套用的序號（重新連線的 resume），等待 keyframe 時為 null
+    const currentSeq = () => seq;
+
+    return { apply, applyBinary, seq: currentSeq };
+};